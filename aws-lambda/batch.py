@@ -0,0 +1,83 @@
+""" batch.py
+Helpers for Lambda handlers that take a batch of records (from an SQS queue,
+a Kinesis stream, or simply a list of events) as well as single events.
+Records are grouped by device and put in timestamp order, so that each device
+can be brought up to date with a single shadow write. Failed records are
+reported back individually, in the format SQS / Kinesis triggers expect.
+"""
+
+import base64
+import json
+
+def is_batch(event):
+    """ Whether the event is a batch of records, rather than a single event """
+    return isinstance(event, list) or (isinstance(event, dict) and "Records" in event)
+
+def iter_records(event):
+    """ (record id, payload) for each record in the batch. Records that cannot
+    be decoded are given a payload of None. """
+    if isinstance(event, list):
+        for _index, _record in enumerate(event):
+            yield str(_index), _record
+        return
+    for _index, _record in enumerate(event["Records"]):
+        # Taken before decoding, so that an unreadable record is still reported
+        # by the id its trigger knows it by
+        _record_id = _get_record_id(_record, _index)
+        try:
+            if "body" in _record:
+                # SQS
+                yield _record_id, json.loads(_record["body"])
+            elif "kinesis" in _record:
+                yield _record_id, json.loads(base64.b64decode(_record["kinesis"]["data"]))
+            else:
+                yield _record_id, _record
+        except (KeyError, ValueError, TypeError) as ex:
+            print("Unreadable record", _record_id, ex)
+            yield _record_id, None
+
+def _get_record_id(record, index):
+    """ SQS message id, or Kinesis sequence number, falling back on the
+    record's position in the batch """
+    try:
+        if "messageId" in record:
+            return record["messageId"]
+        if "kinesis" in record:
+            return record["kinesis"]["sequenceNumber"]
+    except (KeyError, TypeError):
+        pass
+    return str(index)
+
+def group_by_device(event, device_key, timestamp_key):
+    """ Records grouped by device, each group in timestamp order, as a dict of
+    device to list of (record id, payload). Also returns the ids of records that
+    could not be grouped. """
+    _groups = {}
+    _failed = []
+    _timestamps = {}
+    for _record_id, _payload in iter_records(event):
+        try:
+            _device = device_key(_payload)
+        except (KeyError, TypeError):
+            print("Record", _record_id, "has no device")
+            _failed.append(_record_id)
+            continue
+        try:
+            _timestamps[_record_id] = str(timestamp_key(_payload) or "")
+        except (KeyError, TypeError, ValueError):
+            print("Record", _record_id, "has an unreadable timestamp")
+            _failed.append(_record_id)
+            continue
+        _groups.setdefault(_device, []).append((_record_id, _payload))
+    for _records in _groups.values():
+        # Stable sort, so records with equal (or no) timestamps keep their order
+        _records.sort(key=lambda _record: _timestamps[_record[0]])
+    return _groups, _failed
+
+def failure_response(failed_record_ids):
+    """ Partial batch response, so that only the failed records are retried """
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": _record_id} for _record_id in failed_record_ids
+        ]
+    }
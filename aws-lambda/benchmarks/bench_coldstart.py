@@ -0,0 +1,185 @@
+""" bench_coldstart.py
+Cold start profile of the Lambda functions: module import time, first
+invocation, a warm invocation and the AWS clients each one built. Every run
+is a fresh Python process, so nothing is cached between runs.
+
+boto3 is replaced by the in-memory stand-in in benchmarks/standins, whose
+import, client construction and API call costs can be set (in ms) to imitate
+real boto3. With --eager, boto3 is imported and every client the function
+could use is built before the module is loaded, as the functions used to do
+(the function then uses those clients).
+
+Run from the aws-lambda directory: python benchmarks/bench_coldstart.py
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+_BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+_LAMBDA_DIR = os.path.dirname(_BENCHMARKS_DIR)
+_STANDINS_DIR = os.path.join(_BENCHMARKS_DIR, "standins")
+
+ENVIRONMENT = {
+    "AWS_SES_SENDER": "tracker@example.com",
+    "AWS_SES_RECIPIENT": "owner@example.com",
+    "AWS_REGION_NAME": "eu-west-1",
+    "AWS_COGNITO_USERPOOL_ID": "eu-west-1_standin",
+}
+
+_REGION = {"region_name": ENVIRONMENT["AWS_REGION_NAME"]}
+# Clients each function could need (as it asks for them), built up front with --eager
+EAGER_CLIENTS = {
+    "riot-check-proximity": (
+        ("client", "iot-data", _REGION), ("client", "ses", _REGION),
+        ("client", "cognito-idp", _REGION), ("resource", "dynamodb", {"endpoint_url": None}),
+    ),
+    "riot-iotevents-status": (("client", "iot-data", _REGION), ("client", "ses", _REGION)),
+    "riot-update-deviceshadow": (("client", "iot-data", {}),),
+}
+
+FUNCTIONS = tuple(EAGER_CLIENTS)
+
+def _position_event(latitude, longitude):
+    """ Tracker position, as from the TTN integration """
+    return {
+        "dev_id": "riot-tracker-1",
+        "timestamp": "2020-05-01T10:00:00Z",
+        "position_lat": latitude,
+        "position_long": longitude,
+        "total_distance": 4.2,
+        "total_time": 5400,
+    }
+
+def _status_event(state_name):
+    """ IoT Events detector state change """
+    return {"payload": {"detector": {"keyValue": "riot-tracker-1"}, "state": {"stateName": state_name}}}
+
+# First and second (warm) invocation of each function
+EVENTS = {
+    # Far from any geo point, which is the usual case
+    "riot-check-proximity": (_position_event(51.50, -3.20), _position_event(51.51, -3.21)),
+    "riot-iotevents-status": (_status_event("responding"), _status_event("not-responding")),
+    "riot-update-deviceshadow": (_position_event(51.50, -3.20), _position_event(51.51, -3.21)),
+}
+
+def _seed(state, geo_points, users):
+    """ Data for the stand-in services """
+    state["shadows"]["riot-tracker-1"] = {
+        "state": {"reported": dict(_position_event(51.50, -3.20), current_location="")},
+        "version": 1,
+    }
+    state["tables"]["riot-geo-data"] = [
+        {
+            "location": "Landmark " + str(_index),
+            "latitude": 53.0 + (_index % 100) * 0.01,
+            "longitude": -2.0 + (_index // 100) * 0.01,
+            "approach_distance_km": 0.5,
+        } for _index in range(geo_points)
+    ]
+    state["users"] = [
+        {"Attributes": [{"Name": "email", "Value": "user" + str(_index) + "@example.com"}]}
+        for _index in range(users)
+    ]
+
+def run_child(function, eager, geo_points, users):
+    """ One cold start, in this (fresh) process. Returns the measurements. """
+    sys.path[:0] = [_STANDINS_DIR, _LAMBDA_DIR]
+    os.environ.update(ENVIRONMENT)
+    _start = time.perf_counter()
+    if eager:
+        import clients  # pylint: disable=import-outside-toplevel
+        for _kind, _service_name, _kwargs in EAGER_CLIENTS[function]:
+            getattr(clients, "get_" + _kind)(_service_name, **_kwargs)
+    _spec = importlib.util.spec_from_file_location(
+        function.replace("-", "_"), os.path.join(_LAMBDA_DIR, function + ".py")
+    )
+    _module = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(_module)
+    _imported = time.perf_counter()
+    boto3 = sys.modules.get("boto3") or __import__("boto3")
+    _seed(boto3.STATE, geo_points, users)
+    _first_event, _warm_event = EVENTS[function]
+    _clients_at_import = len(boto3.STATE["clients_built"])
+    _invoke_start = time.perf_counter()
+    _module.lambda_handler(_first_event, None)
+    _first = time.perf_counter()
+    _first_calls = len(boto3.STATE["calls"])
+    _module.lambda_handler(_warm_event, None)
+    _warm = time.perf_counter()
+    return {
+        "import_ms": (_imported - _start) * 1000,
+        "first_invocation_ms": (_first - _invoke_start) * 1000,
+        "warm_invocation_ms": (_warm - _first) * 1000,
+        "clients_at_import": _clients_at_import,
+        "clients_built": len(boto3.STATE["clients_built"]),
+        "first_invocation_calls": _first_calls,
+        "warm_invocation_calls": len(boto3.STATE["calls"]) - _first_calls,
+    }
+
+def bench_function(function, args, eager):
+    """ Median of several cold starts, each in a new process """
+    _environment = dict(
+        os.environ,
+        STANDIN_IMPORT_MS=str(args.import_ms),
+        STANDIN_CLIENT_MS=str(args.client_ms),
+        STANDIN_CALL_MS=str(args.call_ms),
+    )
+    _runs = []
+    for _ in range(args.runs):
+        _command = [
+            sys.executable, os.path.abspath(__file__), "--child", function,
+            "--geo-points", str(args.geo_points), "--users", str(args.users),
+        ]
+        if eager:
+            _command.append("--eager")
+        _output = subprocess.run(
+            _command, env=_environment, check=True, stdout=subprocess.PIPE, universal_newlines=True
+        ).stdout
+        # The functions print as they go; the measurements are the last line
+        _runs.append(json.loads(_output.strip().splitlines()[-1]))
+    _result = {"function": function, "eager": eager, "runs": args.runs}
+    for _key in _runs[0]:
+        _result[_key] = round(statistics.median(_run[_key] for _run in _runs), 2)
+    return _result
+
+def main():
+    """ Profile each function's cold start, printing JSON results """
+    _parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    _parser.add_argument("--runs", type=int, default=5)
+    _parser.add_argument("--function", choices=FUNCTIONS, action="append")
+    _parser.add_argument("--import-ms", type=float, default=300.0,
+                         help="Simulated boto3 import time")
+    _parser.add_argument("--client-ms", type=float, default=60.0,
+                         help="Simulated time to build a client")
+    _parser.add_argument("--call-ms", type=float, default=20.0,
+                         help="Simulated latency of an API call")
+    _parser.add_argument("--geo-points", type=int, default=1000)
+    _parser.add_argument("--users", type=int, default=120)
+    _parser.add_argument("--eager", action="store_true",
+                         help="Also profile building every client up front")
+    _parser.add_argument("--child", choices=FUNCTIONS, help=argparse.SUPPRESS)
+    _args = _parser.parse_args()
+    if _args.child:
+        _measurements = run_child(_args.child, _args.eager, _args.geo_points, _args.users)
+        print(json.dumps(_measurements))
+        return
+    _results = []
+    for _function in _args.function or FUNCTIONS:
+        _results.append(bench_function(_function, _args, False))
+        if _args.eager:
+            _results.append(bench_function(_function, _args, True))
+    print(json.dumps({
+        "import_ms": _args.import_ms,
+        "client_ms": _args.client_ms,
+        "call_ms": _args.call_ms,
+        "results": _results,
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
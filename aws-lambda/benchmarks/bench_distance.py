@@ -0,0 +1,97 @@
+""" bench_distance.py
+Accuracy and speed of the fast distance mode (haversine.distance and
+haversine.ReferencePoint) against haversine, across latitudes. Fails if the
+fast mode's error exceeds haversine.FAST_DISTANCE_MAX_ERROR.
+
+Run from the aws-lambda directory: python benchmarks/bench_distance.py
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import haversine    # pylint: disable=wrong-import-position
+
+LATITUDES = (0, 30, 50, 60, 70, 80)
+
+def _pairs(latitude, min_distance_km, max_distance_km, count, seed):
+    """ Pairs of points around latitude, min to max_distance_km apart in random directions """
+    _random = random.Random(seed)
+    _pairs = []
+    for _ in range(count):
+        _bearing = _random.uniform(0, 2 * math.pi)
+        _distance = _random.uniform(min_distance_km, max_distance_km)
+        _lat_delta = _distance / 111.195 * math.cos(_bearing)
+        _long_delta = _distance / (111.195 * math.cos(math.radians(latitude))) * math.sin(_bearing)
+        _origin = (latitude, _random.uniform(-180, 180))
+        _pairs.append((_origin, (_origin[0] + _lat_delta, _origin[1] + _long_delta)))
+    return _pairs
+
+def bench_latitude(latitude, count, repeat):
+    """ Worst error, and time per call, at one latitude """
+    _short = _pairs(latitude, 0.001, haversine.FAST_DISTANCE_LIMIT_KM, count, latitude)
+    # Beyond the limit, where haversine is used (so the error should be nil)
+    _long = _pairs(
+        latitude,
+        1.1 * haversine.FAST_DISTANCE_LIMIT_KM,
+        10 * haversine.FAST_DISTANCE_LIMIT_KM,
+        count,
+        latitude + 1
+    )
+    _worst_short = 0.0
+    _worst_long = 0.0
+    for _pairs_list, _is_short in ((_short, True), (_long, False)):
+        for _point1, _point2 in _pairs_list:
+            _expected = haversine.haversine(_point1, _point2)
+            _error = abs(haversine.distance(_point1, _point2) - _expected) / _expected
+            if _is_short:
+                _worst_short = max(_worst_short, _error)
+            else:
+                _worst_long = max(_worst_long, _error)
+    if _worst_short > haversine.FAST_DISTANCE_MAX_ERROR:
+        raise AssertionError(
+            "Error " + str(_worst_short) + " at latitude " + str(latitude) + " exceeds bound"
+        )
+    # Repeated measurements from the same point, e.g. consecutive GPS fixes
+    _references = [(haversine.ReferencePoint(_point1), _point2) for _point1, _point2 in _short]
+
+    def _time(statement):
+        return min(timeit.repeat(statement, number=1, repeat=repeat)) / count * 1e9
+
+    return {
+        "latitude": latitude,
+        "max_relative_error_short": _worst_short,
+        "max_relative_error_long": _worst_long,
+        "haversine_ns": round(_time(
+            lambda: [haversine.haversine(_p1, _p2) for _p1, _p2 in _short]
+        )),
+        "distance_ns": round(_time(
+            lambda: [haversine.distance(_p1, _p2) for _p1, _p2 in _short]
+        )),
+        "reference_point_ns": round(_time(
+            lambda: [_reference.distance(_p2) for _reference, _p2 in _references]
+        )),
+    }
+
+def main():
+    """ Run across all latitudes, printing JSON results """
+    _parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    _parser.add_argument("--pairs", type=int, default=20000)
+    _parser.add_argument("--repeat", type=int, default=5)
+    _args = _parser.parse_args()
+    print(json.dumps({
+        "fast_distance_limit_km": haversine.FAST_DISTANCE_LIMIT_KM,
+        "fast_distance_max_latitude": haversine.FAST_DISTANCE_MAX_LATITUDE,
+        "fast_distance_max_error": haversine.FAST_DISTANCE_MAX_ERROR,
+        "latitudes": [
+            bench_latitude(_latitude, _args.pairs, _args.repeat) for _latitude in LATITUDES
+        ],
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+""" bench_haversine.py
+Benchmark of the vectorised haversine functions against the scalar haversine
+in a Python loop, for a proximity style check (one position against thousands
+of geo points) and a long GPX style track. Also checks results agree to within
+the stated tolerance.
+
+Run from the aws-lambda directory: python benchmarks/bench_haversine.py
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import haversine    # pylint: disable=wrong-import-position
+
+# Relative tolerance the vectorised functions are stated to meet
+TOLERANCE = 1e-9
+
+def _random_points(count, seed):
+    """ Points scattered over the UK """
+    _random = random.Random(seed)
+    return [(_random.uniform(50.0, 58.0), _random.uniform(-6.0, 1.5)) for _ in range(count)]
+
+def _random_track(count, seed):
+    """ A random walk with ~10m steps, like a GPX track at 1 fix per few seconds """
+    _random = random.Random(seed)
+    _lat, _long = 51.88, -3.43
+    _track = []
+    for _ in range(count):
+        _lat += _random.uniform(-1e-4, 1e-4)
+        _long += _random.uniform(-1.5e-4, 1.5e-4)
+        _track.append((_lat, _long))
+    return _track
+
+def _best_of(statement, repeat):
+    """ Best time in seconds for a single run of statement """
+    return min(timeit.repeat(statement, number=1, repeat=repeat))
+
+def _check(scalar, vector):
+    """ Worst relative difference, raising if outside tolerance """
+    _worst = 0.0
+    for _expected, _actual in zip(scalar, vector):
+        if _expected:
+            _worst = max(_worst, abs(_actual - _expected) / _expected)
+    if _worst > TOLERANCE:
+        raise AssertionError("Relative error " + str(_worst) + " exceeds " + str(TOLERANCE))
+    return _worst
+
+def bench_one_to_many(count, repeat):
+    """ One position against many geo points """
+    _points = _random_points(count, 1)
+    _position = (51.88, -3.43)
+    _prepared = haversine.prepare_points(_points)
+    _scalar = [haversine.haversine(_point, _position) for _point in _points]
+    _vector = haversine.haversine_one_to_many(_position, _prepared)
+    _scalar_s = _best_of(
+        lambda: [haversine.haversine(_point, _position) for _point in _points], repeat
+    )
+    _vector_s = _best_of(lambda: haversine.haversine_one_to_many(_position, _prepared), repeat)
+    return {
+        "points": count,
+        "scalar_ms": round(_scalar_s * 1000, 3),
+        "vector_ms": round(_vector_s * 1000, 3),
+        "speedup": round(_scalar_s / _vector_s, 1),
+        "max_relative_error": _check(_scalar, _vector),
+    }
+
+def bench_track(count, repeat):
+    """ Cumulative distance along a long track """
+    _track = _random_track(count, 2)
+
+    def _scalar_track():
+        _total = 0.0
+        _cumulative = [0.0]
+        for _index in range(1, len(_track)):
+            _total += haversine.haversine(_track[_index - 1], _track[_index])
+            _cumulative.append(_total)
+        return _cumulative
+
+    _scalar = _scalar_track()
+    _vector = haversine.haversine_track(_track)
+    _scalar_s = _best_of(_scalar_track, repeat)
+    _vector_s = _best_of(lambda: haversine.haversine_track(_track), repeat)
+    # Conversion from a list of tuples dominates; show the cost without it too
+    _prepared = haversine.prepare_points(_track)
+    _prepared_s = _best_of(lambda: haversine.haversine_track(_prepared), repeat)
+    return {
+        "points": count,
+        "scalar_ms": round(_scalar_s * 1000, 3),
+        "vector_ms": round(_vector_s * 1000, 3),
+        "vector_prepared_ms": round(_prepared_s * 1000, 3),
+        "speedup": round(_scalar_s / _vector_s, 1),
+        "speedup_prepared": round(_scalar_s / _prepared_s, 1),
+        "max_relative_error": _check(_scalar, _vector),
+    }
+
+def main():
+    """ Run all benchmarks, printing JSON results """
+    _parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    _parser.add_argument("--points", type=int, default=5000, help="geo points")
+    _parser.add_argument("--track", type=int, default=100000, help="track points")
+    _parser.add_argument("--repeat", type=int, default=5)
+    _args = _parser.parse_args()
+    print(json.dumps({
+        "tolerance": TOLERANCE,
+        "one_to_many": bench_one_to_many(_args.points, _args.repeat),
+        "track": bench_track(_args.track, _args.repeat),
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+""" boto3.py
+Local, in-memory stand-in for the parts of boto3 the Lambda functions use:
+IoT thing shadows (with versions and delta merging), DynamoDB table scans,
+Cognito list_users, SES send_email and SQS send_message. Put this directory first on sys.path.
+
+The time real boto3 spends importing, building clients and making calls can
+be imitated with the STANDIN_IMPORT_MS, STANDIN_CLIENT_MS and STANDIN_CALL_MS
+environment variables. STATE holds the data, and counts what was used.
+"""
+
+import io
+import json
+import os
+import time
+from botocore.exceptions import ClientError
+
+def _delay(variable):
+    """ Sleep for the number of milliseconds in an environment variable """
+    _delay_ms = float(os.environ.get(variable, "0"))
+    if _delay_ms:
+        time.sleep(_delay_ms / 1000.0)
+
+_delay("STANDIN_IMPORT_MS")
+
+STATE = {
+    "shadows": {},
+    "tables": {},
+    "users": [],
+    "emails": [],
+    "messages": [],
+    "clients_built": [],
+    "calls": [],
+}
+
+class _Client():
+    """ Base for stand-in clients, counting calls """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, service_name):
+        """ Building a client takes a while in real boto3 """
+        _delay("STANDIN_CLIENT_MS")
+        self.service_name = service_name
+        STATE["clients_built"].append(service_name)
+
+    def _call(self, operation):
+        """ Count (and optionally delay) each API call """
+        _delay("STANDIN_CALL_MS")
+        STATE["calls"].append(self.service_name + "." + operation)
+
+class _IotDataClient(_Client):
+    """ iot-data: thing shadows """
+
+    def get_thing_shadow(self, thingName):
+        """ Full shadow document """
+        # pylint: disable=invalid-name
+        self._call("get_thing_shadow")
+        if thingName not in STATE["shadows"]:
+            raise ClientError(
+                {"Error": {"Code": "ResourceNotFoundException", "Message": "No shadow exists"}},
+                "GetThingShadow"
+            )
+        return {"payload": io.BytesIO(json.dumps(STATE["shadows"][thingName]).encode())}
+
+    def update_thing_shadow(self, thingName, payload):
+        """ Merge reported state, honouring the version if one is given """
+        # pylint: disable=invalid-name
+        self._call("update_thing_shadow")
+        _update = json.loads(payload)
+        _document = STATE["shadows"].setdefault(
+            thingName, {"state": {"reported": {}}, "version": 0}
+        )
+        if "version" in _update and _update["version"] != _document["version"]:
+            raise ClientError(
+                {"Error": {"Code": "ConflictException", "Message": "Version conflict"}},
+                "UpdateThingShadow"
+            )
+        _merge(_document["state"]["reported"], _update["state"].get("reported", {}))
+        _document["version"] += 1
+        return {"payload": io.BytesIO(json.dumps(
+            {"state": _update["state"], "version": _document["version"]}
+        ).encode())}
+
+class _SesClient(_Client):
+    """ ses: emails are kept, not sent """
+
+    def send_email(self, Source, Destination, Message):
+        """ Record the email """
+        # pylint: disable=invalid-name
+        self._call("send_email")
+        _recipients = sum((Destination.get(_field, []) for _field in
+                           ("ToAddresses", "CcAddresses", "BccAddresses")), [])
+        if len(_recipients) > 50:
+            raise ClientError(
+                {"Error": {"Code": "InvalidParameterValue", "Message": "Too many recipients"}},
+                "SendEmail"
+            )
+        STATE["emails"].append(
+            {"source": Source, "destination": Destination, "subject": Message["Subject"]["Data"]}
+        )
+        return {"MessageId": "standin-" + str(len(STATE["emails"]))}
+
+class _SqsClient(_Client):
+    """ sqs: messages are kept, not queued """
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0):
+        """ Record the message """
+        # pylint: disable=invalid-name
+        self._call("send_message")
+        if not 0 <= DelaySeconds <= 900:
+            raise ClientError(
+                {"Error": {"Code": "InvalidParameterValue", "Message": "DelaySeconds out of range"}},
+                "SendMessage"
+            )
+        STATE["messages"].append(
+            {"queue_url": QueueUrl, "body": MessageBody, "delay_seconds": DelaySeconds}
+        )
+        return {"MessageId": "standin-" + str(len(STATE["messages"]))}
+
+class _CognitoIdpClient(_Client):
+    """ cognito-idp: users, paginated """
+
+    def list_users(self, UserPoolId, AttributesToGet=None, Limit=60, PaginationToken=None):
+        """ One page of users """
+        # pylint: disable=invalid-name,unused-argument
+        self._call("list_users")
+        _start = int(PaginationToken or 0)
+        _response = {"Users": STATE["users"][_start:_start + Limit]}
+        if _start + Limit < len(STATE["users"]):
+            _response["PaginationToken"] = str(_start + Limit)
+        return _response
+
+class _DynamoDbResource(_Client):
+    """ dynamodb resource: tables, scanned a page at a time """
+
+    def Table(self, name):
+        """ Table object """
+        # pylint: disable=invalid-name
+        return _Table(self, name)
+
+class _Table():
+    """ DynamoDB table """
+    # pylint: disable=too-few-public-methods
+    PAGE_SIZE = 100
+
+    def __init__(self, resource, name):
+        """ Table rows live in STATE["tables"] """
+        self.resource = resource
+        self.name = name
+
+    def scan(self, ExclusiveStartKey=None):
+        """ One page of items """
+        # pylint: disable=invalid-name,protected-access
+        self.resource._call("scan")
+        _items = STATE["tables"].get(self.name, [])
+        _start = int(ExclusiveStartKey["index"]) if ExclusiveStartKey else 0
+        _response = {"Items": list(_items[_start:_start + self.PAGE_SIZE])}
+        if _start + self.PAGE_SIZE < len(_items):
+            _response["LastEvaluatedKey"] = {"index": _start + self.PAGE_SIZE}
+        return _response
+
+_CLIENT_CLASSES = {
+    "iot-data": _IotDataClient,
+    "ses": _SesClient,
+    "cognito-idp": _CognitoIdpClient,
+    "sqs": _SqsClient,
+}
+
+def client(service_name, **kwargs):
+    """ Stand-in for boto3.client """
+    # pylint: disable=unused-argument
+    return _CLIENT_CLASSES[service_name](service_name)
+
+def resource(service_name, **kwargs):
+    """ Stand-in for boto3.resource (DynamoDB only) """
+    # pylint: disable=unused-argument
+    if service_name != "dynamodb":
+        raise ValueError("No stand-in for resource " + service_name)
+    return _DynamoDbResource(service_name)
+
+def _merge(document, changes):
+    """ Shadow merge: maps merged, None deletes, everything else replaced """
+    for _key, _value in changes.items():
+        if _value is None:
+            document.pop(_key, None)
+        elif isinstance(_value, dict) and isinstance(document.get(_key), dict):
+            _merge(document[_key], _value)
+        else:
+            document[_key] = _value
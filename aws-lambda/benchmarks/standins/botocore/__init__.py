@@ -0,0 +1 @@
+""" botocore stand-in, see boto3.py alongside """
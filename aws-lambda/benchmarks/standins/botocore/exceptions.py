@@ -0,0 +1,13 @@
+""" botocore.exceptions stand-in """
+
+class ClientError(Exception):
+    """ Same shape as botocore's: error details are in .response["Error"] """
+
+    def __init__(self, error_response, operation_name):
+        """ Keep the response, as handlers read the error code / message from it """
+        super().__init__(
+            "An error occurred (" + error_response["Error"]["Code"] + ") when calling the " +
+            operation_name + " operation: " + error_response["Error"]["Message"]
+        )
+        self.response = error_response
+        self.operation_name = operation_name
@@ -0,0 +1,39 @@
+""" clients.py
+Boto3 clients and resources for the Lambda functions, built on first use and
+then kept for as long as the Lambda container stays warm. Neither boto3 nor
+botocore is imported until it is needed, so a cold start only pays for the
+clients that the invocation actually uses.
+
+botocore's ClientError is available as clients.ClientError, also imported on
+first use. It can be used in except clauses, which are only evaluated once an
+exception is being handled.
+"""
+
+_CLIENTS = {}
+
+def get_client(service_name, **kwargs):
+    """ Memoised boto3.client(service_name, **kwargs) """
+    return _get("client", service_name, kwargs)
+
+def get_resource(service_name, **kwargs):
+    """ Memoised boto3.resource(service_name, **kwargs) """
+    return _get("resource", service_name, kwargs)
+
+def reset():
+    """ Forget all clients, e.g. to simulate a cold start """
+    _CLIENTS.clear()
+
+def _get(kind, service_name, kwargs):
+    """ Build a client or resource, unless an identical one exists already """
+    _key = (kind, service_name, tuple(sorted(kwargs.items())))
+    if _key not in _CLIENTS:
+        import boto3    # pylint: disable=import-outside-toplevel
+        _CLIENTS[_key] = getattr(boto3, kind)(service_name, **kwargs)
+    return _CLIENTS[_key]
+
+def __getattr__(name):
+    """ Lazy module attributes (Python 3.7+) """
+    if name == "ClientError":
+        from botocore.exceptions import ClientError     # pylint: disable=import-outside-toplevel
+        return ClientError
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
@@ -1,82 +1,181 @@
 """ riot-check-proximity.py
 Lambda function to check if current GPS location is within the boundaries
 of a known location stored in DynamoDB. Updates device's shadow document
-with location information, and notifies all users registered in Cognito.
+with location information (read and written at most once per event), and
+notifies all users registered in Cognito.
+Geo points (in a spatial index) and the Cognito users to notify are cached
+across warm invocations, as are AWS clients (which are only built when first
+needed). Also accepts a batch of records, which are applied
+per device in timestamp order, with one shadow write per device.
+Arrival events from devices with their own geofence are trusted, without
+checking the distance again.
 """
 
 import os
-import json
-import boto3
-from botocore.exceptions import ClientError
-import haversine
+import time
+import clients
+import geoindex
+import batch
+from shadow import ThingShadow
 
 # Environment variables for AWS parameters
 AWS_SES_SENDER = os.environ["AWS_SES_SENDER"]
 AWS_REGION = os.environ["AWS_REGION_NAME"]
 AWS_COGNITO_USERPOOL_ID = os.environ["AWS_COGNITO_USERPOOL_ID"]
-# Boto3 clients for AWS resources
-AWS_SES_CLIENT = boto3.client("ses", region_name=AWS_REGION)
-AWS_IOT_CLIENT = boto3.client("iot-data", region_name=AWS_REGION)
-AWS_COGNITO_IDP_CLIENT = boto3.client("cognito-idp", region_name=AWS_REGION)
-AWS_DYNAMODB_CLIENT = boto3.resource("dynamodb")
+AWS_DYNAMODB_GEO_TABLE = os.environ.get("AWS_DYNAMODB_GEO_TABLE", "riot-geo-data")
+# Set to use a local DynamoDB (e.g. http://localhost:8000) instead
+AWS_DYNAMODB_ENDPOINT = os.environ.get("AWS_DYNAMODB_ENDPOINT")
+# How long cached geo points are used for, before being read again
+GEO_DATA_TTL_S = int(os.environ.get("GEO_DATA_TTL_S", "300"))
+# How long the cached email addresses of Cognito users are used for
+COGNITO_USERS_TTL_S = int(os.environ.get("COGNITO_USERS_TTL_S", "900"))
+# Most users Cognito returns per list_users page
+COGNITO_PAGE_SIZE = 60
+# Most recipients SES accepts per message
+AWS_SES_MAX_RECIPIENTS = 50
+# Geo point index, kept for as long as the Lambda container stays warm
+_GEO_INDEX_CACHE = {"index": None, "loaded": 0}
+_RECIPIENTS_CACHE = {"email_addresses": None, "loaded": 0}
 
 def lambda_handler(event, context):
     """ Main Lambda function """
-    thing_id = event["dev_id"]
+    if batch.is_batch(event):
+        return handle_batch(event)
+    thing_shadow = ThingShadow(_iot_client(), event["dev_id"])
+    check_proximity(thing_shadow, event)
+    # All changes from this event in a single update
+    thing_shadow.commit()
+    return None
+
+def handle_batch(event):
+    """ Check each device's records in timestamp order against a single read of
+    its shadow, then write all of its changes at once """
+    _groups, _failed = batch.group_by_device(
+        event,
+        lambda _payload: _payload["dev_id"],
+        lambda _payload: _payload.get("timestamp")
+    )
+    for _dev_id, _records in _groups.items():
+        thing_shadow = ThingShadow(_iot_client(), _dev_id)
+        _applied = []
+        for _record_id, _payload in _records:
+            try:
+                check_proximity(thing_shadow, _payload)
+            except (KeyError, TypeError, ValueError, clients.ClientError) as ex:
+                print("Record", _record_id, "failed:", ex)
+                _failed.append(_record_id)
+            else:
+                _applied.append(_record_id)
+        try:
+            thing_shadow.commit()
+        except clients.ClientError as ex:
+            print("Shadow update of", _dev_id, "failed:", ex)
+            _failed.extend(_applied)
+    print("Checked", len(_groups), "devices,", len(_failed), "failed records")
+    return batch.failure_response(_failed)
+
+def check_proximity(thing_shadow, event):
+    """ Check a single position against nearby geo points, making any changes
+    to the (not yet written) shadow. Devices that check positions themselves
+    (the brick) send arrival events, which are trusted, and mark their other
+    positions as already checked. """
+    if event.get("event") == "arrival":
+        geo_point = get_geo_index().find("location", event["geo_location"])
+        if geo_point is None:
+            print("Arrival at unknown location", event["geo_location"])
+            return
+        arrive(thing_shadow, geo_point, event)
+        return
+    if event.get("geofence") == "edge":
+        return
     current_position = (event["position_lat"], event["position_long"])
-    current_shadow = get_thing_shadow(thing_id)
-    table = AWS_DYNAMODB_CLIENT.Table("riot-geo-data")
-    geo_points = table.scan()["Items"]
-    for geo_point in geo_points:
-        _distance_km = haversine.haversine(
-            (geo_point["latitude"], geo_point["longitude"]),
-            current_position
+    # Only geo points close enough to be within their approach distance
+    for geo_point, _distance_km in get_geo_index().nearby(current_position):
+        arrive(thing_shadow, geo_point, event)
+
+def arrive(thing_shadow, geo_point, event):
+    """ Notify users and record the visit, unless already at the geo point """
+    if str(geo_point["location"]) != str(thing_shadow.get("current_location", "")):
+        send_notify_email(geo_point, thing_shadow.state)
+        thing_shadow.set("current_location", geo_point["location"])
+        mark_visited(thing_shadow, geo_point["location"], event.get("timestamp"))
+
+def mark_visited(thing_shadow, location, timestamp):
+    """ Visited locations are kept as a map of location to time of first visit,
+    so that a new location is a single key in the shadow update. Locations from
+    the old previous_locations list are moved across the first time round. """
+    for _location in thing_shadow.get("previous_locations") or []:
+        thing_shadow.add_member("visited_locations", str(_location))
+    thing_shadow.set("previous_locations", None)
+    if not thing_shadow.has_member("visited_locations", str(location)):
+        thing_shadow.add_member("visited_locations", str(location), timestamp or True)
+        print("Visited", location)
+
+def _iot_client():
+    """ AWS IoT data plane client, for thing shadows """
+    return clients.get_client("iot-data", region_name=AWS_REGION)
+
+def get_geo_index(now=None):
+    """ Spatial index of all geo points, rebuilt from DynamoDB once the cached
+    one is older than GEO_DATA_TTL_S """
+    if now is None:
+        now = time.time()
+    if _GEO_INDEX_CACHE["index"] is None or now - _GEO_INDEX_CACHE["loaded"] >= GEO_DATA_TTL_S:
+        _GEO_INDEX_CACHE["index"] = geoindex.GeoIndex(
+            scan_geo_points(
+                clients.get_resource("dynamodb", endpoint_url=AWS_DYNAMODB_ENDPOINT).Table(
+                    AWS_DYNAMODB_GEO_TABLE
+                )
+            )
         )
-        if "current_location" not in current_shadow:
-            current_shadow["current_location"] = ""
-        if "previous_locations" not in current_shadow:
-            current_shadow["previous_locations"] = []
-        if _distance_km < geo_point["approach_distance_km"]:
-            if str(geo_point["location"]) != str(current_shadow["current_location"]):
-                send_notify_email(geo_point, current_shadow)
-                current_shadow["current_location"] = geo_point["location"]
-                if geo_point["location"] not in current_shadow["previous_locations"]:
-                    current_shadow["previous_locations"].append(geo_point["location"])
-                    print(current_shadow["previous_locations"])
-                update_thing_shadow(thing_id, current_shadow)
+        _GEO_INDEX_CACHE["loaded"] = now
+        print("Loaded", _GEO_INDEX_CACHE["index"].size, "geo points")
+    return _GEO_INDEX_CACHE["index"]
 
-def get_thing_shadow(dev_id):
-    """ Retrieve AWS IoT thing's shadow document """
-    current_shadow = json.loads(
-        AWS_IOT_CLIENT.get_thing_shadow(
-            thingName=dev_id
-        )["payload"].read()
-    )["state"]["reported"]
-    print(current_shadow)
-    return current_shadow
+def scan_geo_points(table):
+    """ Read all geo points from the table, across as many pages as needed """
+    _response = table.scan()
+    geo_points = _response["Items"]
+    while "LastEvaluatedKey" in _response:
+        _response = table.scan(ExclusiveStartKey=_response["LastEvaluatedKey"])
+        geo_points.extend(_response["Items"])
+    return geo_points
 
-def update_thing_shadow(dev_id, data):
-    """ Update the AWS IoT thing's shadow document """
-    reported_data = {"state": {"reported": ""}}
-    reported_data["state"]["reported"] = data
-    AWS_IOT_CLIENT.update_thing_shadow(
-        thingName=dev_id,
-        payload=json.dumps(reported_data)
-    )
+def get_notify_recipients(now=None):
+    """ Email addresses of all users in Cognito's user pool, read again once
+    the cached ones are older than COGNITO_USERS_TTL_S """
+    if now is None:
+        now = time.time()
+    if _RECIPIENTS_CACHE["email_addresses"] is None or \
+            now - _RECIPIENTS_CACHE["loaded"] >= COGNITO_USERS_TTL_S:
+        _RECIPIENTS_CACHE["email_addresses"] = list_cognito_email_addresses()
+        _RECIPIENTS_CACHE["loaded"] = now
+        print("Loaded", len(_RECIPIENTS_CACHE["email_addresses"]), "recipients")
+    return _RECIPIENTS_CACHE["email_addresses"]
+
+def list_cognito_email_addresses():
+    """ Email addresses of all users in Cognito's user pool, across all pages """
+    cognito_email_addresses = []
+    _request = {
+        "UserPoolId": AWS_COGNITO_USERPOOL_ID,
+        "AttributesToGet": ["email"],
+        "Limit": COGNITO_PAGE_SIZE
+    }
+    while True:
+        cognito_users = clients.get_client(
+            "cognito-idp", region_name=AWS_REGION
+        ).list_users(**_request)
+        for cognito_user in cognito_users["Users"]:
+            for _attribute in cognito_user.get("Attributes", []):
+                if _attribute["Name"] == "email":
+                    cognito_email_addresses.append(_attribute["Value"])
+        if not cognito_users.get("PaginationToken"):
+            return cognito_email_addresses
+        _request["PaginationToken"] = cognito_users["PaginationToken"]
 
 def send_notify_email(geo_point, event):
     """ Notify all users registered in Cognito's user pool """
-    # Obtain list of email recipients from Cognito
-    cognito_users = AWS_COGNITO_IDP_CLIENT.list_users(
-        UserPoolId=AWS_COGNITO_USERPOOL_ID,
-        AttributesToGet=[
-            "email",
-        ],
-        Limit=50
-    )
-    cognito_email_addresses = []
-    for cognito_user in cognito_users["Users"]:
-        cognito_email_addresses.append(cognito_user["Attributes"][0]["Value"])
+    cognito_email_addresses = get_notify_recipients()
     # Send status change email
     SUBJECT = "Reached: " + geo_point["name"] + "!"
     BODY_TEXT = geo_point["description"]
@@ -95,30 +194,39 @@ def send_notify_email(geo_point, event):
     </html>
     """
     CHARSET = "UTF-8"
+    # Recipients are sent the same message in groups, and do not see each other
+    for _first in range(0, len(cognito_email_addresses), AWS_SES_MAX_RECIPIENTS):
+        _send_email(
+            cognito_email_addresses[_first:_first + AWS_SES_MAX_RECIPIENTS],
+            SUBJECT, BODY_TEXT, BODY_HTML, CHARSET
+        )
+
+def _send_email(email_addresses, subject, body_text, body_html, charset):
+    """ Send a single email (to at most AWS_SES_MAX_RECIPIENTS addresses) """
     try:
-        response = AWS_SES_CLIENT.send_email(
+        response = clients.get_client("ses", region_name=AWS_REGION).send_email(
             Destination={
-                "ToAddresses": cognito_email_addresses,
+                "BccAddresses": email_addresses,
             },
             Message={
                 "Body": {
                     "Html": {
-                        "Charset": CHARSET,
-                        "Data": BODY_HTML,
+                        "Charset": charset,
+                        "Data": body_html,
                     },
                     "Text": {
-                        "Charset": CHARSET,
-                        "Data": BODY_TEXT,
+                        "Charset": charset,
+                        "Data": body_text,
                     },
                 },
                 "Subject": {
-                    "Charset": CHARSET,
-                    "Data": SUBJECT,
+                    "Charset": charset,
+                    "Data": subject,
                 },
             },
             Source=AWS_SES_SENDER,
         )
-    except ClientError as e:
+    except clients.ClientError as e:
         print(e.response["Error"]["Message"])
     else:
         print("Email sent! Message ID:", response["MessageId"])
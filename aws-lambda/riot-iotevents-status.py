@@ -1,80 +1,83 @@
 """ riot-iotevents-status.py
 Lambda function to respond to IoT Events changing state of a device. Does the following:
--Update device shadow of tracker with latest state
--Sends notification email using AWS SES
+-Update device shadow of tracker with latest state, and record the transition (one read, one write)
+-Schedules a digest email of the window's transitions, sent by riot-status-digest.py
+ (or, if no digest queue is configured, sends it once the state is written, at most once a window)
+Also accepts a batch of records: each device's state changes are applied in
+order, with a single shadow write per device.
 """
 
-import os
-import json
-import boto3
-from botocore.exceptions import ClientError
-
-AWS_SES_SENDER = os.environ["AWS_SES_SENDER"]
-AWS_SES_RECIPIENT = os.environ["AWS_SES_RECIPIENT"]
-AWS_REGION = os.environ["AWS_REGION_NAME"]
-AWS_SES_CLIENT = boto3.client("ses", region_name=AWS_REGION)
-AWS_IOT_CLIENT = boto3.client("iot-data", region_name=AWS_REGION)
+import clients
+from shadow import ThingShadow
+import batch
+import status_digest
 
 def lambda_handler(event, context):
     """ Main Lambda function to action notification events """
+    if batch.is_batch(event):
+        return handle_batch(event)
     thing_name = str(event["payload"]["detector"]["keyValue"])
     state_name = event["payload"]["state"]["stateName"]
     print("Thing:", thing_name)
     # Update reported state of tracker
-    _data = {"state": {"reported": {"status": state_name}}}
-    _response = AWS_IOT_CLIENT.update_thing_shadow(
-        thingName=thing_name,
-        payload=json.dumps(_data)
+    _thing_shadow = ThingShadow(_iot_client(), thing_name)
+    status_digest.record_transition(_thing_shadow, state_name, event.get("eventTime"))
+    _dispatch = status_digest.prepare_dispatch(_thing_shadow)
+    _thing_shadow.commit()
+    if _dispatch:
+        _dispatch_digest(_thing_shadow)
+    return None
+
+def handle_batch(event):
+    """ Record each device's state changes in order, with one shadow write
+    and at most one digest per device """
+    _groups, _failed = batch.group_by_device(
+        event,
+        lambda _payload: str(_payload["payload"]["detector"]["keyValue"]),
+        _event_time_key
     )
-    print(_response, _data)
-    _current_shadow = json.loads(AWS_IOT_CLIENT.get_thing_shadow(
-        thingName=thing_name
-    )["payload"].read())["state"]["reported"]
-    print(_current_shadow)
-    # Send status change email
-    if state_name == "responding":
-        SUBJECT = "Happy days! " + event["payload"]["detector"]["keyValue"] + " is alive and well."
-    elif state_name == "not-responding":
-        SUBJECT = "Oh no! We've not heard from " +\
-        event["payload"]["detector"]["keyValue"] + " in a while..."
-    elif state_name == "lost":
-        SUBJECT = "Oops! " + event["payload"]["detector"]["keyValue"] + " appears to be lost."
-    BODY_TEXT = "Last reported data: " + str(_current_shadow)
-    BODY_HTML = """<html>
-    <head></head>
-    <body>
-    <h1>""" + SUBJECT + """</h1>
-    Last reported data: """ + str(_current_shadow) + """.
-    </body>
-    </html>
-    """
-    CHARSET = "UTF-8"
+    for thing_name, _records in _groups.items():
+        _thing_shadow = ThingShadow(_iot_client(), thing_name)
+        _applied = []
+        for _record_id, _payload in _records:
+            try:
+                status_digest.record_transition(
+                    _thing_shadow, _payload["payload"]["state"]["stateName"], _payload.get("eventTime")
+                )
+            except (KeyError, TypeError, ValueError):
+                print("Record", _record_id, "has no state")
+                _failed.append(_record_id)
+            else:
+                _applied.append(_record_id)
+        if not _applied:
+            continue
+        _dispatch = status_digest.prepare_dispatch(_thing_shadow)
+        try:
+            _thing_shadow.commit()
+        except clients.ClientError as ex:
+            print("Shadow update of", thing_name, "failed:", ex)
+            _failed.extend(_applied)
+            continue
+        if _dispatch:
+            _dispatch_digest(_thing_shadow)
+    print("Updated", len(_groups), "devices,", len(_failed), "failed records")
+    return batch.failure_response(_failed)
+
+def _event_time_key(payload):
+    """ eventTime (ms since the epoch), zero padded so that it sorts as text.
+    Raises ValueError (or TypeError) if it is not a number, failing the record. """
+    return "{:020d}".format(int(payload.get("eventTime") or 0))
+
+def _iot_client():
+    """ AWS IoT data plane client, for thing shadows """
+    return clients.get_client("iot-data", region_name=status_digest.AWS_REGION)
+
+def _dispatch_digest(thing_shadow):
+    """ Queue (or send) the digest, once the transitions are safely in the
+    shadow. A failure is logged rather than retried, as the state change is
+    written: the transitions stay pending, and the next change schedules
+    (or sends) the digest again. """
     try:
-        response = AWS_SES_CLIENT.send_email(
-            Destination={
-                "ToAddresses": [
-                    AWS_SES_RECIPIENT,
-                ],
-            },
-            Message={
-                "Body": {
-                    "Html": {
-                        "Charset": CHARSET,
-                        "Data": BODY_HTML,
-                    },
-                    "Text": {
-                        "Charset": CHARSET,
-                        "Data": BODY_TEXT,
-                    },
-                },
-                "Subject": {
-                    "Charset": CHARSET,
-                    "Data": SUBJECT,
-                },
-            },
-            Source=AWS_SES_SENDER,
-        )
-    except ClientError as ex:
+        status_digest.dispatch(thing_shadow)
+    except clients.ClientError as ex:
         print(ex.response["Error"]["Message"])
-    else:
-        print("Email sent! Message ID:", response["MessageId"])
@@ -0,0 +1,38 @@
+""" riot-status-digest.py
+Lambda function triggered by the status digest SQS queue (see status_digest.py).
+Each message names a device whose digest window has closed: its pending state
+transitions are sent in one email and removed from its shadow. Transitions that
+arrived while the digest was being sent are scheduled for the next window.
+A message for a device with nothing pending (e.g. one scheduled again while
+the first was still being retried) sends nothing.
+"""
+
+import clients
+from shadow import ThingShadow
+import batch
+import status_digest
+
+def lambda_handler(event, context):
+    """ Send one digest per device in the batch of messages """
+    _groups, _failed = batch.group_by_device(
+        event,
+        lambda _payload: str(_payload["thing_name"]),
+        lambda _payload: None
+    )
+    for thing_name, _records in _groups.items():
+        _thing_shadow = ThingShadow(
+            clients.get_client("iot-data", region_name=status_digest.AWS_REGION), thing_name
+        )
+        try:
+            _sent = status_digest.send_digest(_thing_shadow)
+            _thing_shadow.commit()
+            if status_digest.prepare_dispatch(_thing_shadow):
+                _thing_shadow.commit()
+                status_digest.dispatch(_thing_shadow)
+        except clients.ClientError as ex:
+            # Transitions are only removed once emailed, so a retry is safe
+            print("Digest of", thing_name, "failed:", ex)
+            _failed.extend(_record_id for _record_id, _payload in _records)
+        else:
+            print("Digest of", thing_name, ":", _sent, "transitions")
+    return batch.failure_response(_failed)
@@ -1,23 +1,63 @@
 """ riot-update-deviceshadow.py
 Update device shadow document of a thing in AWS IoT Core
-with data based of incoming payload.
+with data based of incoming payload. Also accepts a batch of records,
+in which case each device's shadow is written once, with its latest data.
+Events (such as the brick's arrivals, for riot-check-proximity) and the
+brick's geofence marker are left out of the shadow.
 """
 
 import json
-import boto3
-from botocore.exceptions import ClientError
+import clients
+import batch
 
-client = boto3.client("iot-data")
+# Payload keys that are only for riot-check-proximity
+CHECK_ONLY_KEYS = ("geofence",)
 
 def lambda_handler(event, context):
     """ Update reported state of thing in device shadow with payload """
-    _data = {"state": {"reported": event}}
+    if batch.is_batch(event):
+        return handle_batch(event)
+    _reported = shadow_data(event)
+    if _reported is None:
+        print("Not a position:", event.get("event"))
+        return None
+    update_device_shadow(event["dev_id"], _reported)
+    return None
+
+def handle_batch(event):
+    """ Merge each device's records (oldest first) into one shadow update """
+    _groups, _failed = batch.group_by_device(
+        event,
+        lambda _payload: _payload["dev_id"],
+        lambda _payload: _payload.get("timestamp")
+    )
+    for _dev_id, _records in _groups.items():
+        _reported = {}
+        for _record_id, _payload in _records:
+            _reported.update(shadow_data(_payload) or {})
+        if not _reported:
+            continue
+        if not update_device_shadow(_dev_id, _reported):
+            _failed.extend(_record_id for _record_id, _payload in _records)
+    print("Updated", len(_groups), "devices,", len(_failed), "failed records")
+    return batch.failure_response(_failed)
+
+def shadow_data(payload):
+    """ The part of a payload that belongs in the shadow, or None for an event """
+    if "event" in payload:
+        return None
+    return {_key: _value for _key, _value in payload.items() if _key not in CHECK_ONLY_KEYS}
+
+def update_device_shadow(dev_id, reported):
+    """ Write reported state to the device's shadow. Returns False on failure. """
+    _data = {"state": {"reported": reported}}
     try:
-        _response = client.update_thing_shadow(
-            thingName=event["dev_id"],
+        _response = clients.get_client("iot-data").update_thing_shadow(
+            thingName=dev_id,
             payload=json.dumps(_data)
         )
-    except ClientError as ex:
+    except clients.ClientError as ex:
         print(ex.response["Error"]["Message"])
-    else:
-        print(_response, _data)
+        return False
+    print(_response, _data)
+    return True
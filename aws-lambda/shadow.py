@@ -0,0 +1,131 @@
+""" shadow.py
+Access layer for AWS IoT thing shadows, shared by the Lambda functions.
+A shadow is read at most once, changes are collected as they are made, and
+written back as a single delta-only update, conditioned on the version read.
+"""
+
+import json
+import clients
+
+class ThingShadow():
+    """ Reported state of a thing's shadow, plus any local changes to it """
+
+    def __init__(self, iot_client, thing_name):
+        """ Nothing is read until the state is first needed """
+        self.iot_client = iot_client
+        self.thing_name = thing_name
+        self.reported = None
+        self.version = None
+        self.changes = {}
+
+    def load(self):
+        """ Read the shadow, if not already read. A thing without a shadow
+        is treated as having an empty one. """
+        if self.reported is not None:
+            return self.reported
+        try:
+            _document = json.loads(
+                self.iot_client.get_thing_shadow(thingName=self.thing_name)["payload"].read()
+            )
+        except clients.ClientError as ex:
+            if ex.response["Error"]["Code"] != "ResourceNotFoundException":
+                raise
+            _document = {}
+        self.reported = _document.get("state", {}).get("reported", {})
+        self.version = _document.get("version")
+        return self.reported
+
+    @property
+    def state(self):
+        """ Reported state with local changes applied """
+        return _merge(dict(self.load()), self.changes)
+
+    def get(self, key, default=None):
+        """ Current value of a top level key """
+        return self.state.get(key, default)
+
+    def set(self, key, value):
+        """ Change a top level key. Setting it to None deletes it. Values that
+        are already reported are not sent again. """
+        if key not in self.changes and self.load().get(key) == value:
+            return
+        self.changes[key] = value
+
+    def update(self, data):
+        """ Change several top level keys at once """
+        for _key, _value in data.items():
+            self.set(_key, _value)
+
+    def has_member(self, key, member):
+        """ Whether a map valued key (used as a set) contains member """
+        return self.get(key, {}).get(member) is not None
+
+    def add_member(self, key, member, value=True):
+        """ Add member to a map valued key. Only the new member is sent, as the
+        shadow service merges maps. """
+        if self.has_member(key, member):
+            return
+        _changes = self.changes.get(key)
+        if not isinstance(_changes, dict):
+            _changes = self.changes[key] = {}
+        _changes[member] = value
+
+    def remove_member(self, key, member):
+        """ Remove member from a map valued key, leaving any other members
+        (including ones added by someone else since the read) alone """
+        if not self.has_member(key, member):
+            return
+        _changes = self.changes.get(key)
+        if not isinstance(_changes, dict):
+            _changes = self.changes[key] = {}
+        _changes[member] = None
+
+    def commit(self):
+        """ Write all changes in a single update, and return the response.
+        If the shadow was changed by someone else since it was read, it is
+        read again and the update retried once. """
+        if not self.changes:
+            return None
+        _payload = {"state": {"reported": self.changes}}
+        if self.version is not None:
+            _payload["version"] = self.version
+        try:
+            _response = self._update(_payload)
+        except clients.ClientError as ex:
+            if ex.response["Error"]["Code"] != "ConflictException":
+                raise
+            print("Shadow of", self.thing_name, "changed since read, retrying")
+            self.reported = None
+            self.load()
+            _payload.pop("version", None)
+            if self.version is not None:
+                _payload["version"] = self.version
+            _response = self._update(_payload)
+        self.reported = self.state
+        self.version = _response.get("version", self.version)
+        self.changes = {}
+        return _response
+
+    def _update(self, payload):
+        """ Send the update, and return the accepted document """
+        _response = self.iot_client.update_thing_shadow(
+            thingName=self.thing_name,
+            payload=json.dumps(payload)
+        )
+        print("Shadow update", self.thing_name, payload)
+        try:
+            return json.loads(_response["payload"].read())
+        except (KeyError, ValueError):
+            return {}
+
+def _merge(document, changes):
+    """ Apply changes to a document as the shadow service does: maps are merged,
+    everything else replaced, and None deletes. """
+    for _key, _value in changes.items():
+        if _value is None:
+            document.pop(_key, None)
+        elif isinstance(_value, dict) and isinstance(document.get(_key), dict):
+            document[_key] = _merge(dict(document[_key]), _value)
+        else:
+            document[_key] = _value
+    return document
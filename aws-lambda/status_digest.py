@@ -0,0 +1,191 @@
+""" status_digest.py
+Coalesced status notifications, shared by riot-iotevents-status.py and
+riot-status-digest.py. Rather than an email per IoT Events state change,
+each change is recorded in the device's shadow (status_transitions, a map of
+event time to state name) and the first change in a window schedules a
+delayed SQS message. When that message arrives, one digest email with the
+final state and every transition since the last digest is sent.
+When the message was scheduled is kept in the shadow too (written along with
+the transition), so that a digest which never arrives (its message
+dead-lettered, or the email kept failing) is scheduled again by the next
+change once overdue, rather than holding up that device's emails for good.
+Without a queue (AWS_STATUS_DIGEST_QUEUE_URL), a change that comes at least a
+window after the last digest was sent (also kept in the shadow) sends one
+straight away, once the change is written. Changes within the window are kept
+for the first change after it, so the digest then sent may be of a while ago.
+"""
+
+import json
+import os
+import time
+import clients
+
+AWS_SES_SENDER = os.environ["AWS_SES_SENDER"]
+AWS_SES_RECIPIENT = os.environ["AWS_SES_RECIPIENT"]
+AWS_REGION = os.environ["AWS_REGION_NAME"]
+AWS_STATUS_DIGEST_QUEUE_URL = os.environ.get("AWS_STATUS_DIGEST_QUEUE_URL")
+# How long transitions are collected for, before a digest is sent
+STATUS_DIGEST_WINDOW_S = int(os.environ.get("STATUS_DIGEST_WINDOW_S", "300"))
+# How long after its window a scheduled digest is taken as lost
+STATUS_DIGEST_MARGIN_S = int(os.environ.get("STATUS_DIGEST_MARGIN_S", "600"))
+# Longest delay SQS allows on a message
+SQS_MAX_DELAY_S = 900
+TRANSITIONS_KEY = "status_transitions"
+# When (ms since the epoch) the pending digest was scheduled
+SCHEDULED_KEY = "status_digest_scheduled"
+# When (ms since the epoch) the last digest was sent, without a queue
+SENT_KEY = "status_digest_sent"
+
+SUBJECTS = {
+    "responding": "Happy days! {} is alive and well.",
+    "not-responding": "Oh no! We've not heard from {} in a while...",
+    "lost": "Oops! {} appears to be lost.",
+}
+
+def record_transition(thing_shadow, state_name, event_time_ms=None):
+    """ Add a state change to the (not yet written) shadow, and make it the
+    current status. Transitions are keyed by event time, zero padded so that
+    they sort in time order. Returns the transition's key. """
+    if event_time_ms is None:
+        event_time_ms = int(time.time() * 1000)
+    _key = "{:015d}".format(int(event_time_ms))
+    thing_shadow.set("status", state_name)
+    thing_shadow.add_member(TRANSITIONS_KEY, _key, state_name)
+    return _key
+
+def pending_transitions(thing_shadow):
+    """ (event time key, state name) of transitions not yet in a digest, oldest
+    first. Members set to null (removed) are skipped. """
+    return sorted(
+        _item for _item in (thing_shadow.get(TRANSITIONS_KEY) or {}).items()
+        if _item[1] is not None
+    )
+
+def digest_due(thing_shadow, now_ms=None):
+    """ Whether there are pending transitions, but no digest scheduled for
+    them (or one scheduled so long ago that it is not coming) """
+    if not pending_transitions(thing_shadow):
+        return False
+    _scheduled_ms = thing_shadow.get(SCHEDULED_KEY)
+    if _scheduled_ms is None:
+        return True
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    _overdue_s = min(STATUS_DIGEST_WINDOW_S, SQS_MAX_DELAY_S) + STATUS_DIGEST_MARGIN_S
+    if now_ms - int(_scheduled_ms) < _overdue_s * 1000:
+        return False
+    print("Digest for", thing_shadow.thing_name, "overdue, scheduling again")
+    return True
+
+def send_due(thing_shadow, now_ms=None):
+    """ Without a queue: whether there are pending transitions, and the last
+    digest was sent at least a window ago """
+    if not pending_transitions(thing_shadow):
+        return False
+    _sent_ms = thing_shadow.get(SENT_KEY)
+    if _sent_ms is None:
+        return True
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    return now_ms - int(_sent_ms) >= STATUS_DIGEST_WINDOW_S * 1000
+
+def prepare_dispatch(thing_shadow):
+    """ Before the commit that records transitions: note a digest as scheduled
+    if one is due (or, without a queue, check whether one can be sent). Returns
+    whether dispatch is to be called once committed. """
+    if not AWS_STATUS_DIGEST_QUEUE_URL:
+        return send_due(thing_shadow)
+    if not digest_due(thing_shadow):
+        return False
+    thing_shadow.set(SCHEDULED_KEY, int(time.time() * 1000))
+    return True
+
+def dispatch(thing_shadow):
+    """ Once the transitions are written: queue the digest, or without a queue
+    send it now and write the removal of its transitions (and when it was
+    sent). A failure raises ClientError; the state change is already written,
+    and its transitions are left pending for a later digest. """
+    if AWS_STATUS_DIGEST_QUEUE_URL:
+        schedule_digest(thing_shadow.thing_name)
+        return
+    if send_digest(thing_shadow):
+        thing_shadow.set(SENT_KEY, int(time.time() * 1000))
+    thing_shadow.commit()
+
+def schedule_digest(thing_name, delay_s=STATUS_DIGEST_WINDOW_S):
+    """ Queue a delayed message for riot-status-digest.py """
+    clients.get_client("sqs", region_name=AWS_REGION).send_message(
+        QueueUrl=AWS_STATUS_DIGEST_QUEUE_URL,
+        MessageBody=json.dumps({"thing_name": thing_name}),
+        DelaySeconds=max(0, min(int(delay_s), SQS_MAX_DELAY_S)),
+    )
+    print("Digest for", thing_name, "scheduled in", delay_s, "s")
+
+def send_digest(thing_shadow):
+    """ Email the pending transitions, then remove just those (and the
+    scheduled time) from the shadow, so that any which arrive meanwhile are
+    kept for the next digest. The removal is written by the caller's next
+    commit. Returns the number of transitions sent. A failed email raises
+    ClientError, leaving the transitions pending. """
+    _transitions = pending_transitions(thing_shadow)
+    if not _transitions:
+        thing_shadow.set(SCHEDULED_KEY, None)
+        return 0
+    send_digest_email(thing_shadow.thing_name, _transitions, thing_shadow.state)
+    for _key, _state_name in _transitions:
+        thing_shadow.remove_member(TRANSITIONS_KEY, _key)
+    thing_shadow.set(SCHEDULED_KEY, None)
+    return len(_transitions)
+
+def send_digest_email(thing_name, transitions, current_shadow):
+    """ One email with the current state and the transitions that led to it """
+    _state_name = current_shadow.get("status", transitions[-1][1])
+    SUBJECT = SUBJECTS.get(_state_name, "{} is now " + str(_state_name) + ".").format(thing_name)
+    _history = [
+        (time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(int(_key) / 1000.0)), _name)
+        for _key, _name in transitions
+    ]
+    _reported = dict(current_shadow)
+    _reported.pop(TRANSITIONS_KEY, None)
+    _reported.pop(SCHEDULED_KEY, None)
+    _reported.pop(SENT_KEY, None)
+    BODY_TEXT = "Transitions:\n" + "\n".join(
+        _at + " " + _name for _at, _name in _history
+    ) + "\nLast reported data: " + str(_reported)
+    BODY_HTML = """<html>
+    <head></head>
+    <body>
+    <h1>""" + SUBJECT + """</h1>
+    <ul>""" + "".join(
+        "<li>" + _at + " <b>" + _name + "</b></li>" for _at, _name in _history
+    ) + """</ul>
+    Last reported data: """ + str(_reported) + """.
+    </body>
+    </html>
+    """
+    CHARSET = "UTF-8"
+    response = clients.get_client("ses", region_name=AWS_REGION).send_email(
+        Destination={
+            "ToAddresses": [
+                AWS_SES_RECIPIENT,
+            ],
+        },
+        Message={
+            "Body": {
+                "Html": {
+                    "Charset": CHARSET,
+                    "Data": BODY_HTML,
+                },
+                "Text": {
+                    "Charset": CHARSET,
+                    "Data": BODY_TEXT,
+                },
+            },
+            "Subject": {
+                "Charset": CHARSET,
+                "Data": SUBJECT,
+            },
+        },
+        Source=AWS_SES_SENDER,
+    )
+    print("Digest of", len(transitions), "transitions sent! Message ID:", response["MessageId"])
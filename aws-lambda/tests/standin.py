@@ -0,0 +1,72 @@
+""" standin.py
+Test set up for the Lambda functions: the aws-lambda directory and the
+in-memory boto3 stand-in (benchmarks/standins) are put first on sys.path, and
+the environment variables the functions need are set, before anything else
+is imported.
+"""
+
+import importlib.util
+import json
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_DIR = os.path.dirname(TESTS_DIR)
+STANDINS_DIR = os.path.join(LAMBDA_DIR, "benchmarks", "standins")
+
+for _path in (LAMBDA_DIR, STANDINS_DIR):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+ENVIRONMENT = {
+    "AWS_SES_SENDER": "tracker@example.com",
+    "AWS_SES_RECIPIENT": "owner@example.com",
+    "AWS_REGION_NAME": "eu-west-1",
+    "AWS_COGNITO_USERPOOL_ID": "eu-west-1_standin",
+}
+for _name, _value in ENVIRONMENT.items():
+    os.environ.setdefault(_name, _value)
+
+import boto3    # pylint: disable=wrong-import-position
+import clients  # pylint: disable=wrong-import-position
+
+def reset():
+    """ Empty the stand-in's state, and forget any clients built """
+    for _value in boto3.STATE.values():
+        _value.clear()
+    clients.reset()
+
+def load_function(name):
+    """ Import a Lambda function module (whose file names have hyphens) """
+    _spec = importlib.util.spec_from_file_location(
+        name.replace("-", "_"), os.path.join(LAMBDA_DIR, name + ".py")
+    )
+    _module = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(_module)
+    return _module
+
+def set_shadow(thing_name, state, version=1):
+    """ Store a shadow document in the stand-in """
+    boto3.STATE["shadows"][thing_name] = {"state": {"reported": state}, "version": version}
+
+def reported(thing_name):
+    """ Reported state stored in the stand-in """
+    return boto3.STATE["shadows"][thing_name]["state"]["reported"]
+
+class RecordingIotClient():
+    """ iot-data stand-in client that also keeps the update payloads sent """
+    # pylint: disable=invalid-name
+
+    def __init__(self):
+        """ Wraps a stand-in client """
+        self.client = boto3.client("iot-data")
+        self.updates = []
+
+    def get_thing_shadow(self, thingName):
+        """ Passed through """
+        return self.client.get_thing_shadow(thingName=thingName)
+
+    def update_thing_shadow(self, thingName, payload):
+        """ Kept, then passed through """
+        self.updates.append(json.loads(payload))
+        return self.client.update_thing_shadow(thingName=thingName, payload=payload)
@@ -0,0 +1,287 @@
+""" test_batch.py
+Batch handling (batch.py) for each shape of event a handler can be given: a
+list of events, an SQS batch and a Kinesis batch. Records are unpacked,
+grouped by device in timestamp order, and failures reported by the id the
+trigger knows each record by. The handlers of riot-update-deviceshadow and
+riot-check-proximity are run over the same batches against the boto3 stand-in.
+Run from the aws-lambda directory: python -m pytest tests
+"""
+
+import base64
+import json
+import unittest
+import standin
+import boto3
+import batch
+
+SHAPES = ("list", "sqs", "kinesis")
+
+def make_batch(shape, payloads):
+    """ Payloads as a batch of the given shape. Payloads that are str are
+    sent as they are, e.g. to be unreadable. """
+    if shape == "list":
+        return list(payloads)
+    _records = []
+    for _index, _payload in enumerate(payloads):
+        _data = _payload if isinstance(_payload, str) else json.dumps(_payload)
+        if shape == "sqs":
+            _records.append({"messageId": "message-" + str(_index), "body": _data})
+        else:
+            _records.append({"kinesis": {
+                "sequenceNumber": "sequence-" + str(_index),
+                "data": base64.b64encode(_data.encode()).decode(),
+            }})
+    return {"Records": _records}
+
+def record_id(shape, index):
+    """ Id a record is reported by, for its shape and position in the batch """
+    return {"list": "", "sqs": "message-", "kinesis": "sequence-"}[shape] + str(index)
+
+def position(dev_id, timestamp, latitude=51.50, longitude=-3.20):
+    """ Tracker position, as from the TTN integration """
+    return {
+        "dev_id": dev_id,
+        "timestamp": timestamp,
+        "position_lat": latitude,
+        "position_long": longitude,
+        "total_distance": 4.2,
+        "total_time": 5400,
+    }
+
+def _group(event):
+    """ group_by_device as the handlers call it """
+    return batch.group_by_device(
+        event, lambda _payload: _payload["dev_id"], lambda _payload: _payload.get("timestamp")
+    )
+
+class BatchTest(unittest.TestCase):
+    """ Unpacking and grouping """
+
+    def test_is_batch(self):
+        """ Lists and Records are batches, a single event is not """
+        self.assertFalse(batch.is_batch(position("riot-tracker-1", "2020-05-01T10:00:00Z")))
+        for _shape in SHAPES:
+            self.assertTrue(batch.is_batch(make_batch(_shape, [])))
+
+    def test_iter_records(self):
+        """ Each shape is unpacked to the same payloads """
+        _payloads = [position("riot-tracker-1", "2020-05-01T10:00:00Z"),
+                     position("riot-tracker-2", "2020-05-01T10:01:00Z")]
+        for _shape in SHAPES:
+            with self.subTest(shape=_shape):
+                self.assertEqual(
+                    list(batch.iter_records(make_batch(_shape, _payloads))),
+                    [(record_id(_shape, 0), _payloads[0]), (record_id(_shape, 1), _payloads[1])]
+                )
+
+    def test_grouped_in_order(self):
+        """ Each device's records in timestamp order, equal timestamps kept in
+        the order received """
+        _payloads = [
+            position("riot-tracker-1", "2020-05-01T10:02:00Z"),
+            position("riot-tracker-2", "2020-05-01T10:00:00Z"),
+            position("riot-tracker-1", "2020-05-01T10:00:00Z"),
+            position("riot-tracker-1", "2020-05-01T10:01:00Z", latitude=1.0),
+            position("riot-tracker-1", "2020-05-01T10:01:00Z", latitude=2.0),
+        ]
+        for _shape in SHAPES:
+            with self.subTest(shape=_shape):
+                _groups, _failed = _group(make_batch(_shape, _payloads))
+                self.assertEqual(_failed, [])
+                self.assertEqual(
+                    [_id for _id, _payload in _groups["riot-tracker-1"]],
+                    [record_id(_shape, _index) for _index in (2, 3, 4, 0)]
+                )
+                self.assertEqual(
+                    [_id for _id, _payload in _groups["riot-tracker-2"]], [record_id(_shape, 1)]
+                )
+
+    def test_unreadable_failed(self):
+        """ Records that cannot be decoded, or have no device, are failed by
+        their own id, and the rest are still grouped """
+        _payloads = [
+            position("riot-tracker-1", "2020-05-01T10:00:00Z"),
+            "not json",
+            {"timestamp": "2020-05-01T10:00:00Z"},
+        ]
+        for _shape in ("sqs", "kinesis"):
+            with self.subTest(shape=_shape):
+                _groups, _failed = _group(make_batch(_shape, _payloads))
+                self.assertEqual(_failed, [record_id(_shape, 1), record_id(_shape, 2)])
+                self.assertEqual(list(_groups), ["riot-tracker-1"])
+
+    def test_unreadable_timestamp_failed(self):
+        """ A timestamp key that raises fails the record """
+        _groups, _failed = batch.group_by_device(
+            [{"dev_id": "riot-tracker-1", "eventTime": "soon"},
+             {"dev_id": "riot-tracker-1", "eventTime": 2}],
+            lambda _payload: _payload["dev_id"],
+            lambda _payload: "{:020d}".format(int(_payload["eventTime"]))
+        )
+        self.assertEqual(_failed, ["0"])
+        self.assertEqual([_id for _id, _payload in _groups["riot-tracker-1"]], ["1"])
+
+    def test_kinesis_record_without_data(self):
+        """ Still reported by its sequence number """
+        _groups, _failed = _group({"Records": [{"kinesis": {"sequenceNumber": "sequence-0"}}]})
+        self.assertEqual((_groups, _failed), ({}, ["sequence-0"]))
+
+    def test_failure_response(self):
+        """ Partial batch response """
+        self.assertEqual(batch.failure_response([]), {"batchItemFailures": []})
+        self.assertEqual(
+            batch.failure_response(["message-1"]),
+            {"batchItemFailures": [{"itemIdentifier": "message-1"}]}
+        )
+
+class _FailingUpdates():
+    """ Makes the stand-in's shadow updates of one thing fail """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, thing_name):
+        self.thing_name = thing_name
+        self.update_thing_shadow = boto3._IotDataClient.update_thing_shadow   # pylint: disable=protected-access
+
+    def __enter__(self):
+        _update_thing_shadow = self.update_thing_shadow
+        _thing_name = self.thing_name
+
+        def _failing_update(client, thingName, payload):
+            # pylint: disable=invalid-name
+            if thingName == _thing_name:
+                raise boto3.ClientError(
+                    {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}},
+                    "UpdateThingShadow"
+                )
+            return _update_thing_shadow(client, thingName=thingName, payload=payload)
+
+        boto3._IotDataClient.update_thing_shadow = _failing_update     # pylint: disable=protected-access
+        return self
+
+    def __exit__(self, *exc_info):
+        boto3._IotDataClient.update_thing_shadow = self.update_thing_shadow    # pylint: disable=protected-access
+
+class UpdateDeviceShadowTest(unittest.TestCase):
+    """ riot-update-deviceshadow over a batch """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.function = standin.load_function("riot-update-deviceshadow")
+
+    def setUp(self):
+        standin.reset()
+
+    def test_latest_data_written_once(self):
+        """ One write per device, the latest record's values winning """
+        for _shape in SHAPES:
+            with self.subTest(shape=_shape):
+                standin.reset()
+                _response = self.function.lambda_handler(make_batch(_shape, [
+                    position("riot-tracker-1", "2020-05-01T10:02:00Z", latitude=3.0),
+                    dict(position("riot-tracker-1", "2020-05-01T10:01:00Z", latitude=2.0),
+                         battery=4.1),
+                    position("riot-tracker-2", "2020-05-01T10:00:00Z", latitude=1.0),
+                ]), None)
+                self.assertEqual(_response, {"batchItemFailures": []})
+                self.assertEqual(boto3.STATE["calls"].count("iot-data.update_thing_shadow"), 2)
+                _reported = standin.reported("riot-tracker-1")
+                self.assertEqual(_reported["position_lat"], 3.0)
+                self.assertEqual(_reported["timestamp"], "2020-05-01T10:02:00Z")
+                self.assertEqual(_reported["battery"], 4.1)
+                self.assertEqual(standin.reported("riot-tracker-2")["position_lat"], 1.0)
+
+    def test_failed_write(self):
+        """ All of a device's records fail with its write, and only those """
+        for _shape in SHAPES:
+            with self.subTest(shape=_shape):
+                standin.reset()
+                with _FailingUpdates("riot-tracker-2"):
+                    _response = self.function.lambda_handler(make_batch(_shape, [
+                        position("riot-tracker-2", "2020-05-01T10:01:00Z"),
+                        position("riot-tracker-1", "2020-05-01T10:00:00Z"),
+                        position("riot-tracker-2", "2020-05-01T10:00:00Z"),
+                    ]), None)
+                self.assertEqual(
+                    [_failure["itemIdentifier"] for _failure in _response["batchItemFailures"]],
+                    [record_id(_shape, 2), record_id(_shape, 0)]
+                )
+                self.assertIn("riot-tracker-1", boto3.STATE["shadows"])
+
+    def test_events_left_out(self):
+        """ The brick's arrival events and geofence marker are not merged """
+        _arrival = dict(position("riot-tracker-1", "2020-05-01T10:01:00Z", 53.0, -2.0),
+                        event="arrival", geo_location="Landmark", distance_km=0.1)
+        for _shape in SHAPES:
+            with self.subTest(shape=_shape):
+                standin.reset()
+                _response = self.function.lambda_handler(make_batch(_shape, [
+                    dict(position("riot-tracker-1", "2020-05-01T10:00:00Z"), geofence="edge"),
+                    _arrival,
+                    dict(_arrival, dev_id="riot-tracker-2"),
+                ]), None)
+                self.assertEqual(_response, {"batchItemFailures": []})
+                self.assertEqual(
+                    standin.reported("riot-tracker-1"),
+                    position("riot-tracker-1", "2020-05-01T10:00:00Z")
+                )
+                self.assertNotIn("riot-tracker-2", boto3.STATE["shadows"])
+        standin.reset()
+        self.function.lambda_handler(_arrival, None)
+        self.assertEqual(boto3.STATE["shadows"], {})
+
+class CheckProximityTest(unittest.TestCase):
+    """ riot-check-proximity over a batch """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.function = standin.load_function("riot-check-proximity")
+
+    def _seed(self):
+        """ One geo point and one user, with nothing cached """
+        standin.reset()
+        self.function._GEO_INDEX_CACHE["index"] = None    # pylint: disable=protected-access
+        self.function._RECIPIENTS_CACHE["email_addresses"] = None  # pylint: disable=protected-access
+        boto3.STATE["tables"]["riot-geo-data"] = [{
+            "location": "Landmark",
+            "name": "The Landmark",
+            "description": "A landmark",
+            "message": "Made it",
+            "image_url": "https://example.com/landmark.jpg",
+            "url": "https://example.com/landmark",
+            "latitude": 53.0,
+            "longitude": -2.0,
+            "approach_distance_km": 0.5,
+        }]
+        boto3.STATE["users"] = [{"Attributes": [{"Name": "email", "Value": "user@example.com"}]}]
+        # The email is made from the position riot-update-deviceshadow last wrote
+        standin.set_shadow("riot-tracker-1", position("riot-tracker-1", "2020-05-01T09:00:00Z"))
+
+    def test_arrival_in_order(self):
+        """ Records are checked oldest first, against one read and one write
+        of each shadow, and a record that cannot be checked fails alone """
+        _bad = position("riot-tracker-1", "2020-05-01T10:03:00Z")
+        del _bad["position_lat"]
+        _payloads = [
+            position("riot-tracker-1", "2020-05-01T10:10:00Z", 53.0, -2.0),
+            position("riot-tracker-1", "2020-05-01T10:05:00Z", 53.0, -2.0),
+            _bad,
+            position("riot-tracker-1", "2020-05-01T10:00:00Z"),
+        ]
+        for _shape in SHAPES:
+            with self.subTest(shape=_shape):
+                self._seed()
+                _response = self.function.lambda_handler(make_batch(_shape, _payloads), None)
+                self.assertEqual(
+                    _response, {"batchItemFailures": [{"itemIdentifier": record_id(_shape, 2)}]}
+                )
+                self.assertEqual(boto3.STATE["calls"].count("iot-data.get_thing_shadow"), 1)
+                self.assertEqual(boto3.STATE["calls"].count("iot-data.update_thing_shadow"), 1)
+                self.assertEqual(len(boto3.STATE["emails"]), 1)
+                _reported = standin.reported("riot-tracker-1")
+                self.assertEqual(_reported["current_location"], "Landmark")
+                self.assertEqual(
+                    _reported["visited_locations"], {"Landmark": "2020-05-01T10:05:00Z"}
+                )
+
+if __name__ == "__main__":
+    unittest.main()
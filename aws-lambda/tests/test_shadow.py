@@ -0,0 +1,176 @@
+""" test_shadow.py
+Shadow access layer (shadow.py) against the in-memory boto3 stand-in: only
+changes are sent, a version conflict is retried once, and riot-check-proximity
+moves an old previous_locations list to the visited_locations map.
+Run from the aws-lambda directory: python -m pytest tests
+"""
+
+import unittest
+import standin
+import boto3
+import clients
+from shadow import ThingShadow
+
+THING = "riot-tracker-1"
+
+class DeltaTest(unittest.TestCase):
+    """ Only changed keys, and new map members, are written """
+
+    def setUp(self):
+        standin.reset()
+        standin.set_shadow(THING, {
+            "current_location": "Home",
+            "visited_locations": {"Home": "2020-05-01T09:00:00Z"},
+            "battery": 4.1,
+        })
+        self.iot_client = standin.RecordingIotClient()
+        self.thing_shadow = ThingShadow(self.iot_client, THING)
+
+    def test_unchanged_values_not_sent(self):
+        """ Setting the reported value again sends nothing """
+        self.thing_shadow.set("current_location", "Home")
+        self.thing_shadow.update({"battery": 4.1})
+        self.assertIsNone(self.thing_shadow.commit())
+        self.assertEqual(self.iot_client.updates, [])
+
+    def test_only_changes_sent(self):
+        """ A changed key and a new member go in one update, conditioned on the version """
+        self.thing_shadow.set("current_location", "Work")
+        self.thing_shadow.set("battery", 4.1)
+        self.thing_shadow.add_member("visited_locations", "Work", "2020-05-01T10:00:00Z")
+        self.thing_shadow.add_member("visited_locations", "Home")
+        self.thing_shadow.commit()
+        self.assertEqual(self.iot_client.updates, [{
+            "state": {"reported": {
+                "current_location": "Work",
+                "visited_locations": {"Work": "2020-05-01T10:00:00Z"},
+            }},
+            "version": 1,
+        }])
+        self.assertEqual(standin.reported(THING), {
+            "current_location": "Work",
+            "visited_locations": {
+                "Home": "2020-05-01T09:00:00Z",
+                "Work": "2020-05-01T10:00:00Z",
+            },
+            "battery": 4.1,
+        })
+
+    def test_delete(self):
+        """ None deletes a key, or a single member """
+        self.thing_shadow.set("battery", None)
+        self.thing_shadow.remove_member("visited_locations", "Home")
+        self.assertNotIn("battery", self.thing_shadow.state)
+        self.assertFalse(self.thing_shadow.has_member("visited_locations", "Home"))
+        self.thing_shadow.commit()
+        self.assertEqual(standin.reported(THING), {
+            "current_location": "Home",
+            "visited_locations": {},
+        })
+
+    def test_missing_shadow(self):
+        """ A thing without a shadow reads as empty, and the write is unconditional """
+        _thing_shadow = ThingShadow(self.iot_client, "riot-tracker-2")
+        self.assertEqual(_thing_shadow.state, {})
+        _thing_shadow.set("current_location", "Home")
+        _thing_shadow.commit()
+        self.assertNotIn("version", self.iot_client.updates[0])
+        self.assertEqual(standin.reported("riot-tracker-2"), {"current_location": "Home"})
+
+    def test_commit_twice(self):
+        """ After a commit, the next commit is from the new version """
+        self.thing_shadow.set("battery", 4.0)
+        self.thing_shadow.commit()
+        self.thing_shadow.set("battery", 3.9)
+        self.thing_shadow.commit()
+        self.assertEqual([_update["version"] for _update in self.iot_client.updates], [1, 2])
+        self.assertEqual(standin.reported(THING)["battery"], 3.9)
+
+class ConflictTest(unittest.TestCase):
+    """ Someone else updating the shadow between read and write """
+
+    def setUp(self):
+        standin.reset()
+        standin.set_shadow(THING, {"visited_locations": {"Home": True}}, version=5)
+        self.iot_client = standin.RecordingIotClient()
+        self.thing_shadow = ThingShadow(self.iot_client, THING)
+        self.thing_shadow.add_member("visited_locations", "Work")
+        # The other writer
+        boto3.client("iot-data").update_thing_shadow(
+            thingName=THING,
+            payload='{"state": {"reported": {"visited_locations": {"Shop": true}}}}'
+        )
+
+    def test_retried_with_new_version(self):
+        """ The update is read again and retried, keeping the other change """
+        self.thing_shadow.commit()
+        self.assertEqual([_update.get("version") for _update in self.iot_client.updates], [5, 6])
+        self.assertEqual(
+            standin.reported(THING)["visited_locations"],
+            {"Home": True, "Shop": True, "Work": True}
+        )
+        self.assertEqual(self.thing_shadow.version, 7)
+        self.assertEqual(self.thing_shadow.changes, {})
+        self.assertTrue(self.thing_shadow.has_member("visited_locations", "Shop"))
+
+    def test_retried_once(self):
+        """ A second conflict is raised """
+        _update_thing_shadow = self.iot_client.update_thing_shadow
+
+        def _conflicting_update(thingName, payload):
+            # pylint: disable=invalid-name
+            boto3.STATE["shadows"][THING]["version"] += 1
+            return _update_thing_shadow(thingName=thingName, payload=payload)
+
+        self.iot_client.update_thing_shadow = _conflicting_update
+        with self.assertRaises(clients.ClientError) as _raised:
+            self.thing_shadow.commit()
+        self.assertEqual(_raised.exception.response["Error"]["Code"], "ConflictException")
+        self.assertEqual(len(self.iot_client.updates), 2)
+
+class MarkVisitedTest(unittest.TestCase):
+    """ riot-check-proximity's visited locations """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.check_proximity = standin.load_function("riot-check-proximity")
+
+    def setUp(self):
+        standin.reset()
+        self.iot_client = standin.RecordingIotClient()
+
+    def test_old_list_moved(self):
+        """ previous_locations becomes members of visited_locations, and is deleted """
+        standin.set_shadow(THING, {"previous_locations": ["Home", "Work"]})
+        _thing_shadow = ThingShadow(self.iot_client, THING)
+        self.check_proximity.mark_visited(_thing_shadow, "Shop", "2020-05-01T10:00:00Z")
+        _thing_shadow.commit()
+        self.assertEqual(self.iot_client.updates[0]["state"]["reported"], {
+            "previous_locations": None,
+            "visited_locations": {"Home": True, "Work": True, "Shop": "2020-05-01T10:00:00Z"},
+        })
+        self.assertEqual(standin.reported(THING), {
+            "visited_locations": {"Home": True, "Work": True, "Shop": "2020-05-01T10:00:00Z"},
+        })
+
+    def test_old_list_with_location(self):
+        """ A location already in the old list keeps its (unknown) visit time """
+        standin.set_shadow(THING, {"previous_locations": ["Home"]})
+        _thing_shadow = ThingShadow(self.iot_client, THING)
+        self.check_proximity.mark_visited(_thing_shadow, "Home", "2020-05-01T10:00:00Z")
+        _thing_shadow.commit()
+        self.assertEqual(standin.reported(THING), {"visited_locations": {"Home": True}})
+
+    def test_new_format(self):
+        """ Once moved, only the new location is sent """
+        standin.set_shadow(THING, {"visited_locations": {"Home": True}})
+        _thing_shadow = ThingShadow(self.iot_client, THING)
+        self.check_proximity.mark_visited(_thing_shadow, "Work", None)
+        self.check_proximity.mark_visited(_thing_shadow, "Home", None)
+        _thing_shadow.commit()
+        self.assertEqual(self.iot_client.updates[0]["state"]["reported"], {
+            "visited_locations": {"Work": True},
+        })
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+""" test_status_digest.py
+Coalesced status notifications (status_digest.py) through riot-iotevents-status,
+against the boto3 stand-in: the state change is always written, with or without
+a digest queue, and at most one digest goes out per window.
+Run from the aws-lambda directory: python -m pytest tests
+"""
+
+import time
+import unittest
+import standin
+import boto3
+import status_digest
+
+THING = "riot-tracker-1"
+
+def status_event(state_name, event_time_ms):
+    """ IoT Events detector state change """
+    return {
+        "payload": {"detector": {"keyValue": THING}, "state": {"stateName": state_name}},
+        "eventTime": event_time_ms,
+    }
+
+class _FailingEmails():
+    """ Makes the stand-in's send_email fail """
+    # pylint: disable=too-few-public-methods
+
+    def __enter__(self):
+        self.send_email = boto3._SesClient.send_email     # pylint: disable=protected-access
+
+        def _failing_send_email(client, **kwargs):
+            # pylint: disable=unused-argument
+            raise boto3.ClientError(
+                {"Error": {"Code": "Throttling", "Message": "Maximum sending rate exceeded"}},
+                "SendEmail"
+            )
+
+        boto3._SesClient.send_email = _failing_send_email     # pylint: disable=protected-access
+        return self
+
+    def __exit__(self, *exc_info):
+        boto3._SesClient.send_email = self.send_email     # pylint: disable=protected-access
+
+class _DigestTest(unittest.TestCase):
+    """ riot-iotevents-status, with the queue URL set as QUEUE_URL """
+    QUEUE_URL = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.function = standin.load_function("riot-iotevents-status")
+
+    def setUp(self):
+        standin.reset()
+        self._queue_url = status_digest.AWS_STATUS_DIGEST_QUEUE_URL
+        status_digest.AWS_STATUS_DIGEST_QUEUE_URL = self.QUEUE_URL
+        self.now_ms = int(time.time() * 1000)
+
+    def tearDown(self):
+        status_digest.AWS_STATUS_DIGEST_QUEUE_URL = self._queue_url
+
+    def change(self, state_name, offset_s=0):
+        """ A state change, offset_s after the start of the test """
+        return self.function.lambda_handler(
+            status_event(state_name, self.now_ms + offset_s * 1000), None
+        )
+
+    def pending(self):
+        """ Transitions in the shadow, not yet in a digest """
+        return sorted(
+            _name for _name in
+            standin.reported(THING).get(status_digest.TRANSITIONS_KEY, {}).values()
+        )
+
+class NoQueueTest(_DigestTest):
+    """ Digests sent by riot-iotevents-status itself """
+
+    def test_once_a_window(self):
+        """ The first change is sent, the next ones in the window wait for the
+        first change after it """
+        self.change("not-responding")
+        self.assertEqual(len(boto3.STATE["emails"]), 1)
+        self.assertEqual(self.pending(), [])
+        self.change("responding", 10)
+        self.change("not-responding", 20)
+        self.assertEqual(len(boto3.STATE["emails"]), 1)
+        self.assertEqual(self.pending(), ["not-responding", "responding"])
+        # The window is over
+        standin.reported(THING)[status_digest.SENT_KEY] -= status_digest.STATUS_DIGEST_WINDOW_S * 1000
+        self.change("lost", 30)
+        self.assertEqual(len(boto3.STATE["emails"]), 2)
+        self.assertEqual(boto3.STATE["emails"][1]["subject"], "Oops! " + THING + " appears to be lost.")
+        self.assertEqual(self.pending(), [])
+        self.assertEqual(standin.reported(THING)["status"], "lost")
+
+    def test_email_failure(self):
+        """ The state change is written even though the email fails, and is
+        sent with the next change """
+        with _FailingEmails():
+            self.assertIsNone(self.change("not-responding"))
+        self.assertEqual(standin.reported(THING)["status"], "not-responding")
+        self.assertEqual(self.pending(), ["not-responding"])
+        self.change("responding", 10)
+        self.assertEqual(len(boto3.STATE["emails"]), 1)
+        self.assertEqual(self.pending(), [])
+
+    def test_batch(self):
+        """ One digest for a device's changes in a batch """
+        _response = self.function.lambda_handler([
+            status_event("responding", self.now_ms + 1000),
+            status_event("not-responding", self.now_ms),
+        ], None)
+        self.assertEqual(_response, {"batchItemFailures": []})
+        self.assertEqual(len(boto3.STATE["emails"]), 1)
+        self.assertEqual(standin.reported(THING)["status"], "responding")
+        self.assertEqual(self.pending(), [])
+
+class QueueTest(_DigestTest):
+    """ Digests scheduled on the queue, and sent by riot-status-digest """
+    QUEUE_URL = "https://sqs.eu-west-1.amazonaws.com/123456789012/riot-status-digest"
+
+    def test_scheduled_once(self):
+        """ One message per window, and no email until it arrives """
+        self.change("not-responding")
+        self.change("responding", 10)
+        self.assertEqual(len(boto3.STATE["messages"]), 1)
+        self.assertEqual(boto3.STATE["emails"], [])
+        _digest = standin.load_function("riot-status-digest")
+        _response = _digest.lambda_handler({"Records": [
+            {"messageId": "message-0", "body": boto3.STATE["messages"][0]["body"]}
+        ]}, None)
+        self.assertEqual(_response, {"batchItemFailures": []})
+        self.assertEqual(len(boto3.STATE["emails"]), 1)
+        self.assertEqual(self.pending(), [])
+        self.assertNotIn(status_digest.SCHEDULED_KEY, standin.reported(THING))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,405 @@
+""" archive.py
+Columnar daily archive of uploaded brick records, for analysis after a trip.
+Each day's records from each device are kept in a directory of their own,
+<archive_dir>/<YYYY-MM-DD>/<dev_uid>/, with one NumPy .npy file per field (fixed
+width types, so they can be memory mapped rather than read), sorted by time, and
+an index.json holding the field types, the row count and the first row of each
+hour. Missing values are NaN. Arrival events are not archived.
+New rows that come after those already archived (the usual case) are appended
+to the files, and take effect when the index is replaced; rows left after the
+indexed count by an append cut short are ignored, and overwritten by the next.
+Otherwise a day's files are merged and replaced in one go, by swapping
+directories; a swap cut short (e.g. by a power cut) is finished off by the
+next run.
+Loading:
+    _day = archive.load_day("archive/", "2019-06-01", 0, ["altitude"])
+    _trip = archive.load("archive/", 0, "2019-06-01 09:00:00", "2019-06-02 18:00:00")
+"""
+
+import io
+import os
+import time
+import json
+import uuid
+import shutil
+import logging
+import sqlite3
+import numpy
+
+TIME_FIELD = "time"
+TIME_DTYPE = "datetime64[s]"
+# Positions keep full precision; everything else fits a float32
+SENSOR_FIELDS = (
+    ("position_lat", "<f8"), ("position_long", "<f8"), ("altitude", "<f4"),
+    ("temperature", "<f4"), ("pressure", "<f4"), ("humidity", "<f4"), ("light", "<f4"),
+    ("total_distance", "<f4"), ("total_climb", "<f4"), ("total_time", "<f4"),
+    ("cpu", "<f4"), ("memory", "<f4"), ("disk", "<f4"),
+)
+TRACKER_FIELDS = (("position_lat", "<f8"), ("position_long", "<f8"))
+INDEX_FILE = "index.json"
+STATE_FILE = "state.json"
+# Holds a random id for the database, so that a rebuilt one (whose record ids
+# start again from 1) is told apart from the one archived before
+DATABASE_ID_TABLE = "archive_database"
+
+LOG = logging.getLogger("riot.archive")
+
+# .npy header readers and writers, by format version
+_NPY_HEADERS = {
+    (1, 0): (numpy.lib.format.read_array_header_1_0, numpy.lib.format.write_array_header_1_0),
+    (2, 0): (numpy.lib.format.read_array_header_2_0, numpy.lib.format.write_array_header_2_0),
+}
+
+class Archiver():
+    """ Moves uploaded records from the SQLite buffer into the archive. Only
+    records up to the first one still awaiting upload are taken, so that
+    nothing is skipped when uploads complete out of order. """
+    # pylint: disable=too-many-arguments
+
+    def __init__(self, archive_dir, database, table, batch_size=10000, purge=False,
+                 max_pending_s=None):
+        """ purge deletes records from the buffer once archived. Records not
+        uploaded after max_pending_s are archived anyway, so that one which
+        never uploads does not hold up the rest for good. """
+        self.archive_dir = archive_dir
+        self.database = database
+        self.table = table
+        self.batch_size = batch_size
+        self.purge = purge
+        self.max_pending_s = max_pending_s
+
+    def archive(self):
+        """ Archive whatever is newly uploaded. Returns the number of records
+        archived. """
+        self.recover()
+        _state = self._load_state()
+        _conn = sqlite3.connect(self.database)
+        try:
+            _database_id = _get_database_id(_conn)
+            if _state.setdefault("database_id", _database_id) != _database_id:
+                LOG.warning("Database replaced since last archived, archiving it from the start")
+                _state = {"database_id": _database_id, "last_id": 0}
+            _stale_id = self._stale_id(_conn, _state)
+            _pending = _conn.execute(
+                "SELECT MIN(id) FROM " + self.table + " WHERE processed = 0 AND id > ?",
+                (max(_state["last_id"], _stale_id),)
+            ).fetchone()[0]
+            self._check_progress(_state, _pending)
+            _rows = _conn.execute(
+                "SELECT id, payload, dev_uid FROM " + self.table +
+                " WHERE (processed = 1 OR id <= ?) AND id > ? AND id < ? ORDER BY id ASC",
+                (_stale_id, _state["last_id"],
+                 _pending if _pending is not None else 2 ** 63 - 1)
+            )
+            _archived = 0
+            while True:
+                _batch = _rows.fetchmany(self.batch_size)
+                if not _batch:
+                    break
+                _columns = {}
+                for _row_id, _payload, _dev_uid in _batch:
+                    _add_record(_columns, _row_id, _payload, _dev_uid)
+                for (_day, _dev_uid), _day_columns in sorted(_columns.items()):
+                    _archived += self._append(_day, _dev_uid, _day_columns, _database_id)
+                _state["last_id"] = _batch[-1][0]
+                self._save_state(_state)
+            if self.purge:
+                with _conn:
+                    _conn.execute(
+                        "DELETE FROM " + self.table + " WHERE processed = 1 AND id <= ?",
+                        (_state["last_id"],)
+                    )
+        finally:
+            _conn.close()
+        return _archived
+
+    def recover(self):
+        """ Finish off swaps of a day's files cut short (e.g. by a power cut):
+        the previous files are put back if the new ones never replaced them,
+        and left over copies are removed """
+        for _day in days(self.archive_dir):
+            _day_dir = os.path.join(self.archive_dir, _day)
+            for _name in os.listdir(_day_dir):
+                _path = os.path.join(_day_dir, _name)
+                if _name.endswith(".old"):
+                    if os.path.isdir(_path[:-len(".old")]):
+                        shutil.rmtree(_path, ignore_errors=True)
+                    else:
+                        LOG.warning("Restoring %s", _path)
+                        os.rename(_path, _path[:-len(".old")])
+                elif _name.endswith(".new"):
+                    shutil.rmtree(_path, ignore_errors=True)
+
+    def _stale_id(self, conn, state):
+        """ Id up to which records are old enough to be archived whether
+        uploaded or not (0 for none). The newest id is noted every
+        max_pending_s, so such records are archived between max_pending_s and
+        twice that after being stored. """
+        if not self.max_pending_s:
+            return 0
+        _now = time.time()
+        _mark = state.get("pending_mark")
+        if _mark is None or _now - _mark["time"] >= self.max_pending_s:
+            if _mark is not None:
+                state["stale_id"] = _mark["id"]
+            state["pending_mark"] = {
+                "id": conn.execute("SELECT MAX(id) FROM " + self.table).fetchone()[0] or 0,
+                "time": _now,
+            }
+            self._save_state(state)
+        return state.get("stale_id", 0)
+
+    def _check_progress(self, state, pending):
+        """ Warn when archiving is held up by the same record as the last run """
+        _held_by = state.get("held_by")
+        if pending is None:
+            state.pop("held_by", None)
+        elif _held_by is None or _held_by["id"] != pending:
+            state["held_by"] = {"id": pending, "since": time.time()}
+        else:
+            LOG.warning(
+                "Archiving held up for %ds by record %d, not yet uploaded%s",
+                time.time() - _held_by["since"], pending,
+                "" if self.max_pending_s else " (see max_pending_s)"
+            )
+        self._save_state(state)
+
+    def _append(self, day, dev_uid, columns, database_id):
+        """ Add new rows to a day's files: appended to them if they all come
+        after the rows already there, otherwise merged with those rows and the
+        files replaced in one go. Returns the number of rows added. """
+        _dir = os.path.join(self.archive_dir, day, str(dev_uid))
+        _fields = TRACKER_FIELDS if dev_uid else SENSOR_FIELDS
+        _index = read_index(_dir)
+        _new = {
+            TIME_FIELD: numpy.array(columns[TIME_FIELD], dtype=TIME_DTYPE),
+            "id": numpy.array(columns["id"], dtype="<i8"),
+        }
+        for _field, _dtype in _fields:
+            _new[_field] = numpy.array(columns[_field], dtype=_dtype)
+        _same_database = _index is not None and\
+            _index.get("database_id", database_id) == database_id
+        if _index is not None:
+            # Rows from an interrupted run may already be here. Ids from a
+            # database since replaced mean nothing, so then go by time.
+            if _same_database:
+                _keep = _new["id"] > _index["last_id"]
+            else:
+                _keep = _new[TIME_FIELD] > numpy.datetime64(_index["last"], "s")
+            if not _keep.any():
+                return 0
+            _new = {_name: _values[_keep] for _name, _values in _new.items()}
+        _order = numpy.argsort(_new[TIME_FIELD], kind="stable")
+        _new = {_name: _values[_order] for _name, _values in _new.items()}
+        _ids = _new.pop("id")
+        _last_id = int(_ids.max())
+        if _same_database:
+            _last_id = max(_last_id, _index["last_id"])
+        if _index is not None and\
+                _new[TIME_FIELD][0] >= numpy.datetime64(_index["last"], "s") and\
+                all(_append_rows(os.path.join(_dir, _name + ".npy"), _values, _index["count"])
+                    for _name, _values in _new.items()):
+            _index.update(
+                database_id=database_id,
+                count=_index["count"] + len(_ids),
+                last=str(_new[TIME_FIELD][-1]),
+                last_id=_last_id,
+                hour_offsets=(
+                    numpy.array(_index["hour_offsets"]) + _hour_offsets(day, _new[TIME_FIELD])
+                ).tolist(),
+            )
+            _index_file_name = os.path.join(_dir, INDEX_FILE)
+            with open(_index_file_name + ".tmp", "w") as _index_file:
+                json.dump(_index, _index_file)
+            os.replace(_index_file_name + ".tmp", _index_file_name)
+            LOG.debug("Appended %d records for %s, device %s", len(_ids), day, dev_uid)
+            return len(_ids)
+        if _index is not None:
+            _existing = load_day(self.archive_dir, day, dev_uid, mmap=False)
+            _new = {
+                _name: numpy.concatenate((_existing[_name], _values))
+                for _name, _values in _new.items()
+            }
+        _order = numpy.argsort(_new[TIME_FIELD], kind="stable")
+        _temp_dir = _dir + ".new"
+        shutil.rmtree(_temp_dir, ignore_errors=True)
+        os.makedirs(_temp_dir)
+        for _name, _values in _new.items():
+            numpy.save(os.path.join(_temp_dir, _name + ".npy"), _values[_order])
+        _times = _new[TIME_FIELD][_order]
+        with open(os.path.join(_temp_dir, INDEX_FILE), "w") as _index_file:
+            json.dump({
+                "dev_uid": dev_uid,
+                "database_id": database_id,
+                "count": len(_times),
+                "first": str(_times[0]),
+                "last": str(_times[-1]),
+                "last_id": _last_id,
+                "fields": dict(((TIME_FIELD, TIME_DTYPE),) + _fields),
+                "hour_offsets": _hour_offsets(day, _times).tolist(),
+            }, _index_file)
+        _old_dir = _dir + ".old"
+        if os.path.isdir(_dir):
+            os.rename(_dir, _old_dir)
+        os.rename(_temp_dir, _dir)
+        shutil.rmtree(_old_dir, ignore_errors=True)
+        LOG.debug("Archived %d records for %s, device %s", len(_ids), day, dev_uid)
+        return len(_ids)
+
+    def _load_state(self):
+        """ Id of the last record archived """
+        try:
+            with open(os.path.join(self.archive_dir, STATE_FILE)) as _state_file:
+                return json.load(_state_file)
+        except (OSError, ValueError):
+            return {"last_id": 0}
+
+    def _save_state(self, state):
+        """ Replace the state file in one go """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        _state_file_name = os.path.join(self.archive_dir, STATE_FILE)
+        with open(_state_file_name + ".tmp", "w") as _state_file:
+            json.dump(state, _state_file)
+        os.replace(_state_file_name + ".tmp", _state_file_name)
+
+def _get_database_id(conn):
+    """ The database's id, given one on first use """
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS " + DATABASE_ID_TABLE + " (id TEXT NOT NULL)")
+        _row = conn.execute("SELECT id FROM " + DATABASE_ID_TABLE).fetchone()
+        if _row is None:
+            _row = (uuid.uuid4().hex,)
+            conn.execute("INSERT INTO " + DATABASE_ID_TABLE + " VALUES (?)", _row)
+    return _row[0]
+
+def _hour_offsets(day, times):
+    """ Number of (sorted) times before each hour of the day, and the next """
+    return numpy.searchsorted(times, numpy.datetime64(day, "h") + numpy.arange(25))
+
+def _append_rows(path, values, count):
+    """ Write values after the first count rows of a 1-d .npy file, and make
+    that the length in its header. Anything after those rows (left by an
+    append cut short) is overwritten. Returns False, changing nothing, if the
+    file's header would no longer fit. """
+    with open(path, "r+b") as _npy_file:
+        _version = numpy.lib.format.read_magic(_npy_file)
+        if _version not in _NPY_HEADERS:
+            return False
+        _read_header, _write_header = _NPY_HEADERS[_version]
+        _dtype = _read_header(_npy_file)[2]
+        _data_offset = _npy_file.tell()
+        _header = io.BytesIO()
+        _write_header(_header, {
+            "descr": numpy.lib.format.dtype_to_descr(_dtype),
+            "fortran_order": False,
+            "shape": (count + len(values),),
+        })
+        if _header.tell() != _data_offset:
+            return False
+        _npy_file.seek(_data_offset + count * _dtype.itemsize)
+        _npy_file.write(numpy.ascontiguousarray(values, dtype=_dtype).tobytes())
+        _npy_file.truncate()
+        _npy_file.seek(0)
+        _npy_file.write(_header.getvalue())
+    return True
+
+def _add_record(columns, row_id, payload, dev_uid):
+    """ Add a stored payload to the columns of its day and device. Events,
+    and unreadable payloads, are left out. """
+    try:
+        _payload = json.loads(payload.replace("'", '"'))
+    except ValueError:
+        LOG.warning("Record %d not archived, unreadable", row_id)
+        return
+    if "event" in _payload:
+        return
+    _data = _payload.get("rfproxy", _payload)
+    _timestamp = _data.get("timestamp")
+    if not _timestamp:
+        return
+    _fields = TRACKER_FIELDS if dev_uid else SENSOR_FIELDS
+    _day_columns = columns.get((_timestamp[:10], dev_uid))
+    if _day_columns is None:
+        _day_columns = columns[(_timestamp[:10], dev_uid)] = {
+            _name: [] for _name in [TIME_FIELD, "id"] + [_field for _field, _dtype in _fields]
+        }
+    _day_columns[TIME_FIELD].append(_timestamp)
+    _day_columns["id"].append(row_id)
+    for _field, _dtype in _fields:
+        _value = _data.get(_field)
+        _day_columns[_field].append(_value if _value is not None else numpy.nan)
+
+def days(archive_dir):
+    """ Days in the archive, oldest first """
+    try:
+        return sorted(
+            _name for _name in os.listdir(archive_dir)
+            if os.path.isdir(os.path.join(archive_dir, _name))
+        )
+    except OSError:
+        return []
+
+def read_index(day_dir):
+    """ A day and device's index, or None if there is nothing archived """
+    try:
+        with open(os.path.join(day_dir, INDEX_FILE)) as _index_file:
+            return json.load(_index_file)
+    except OSError:
+        return None
+
+def load_day(archive_dir, day, dev_uid, fields=None, start=None, end=None, mmap=True):
+    """ A day's records from a device, as {field: array}, always including the
+    time (as datetime64[s]). start and end (inclusive, datetime64 or
+    "YYYY-MM-DD HH:MM:SS") narrow it down using the hourly index. Arrays are
+    read-only memory maps, unless mmap is False. Returns None if there is
+    nothing archived. """
+    _dir = os.path.join(archive_dir, day, str(dev_uid))
+    _index = read_index(_dir)
+    if _index is None:
+        return None
+    _names = [TIME_FIELD] + [
+        _name for _name in (fields or _index["fields"]) if _name != TIME_FIELD
+    ]
+    _mmap_mode = "r" if mmap else None
+    _times = numpy.load(os.path.join(_dir, TIME_FIELD + ".npy"), mmap_mode=_mmap_mode)
+    _first, _last = 0, _index["count"]
+    _offsets = _index["hour_offsets"]
+    if start is not None:
+        _start = numpy.datetime64(start, "s")
+        _hour = int((_start - numpy.datetime64(day, "h")) / numpy.timedelta64(1, "h"))
+        _from = _offsets[min(max(_hour, 0), 24)]
+        _first = _from + int(numpy.searchsorted(_times[_from:_last], _start))
+    if end is not None:
+        _end = numpy.datetime64(end, "s")
+        _hour = int((_end - numpy.datetime64(day, "h")) / numpy.timedelta64(1, "h")) + 1
+        _to = _offsets[min(max(_hour, 0), 24)]
+        _last = max(_first, int(numpy.searchsorted(_times[:_to], _end, side="right")))
+    _columns = {}
+    for _name in _names:
+        _values = _times if _name == TIME_FIELD else\
+            numpy.load(os.path.join(_dir, _name + ".npy"), mmap_mode=_mmap_mode)
+        _columns[_name] = _values[_first:_last]
+    return _columns
+
+def load(archive_dir, dev_uid, start=None, end=None, fields=None):
+    """ A device's records between start and end (inclusive, as for load_day),
+    over as many days as needed, as {field: array} """
+    _start_day = str(start)[:10] if start is not None else None
+    _end_day = str(end)[:10] if end is not None else None
+    _parts = []
+    for _day in days(archive_dir):
+        if (_start_day and _day < _start_day) or (_end_day and _day > _end_day):
+            continue
+        _columns = load_day(
+            archive_dir, _day, dev_uid, fields,
+            start if _day == _start_day else None, end if _day == _end_day else None
+        )
+        if _columns is not None:
+            _parts.append(_columns)
+    if not _parts:
+        return None
+    if len(_parts) == 1:
+        return _parts[0]
+    return {
+        _name: numpy.concatenate([_part[_name] for _part in _parts]) for _name in _parts[0]
+    }
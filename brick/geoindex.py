@@ -0,0 +1,93 @@
+""" geoindex.py
+Grid based spatial index of geo points (e.g. the riot-geo-data table), so that
+a position only needs to be checked against the points in nearby grid cells,
+rather than against every point.
+"""
+
+from math import cos, radians, floor
+import haversine
+
+# Roughly 11km (north-south) per cell
+DEFAULT_CELL_SIZE_DEG = 0.1
+_KM_PER_DEGREE_LATITUDE = 111.195
+
+class GeoIndex():
+    """ Geo points bucketed into a fixed grid of latitude / longitude cells.
+    Each geo point needs "latitude", "longitude" and "approach_distance_km". """
+
+    def __init__(self, geo_points, cell_size_deg=DEFAULT_CELL_SIZE_DEG):
+        """ Build the index. Coordinates are converted to float once here, as
+        DynamoDB hands them over as Decimal. """
+        self.cell_size_deg = cell_size_deg
+        self.cells = {}
+        self.size = 0
+        # A point can only be approached from within its own approach distance,
+        # so nothing further away than the largest of these is of interest
+        self.max_approach_distance_km = 0.0
+        for _geo_point in geo_points:
+            _position = (float(_geo_point["latitude"]), float(_geo_point["longitude"]))
+            _approach_distance_km = float(_geo_point["approach_distance_km"])
+            self.cells.setdefault(self._cell(_position), []).append(
+                (haversine.ReferencePoint(_position), _approach_distance_km, _geo_point)
+            )
+            self.max_approach_distance_km = max(
+                self.max_approach_distance_km, _approach_distance_km
+            )
+            self.size += 1
+
+    def candidates(self, position, radius_km):
+        """ Entries (reference point, approach distance, geo point) in the cells
+        that overlap a bounding box of radius_km around position. """
+        _lat, _long = float(position[0]), float(position[1])
+        _lat_delta = radius_km / _KM_PER_DEGREE_LATITUDE
+        # Longitude degrees shrink towards the poles; near them just take the lot
+        _cos_lat = cos(radians(min(abs(_lat) + _lat_delta, 90.0)))
+        if _cos_lat < 1e-6:
+            _long_delta = 180.0
+        else:
+            _long_delta = min(_lat_delta / _cos_lat, 180.0)
+        _lat_cells = range(
+            self._index(_lat - _lat_delta), self._index(_lat + _lat_delta) + 1
+        )
+        _long_cells = range(
+            self._index(_long - _long_delta), self._index(_long + _long_delta) + 1
+        )
+        _long_cell_count = int(round(360.0 / self.cell_size_deg))
+        # Wrap around the antimeridian, without visiting a cell twice
+        _long_keys = set(_cell % _long_cell_count for _cell in _long_cells)
+        for _lat_cell in _lat_cells:
+            for _long_cell in _long_keys:
+                for _entry in self.cells.get((_lat_cell, _long_cell), ()):
+                    if abs(_entry[0].point[0] - _lat) <= _lat_delta:
+                        yield _entry
+
+    def nearby(self, position):
+        """ Geo points that position is within the approach distance of, as
+        (geo point, distance in km) tuples, nearest first. """
+        _nearby = []
+        position = (float(position[0]), float(position[1]))
+        for _reference, _approach_distance_km, _geo_point in self.candidates(
+                position, self.max_approach_distance_km):
+            _distance_km = _reference.distance(position)
+            if _distance_km < _approach_distance_km:
+                _nearby.append((_geo_point, _distance_km))
+        _nearby.sort(key=lambda _match: _match[1])
+        return _nearby
+
+    def find(self, key, value):
+        """ First geo point whose key matches value (compared as strings), or
+        None. Looks at every point, so is for occasional lookups only. """
+        for _entries in self.cells.values():
+            for _reference, _approach_distance_km, _geo_point in _entries:
+                if str(_geo_point.get(key)) == str(value):
+                    return _geo_point
+        return None
+
+    def _cell(self, position):
+        """ Grid cell a position falls in """
+        _long_cell_count = int(round(360.0 / self.cell_size_deg))
+        return (self._index(position[0]), self._index(position[1]) % _long_cell_count)
+
+    def _index(self, degrees):
+        """ Grid index along one axis """
+        return int(floor(degrees / self.cell_size_deg))
@@ -0,0 +1,273 @@
+from math import radians, cos, sin, asin, sqrt, pi
+from enum import Enum
+from collections import namedtuple
+
+
+# mean earth radius - https://en.wikipedia.org/wiki/Earth_radius#Mean_radius
+_AVG_EARTH_RADIUS_KM = 6371.0088
+
+
+class Unit(Enum):
+    """
+    Enumeration of supported units.
+    The full list can be checked by iterating over the class; e.g.
+    the expression `tuple(Unit)`.
+    """
+
+    KILOMETERS = 'km'
+    METERS = 'm'
+    MILES = 'mi'
+    NAUTICAL_MILES = 'nmi'
+    FEET = 'ft'
+    INCHES = 'in'
+
+
+# Unit values taken from http://www.unitconversion.org/unit_converter/length.html
+_CONVERSIONS = {Unit.KILOMETERS:       1.0,
+                Unit.METERS:           1000.0,
+                Unit.MILES:            0.621371192,
+                Unit.NAUTICAL_MILES:   0.539956803,
+                Unit.FEET:             3280.839895013,
+                Unit.INCHES:           39370.078740158}
+
+# Earth radius per unit, keyed by both Unit members and their abbreviations
+_RADIUS_BY_UNIT = {}
+for _unit, _conversion in _CONVERSIONS.items():
+    _RADIUS_BY_UNIT[_unit] = _RADIUS_BY_UNIT[_unit.value] = _AVG_EARTH_RADIUS_KM * _conversion
+
+# The fast distance mode uses an equirectangular approximation for distances below
+# FAST_DISTANCE_LIMIT_KM, as long as neither point is beyond FAST_DISTANCE_MAX_LATITUDE.
+# Within those limits its relative error (against haversine) is below FAST_DISTANCE_MAX_ERROR.
+FAST_DISTANCE_LIMIT_KM = 20.0
+FAST_DISTANCE_MAX_LATITUDE = 80.0
+FAST_DISTANCE_MAX_ERROR = 2e-5
+
+_RADIANS = pi / 180
+
+
+def haversine(point1, point2, unit=Unit.KILOMETERS):
+    """ Calculate the great-circle distance between two points on the Earth surface.
+
+    Takes two 2-tuples, containing the latitude and longitude of each point in decimal degrees,
+    and, optionally, a unit of length.
+
+    :param point1: first point; tuple of (latitude, longitude) in decimal degrees
+    :param point2: second point; tuple of (latitude, longitude) in decimal degrees
+    :param unit: a member of haversine.Unit, or, equivalently, a string containing the
+                 initials of its corresponding unit of measurement (i.e. miles = mi)
+                 default 'km' (kilometers).
+
+    Example: ``haversine((45.7597, 4.8422), (48.8567, 2.3508), unit=Unit.METERS)``
+
+    Precondition: ``unit`` is a supported unit (supported units are listed in the `Unit` enum)
+
+    :return: the distance between the two points in the requested unit, as a float.
+
+    The default returned unit is kilometers. The default unit can be changed by
+    setting the unit parameter to a member of ``haversine.Unit``
+    (e.g. ``haversine.Unit.INCHES``), or, equivalently, to a string containing the
+    corresponding abbreviation (e.g. 'in'). All available units can be found in the ``Unit`` enum.
+    """
+
+    # get earth radius in required units
+    unit = Unit(unit)
+    avg_earth_radius = _AVG_EARTH_RADIUS_KM * _CONVERSIONS[unit]
+
+    # unpack latitude/longitude
+    lat1, lng1 = point1
+    lat2, lng2 = point2
+
+    # convert all latitudes/longitudes from decimal degrees to radians
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+
+    # calculate haversine
+    lat = lat2 - lat1
+    lng = lng2 - lng1
+    d = sin(lat * 0.5) ** 2 + cos(lat1) * cos(lat2) * sin(lng * 0.5) ** 2
+
+    return 2 * avg_earth_radius * asin(sqrt(d))
+
+
+class ReferencePoint(object):
+    """ A point that distances are repeatedly measured from, such as the last GPS fix
+    or a geo point. Its radians, sine and cosine are worked out once, up front.
+
+    Example: ``ReferencePoint((51.8837, -3.4366)).distance((51.8696, -3.4727))``
+    """
+
+    __slots__ = ("point", "lat", "lng", "cos_lat", "sin_lat", "fast")
+
+    def __init__(self, point):
+        """
+        :param point: tuple of (latitude, longitude) in decimal degrees
+        """
+        self.point = point
+        self.lat, self.lng = radians(point[0]), radians(point[1])
+        self.cos_lat, self.sin_lat = cos(self.lat), sin(self.lat)
+        self.fast = abs(point[0]) <= FAST_DISTANCE_MAX_LATITUDE
+
+    def distance(self, point, unit=Unit.KILOMETERS):
+        """ Distance to another point, using the fast mode where accurate enough
+        (see FAST_DISTANCE_LIMIT_KM), and haversine otherwise.
+
+        :param point: tuple of (latitude, longitude) in decimal degrees
+        :param unit: as for ``haversine``
+
+        :return: the distance between the two points in the requested unit, as a float.
+        """
+        try:
+            avg_earth_radius = _RADIUS_BY_UNIT[unit]
+        except KeyError:
+            avg_earth_radius = _AVG_EARTH_RADIUS_KM * _CONVERSIONS[Unit(unit)]
+        lat2, lng2 = radians(point[0]), radians(point[1])
+        lat = lat2 - self.lat
+        lng = lng2 - self.lng
+        # Shortest way round, across the antimeridian if need be
+        if lng > pi:
+            lng -= 2 * pi
+        elif lng < -pi:
+            lng += 2 * pi
+        if self.fast and abs(point[0]) <= FAST_DISTANCE_MAX_LATITUDE:
+            # cos() of the mean latitude, from the cached sine / cosine of this point
+            # (small angle approximations for half the latitude difference)
+            half_lat = lat * 0.5
+            x = lng * (self.cos_lat * (1 - half_lat * half_lat * 0.5) - self.sin_lat * half_lat)
+            distance_km = _AVG_EARTH_RADIUS_KM * sqrt(x * x + lat * lat)
+            if distance_km < FAST_DISTANCE_LIMIT_KM:
+                return distance_km * avg_earth_radius / _AVG_EARTH_RADIUS_KM
+        d = sin(lat * 0.5) ** 2 + self.cos_lat * cos(lat2) * sin(lng * 0.5) ** 2
+        return 2 * avg_earth_radius * asin(sqrt(min(d, 1.0)))
+
+
+def distance(point1, point2, unit=Unit.KILOMETERS):
+    """ Distance between two points, using a fast equirectangular approximation
+    for short distances (see FAST_DISTANCE_LIMIT_KM) and haversine otherwise.
+
+    When measuring from the same point repeatedly, ``ReferencePoint`` is faster still.
+
+    :param point1: first point; tuple of (latitude, longitude) in decimal degrees
+    :param point2: second point; tuple of (latitude, longitude) in decimal degrees
+    :param unit: as for ``haversine``
+
+    :return: the distance between the two points in the requested unit, as a float.
+    """
+    try:
+        avg_earth_radius = _RADIUS_BY_UNIT[unit]
+    except KeyError:
+        avg_earth_radius = _AVG_EARTH_RADIUS_KM * _CONVERSIONS[Unit(unit)]
+    lat1, lng1 = point1
+    lat2, lng2 = point2
+    fast = abs(lat1) <= FAST_DISTANCE_MAX_LATITUDE and abs(lat2) <= FAST_DISTANCE_MAX_LATITUDE
+    lat1, lng1, lat2, lng2 = lat1 * _RADIANS, lng1 * _RADIANS, lat2 * _RADIANS, lng2 * _RADIANS
+    lat = lat2 - lat1
+    lng = lng2 - lng1
+    if fast:
+        # Shortest way round, across the antimeridian if need be
+        if lng > pi:
+            lng -= 2 * pi
+        elif lng < -pi:
+            lng += 2 * pi
+        x = lng * cos((lat1 + lat2) * 0.5)
+        distance_km = _AVG_EARTH_RADIUS_KM * sqrt(x * x + lat * lat)
+        if distance_km < FAST_DISTANCE_LIMIT_KM:
+            return distance_km * avg_earth_radius / _AVG_EARTH_RADIUS_KM
+    d = sin(lat * 0.5) ** 2 + cos(lat1) * cos(lat2) * sin(lng * 0.5) ** 2
+    return 2 * avg_earth_radius * asin(sqrt(min(d, 1.0)))
+
+
+# Vectorised functions, working on NumPy arrays of many points at once.
+# Results match ``haversine`` to within a relative error of 1e-9.
+# NumPy is only imported once one of them is used, as it is slow to import
+# and most callers (such as riot-check-proximity) only measure single distances.
+
+RadianPoints = namedtuple("RadianPoints", ["lat", "lng", "cos_lat"])
+RadianPoints.__doc__ = """Points prepared for the vectorised functions: latitude and longitude
+in radians, and the cosine of the latitude. Preparing points once saves
+redoing the conversion (and cosines) every time they are used."""
+
+
+def prepare_points(points):
+    """ Convert points into radians, and precompute their cosines.
+
+    :param points: array-like of shape (n, 2), or a single (latitude, longitude)
+                   pair, in decimal degrees. Already prepared points are passed through.
+
+    :return: a ``RadianPoints`` of NumPy arrays (or of floats, for a single pair).
+    """
+    if isinstance(points, RadianPoints):
+        return points
+    numpy = _numpy()
+    _degrees = numpy.asarray(points, dtype=numpy.float64)
+    if not _degrees.size:
+        _degrees = _degrees.reshape(0, 2)
+    _radians = numpy.radians(_degrees)
+    lat = _radians[..., 0]
+    lng = _radians[..., 1]
+    return RadianPoints(lat, lng, numpy.cos(lat))
+
+
+def haversine_one_to_many(point, points, unit=Unit.KILOMETERS):
+    """ Distances from one point to each of many points.
+
+    :param point: (latitude, longitude) in decimal degrees, or prepared with ``prepare_points``
+    :param points: array-like of shape (n, 2) in decimal degrees, or prepared
+    :param unit: as for ``haversine``
+
+    :return: NumPy array of n distances.
+    """
+    return _haversine_arrays(prepare_points(point), prepare_points(points), unit)
+
+
+def haversine_pairwise(points1, points2, unit=Unit.KILOMETERS):
+    """ Distances between corresponding points of two equally long arrays, i.e.
+    from ``points1[i]`` to ``points2[i]``.
+
+    :param points1: array-like of shape (n, 2) in decimal degrees, or prepared
+    :param points2: array-like of shape (n, 2) in decimal degrees, or prepared
+    :param unit: as for ``haversine``
+
+    :return: NumPy array of n distances.
+    """
+    return _haversine_arrays(prepare_points(points1), prepare_points(points2), unit)
+
+
+def haversine_track(points, unit=Unit.KILOMETERS):
+    """ Cumulative distance along a track (e.g. a GPX track segment).
+
+    :param points: array-like of shape (n, 2) in decimal degrees, or prepared, in track order
+    :param unit: as for ``haversine``
+
+    :return: NumPy array of n distances, from the first point to each point
+             along the track. The first element is always 0 (and the array is
+             empty if there are no points).
+    """
+    numpy = _numpy()
+    points = prepare_points(points)
+    if not numpy.size(points.lat):
+        return numpy.zeros(0)
+    _legs = _haversine_arrays(
+        RadianPoints(points.lat[:-1], points.lng[:-1], points.cos_lat[:-1]),
+        RadianPoints(points.lat[1:], points.lng[1:], points.cos_lat[1:]),
+        unit
+    )
+    return numpy.concatenate(([0.0], numpy.cumsum(_legs)))
+
+
+def _numpy():
+    """ NumPy, imported on first use """
+    try:
+        import numpy    # pylint: disable=import-outside-toplevel
+    except ImportError as ex:
+        raise ImportError("The vectorised haversine functions need NumPy") from ex
+    return numpy
+
+
+def _haversine_arrays(points1, points2, unit):
+    """ Haversine over prepared points, broadcasting as NumPy does """
+    numpy = _numpy()
+    avg_earth_radius = _AVG_EARTH_RADIUS_KM * _CONVERSIONS[Unit(unit)]
+    lat = points2.lat - points1.lat
+    lng = points2.lng - points1.lng
+    d = numpy.sin(lat * 0.5) ** 2 + points1.cos_lat * points2.cos_lat * numpy.sin(lng * 0.5) ** 2
+    # Rounding can take d fractionally above 1 for antipodal points
+    return 2 * avg_earth_radius * numpy.arcsin(numpy.sqrt(numpy.minimum(d, 1.0)))
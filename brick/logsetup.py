@@ -0,0 +1,146 @@
+""" logsetup.py
+Logging for the brick daemons, configured from the "logging" section of the brick
+config. Messages are only formatted if their level is enabled (so pass values as
+arguments, e.g. LOG.debug("Payload %s", payload)), and are written to the console
+(i.e. the Supervisor log) by a background thread, from a bounded ring buffer, so
+that a slow SD card does not hold up sampling. If the buffer fills, the oldest
+messages are dropped, and the number dropped is logged.
+Errors are written straight away, preceded by the most recent messages below the
+output level (context_level, if lower than log_level), which are otherwise kept
+in memory only. Uncaught exceptions are logged as critical, before exiting.
+"""
+
+import sys
+import queue
+import atexit
+import logging
+import collections
+import logging.handlers
+
+DEFAULT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_STATE = {"listener": None}
+
+class RingBufferQueue(queue.Queue):
+    """ Bounded queue that drops the oldest record, rather than blocking the
+    producer, when full """
+
+    def __init__(self, maxsize):
+        """ maxsize must be at least 1 """
+        super().__init__(maxsize)
+        self.dropped = 0
+
+    def put_nowait(self, item):
+        """ Add a record, making room if need be """
+        while True:
+            try:
+                return super().put_nowait(item)
+            except queue.Full:
+                try:
+                    super().get_nowait()
+                except queue.Empty:
+                    continue
+                self.task_done()
+                self.dropped += 1
+
+class FlushOnErrorQueueHandler(logging.handlers.QueueHandler):
+    """ Queues records for the background thread. Records at flush_level or above
+    wait until everything queued so far (including them) has been written. """
+
+    def __init__(self, log_queue, flush_level=logging.ERROR):
+        """ log_queue is a RingBufferQueue """
+        super().__init__(log_queue)
+        self.flush_level = flush_level
+
+    def emit(self, record):
+        """ Queue the record, then wait for the writer if it is serious """
+        super().emit(record)
+        if record.levelno >= self.flush_level and _STATE["listener"] is not None:
+            self.queue.join()
+
+class ContextHandler(logging.Handler):
+    """ Writes records at output_level or above to target. Lower records are
+    kept (the most recent context_size of them), and only written just before
+    a record at flush_level or above. """
+
+    def __init__(self, target, output_level, context_size, flush_level=logging.ERROR):
+        """ Everything passed to this handler is either written or kept """
+        super().__init__(logging.NOTSET)
+        self.target = target
+        self.output_level = output_level
+        self.flush_level = flush_level
+        self.context = collections.deque(maxlen=max(context_size, 1))
+        self.log_queue = None
+
+    def emit(self, record):
+        """ Write, or keep, a record """
+        _dropped = self.log_queue.dropped if self.log_queue is not None else 0
+        if _dropped:
+            self.log_queue.dropped = 0
+            self.target.handle(logging.makeLogRecord({
+                "name": record.name, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": "%d log records dropped", "args": (_dropped,),
+            }))
+        if record.levelno < self.output_level:
+            self.context.append(record)
+            return
+        if record.levelno >= self.flush_level:
+            while self.context:
+                self.target.handle(self.context.popleft())
+        self.target.handle(record)
+
+    def flush(self):
+        """ Flush the target """
+        self.target.flush()
+
+def configure(logging_config, service):
+    """ Set up logging for a daemon, and return its logger. Safe to call more
+    than once (e.g. when several services share one process); only the first
+    call starts the writer. """
+    _logger = logging.getLogger("riot." + service)
+    if _STATE["listener"] is not None:
+        return _logger
+    _output_level = _level(logging_config.get("log_level", "INFO"))
+    _context_level = min(_level(logging_config.get("context_level", "INFO")), _output_level)
+    _target = logging.StreamHandler(sys.stdout)
+    _target.setFormatter(logging.Formatter(logging_config.get("log_format", DEFAULT_FORMAT)))
+    _context_handler = ContextHandler(
+        _target, _output_level, logging_config.get("context_size", 100)
+    )
+    _log_queue = RingBufferQueue(logging_config.get("buffer_size", 1000))
+    _context_handler.log_queue = _log_queue
+    _root = logging.getLogger("riot")
+    _root.setLevel(_context_level)
+    _root.propagate = False
+    _root.addHandler(FlushOnErrorQueueHandler(_log_queue))
+    _listener = logging.handlers.QueueListener(_log_queue, _context_handler)
+    _listener.start()
+    _STATE["listener"] = _listener
+    atexit.register(shutdown)
+    sys.excepthook = _log_uncaught_exception
+    return _logger
+
+def shutdown():
+    """ Write everything still queued, and stop the writer """
+    _listener = _STATE["listener"]
+    if _listener is not None:
+        _STATE["listener"] = None
+        _listener.stop()
+        for _handler in _listener.handlers:
+            _handler.flush()
+
+def _log_uncaught_exception(exc_type, exc_value, exc_traceback):
+    """ Log (with context) whatever is about to end the process """
+    if issubclass(exc_type, KeyboardInterrupt):
+        sys.__excepthook__(exc_type, exc_value, exc_traceback)
+        return
+    logging.getLogger("riot").critical(
+        "Uncaught exception", exc_info=(exc_type, exc_value, exc_traceback)
+    )
+
+def _level(name):
+    """ Level number from a name such as "DEBUG" """
+    _number = logging.getLevelName(str(name).upper())
+    if not isinstance(_number, int):
+        raise ValueError("Unknown log level " + str(name))
+    return _number
@@ -0,0 +1,245 @@
+""" metrics.py
+Counters, gauges and latency histograms for the brick daemons, exported in the
+Prometheus text format, to a file (for node_exporter's textfile collector) and / or
+a local HTTP endpoint. Configured from the "metrics" section of the brick config.
+When disabled, every metric is a shared object whose methods do nothing.
+"""
+
+import os
+import time
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Latency buckets in seconds, from a quick SQLite insert up to a slow upload
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_REGISTRY = {
+    "enabled": False,
+    "service": None,
+    "config": {},
+    "metrics": [],
+}
+_LOCK = threading.Lock()
+LOG = logging.getLogger("riot.metrics")
+
+class Counter():
+    """ Value that only goes up, optionally split by label values """
+
+    def __init__(self, name, help_text, label_name=None):
+        """ Label values are added as they are first used """
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.values = {}
+
+    def inc(self, amount=1, label=None):
+        """ Add to the count """
+        self.values[label] = self.values.get(label, 0) + amount
+
+    def samples(self):
+        """ (name, labels, value) for the exposition """
+        return [
+            (self.name, _labels(self.label_name, _label), _value)
+            for _label, _value in sorted(self.values.items(), key=lambda _item: str(_item[0]))
+        ]
+
+class Gauge(Counter):
+    """ Value that is set, e.g. a queue depth """
+
+    def set(self, value, label=None):
+        """ Replace the value """
+        self.values[label] = value
+
+class Histogram():
+    """ Distribution of durations (or sizes) in fixed buckets """
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        """ Buckets are upper bounds, in increasing order """
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """ Record one value """
+        self.count += 1
+        self.sum += value
+        for _index, _bound in enumerate(self.buckets):
+            if value <= _bound:
+                self.counts[_index] += 1
+                break
+
+    def time(self):
+        """ Context manager that observes the time spent inside it """
+        return _Timer(self)
+
+    def samples(self):
+        """ (name, labels, value) for the exposition, with cumulative buckets """
+        _samples = []
+        _cumulative = 0
+        for _bound, _count in zip(self.buckets, self.counts):
+            _cumulative += _count
+            _samples.append((self.name + "_bucket", '{le="' + repr(_bound) + '"}', _cumulative))
+        _samples.append((self.name + "_bucket", '{le="+Inf"}', self.count))
+        _samples.append((self.name + "_sum", "", self.sum))
+        _samples.append((self.name + "_count", "", self.count))
+        return _samples
+
+class _Timer():
+    """ Times a with block into a histogram """
+
+    def __init__(self, histogram):
+        """ Timing starts on entering the block """
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        """ Start timing """
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        """ Record the time, even if the block raised """
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class _NullMetric():
+    """ Stands in for every metric when metrics are disabled """
+
+    def inc(self, amount=1, label=None):
+        """ Nothing to count """
+
+    def set(self, value, label=None):
+        """ Nothing to set """
+
+    def observe(self, value):
+        """ Nothing to record """
+
+    def time(self):
+        """ A timer that does not time """
+        return self
+
+    def __enter__(self):
+        """ Nothing to start """
+        return self
+
+    def __exit__(self, *exc_info):
+        """ Nothing to record """
+        return False
+
+_NULL_METRIC = _NullMetric()
+
+def configure(metrics_config, service):
+    """ Enable (or not) metrics for this daemon. Must be called before its
+    metrics are created. """
+    _REGISTRY["enabled"] = bool(metrics_config.get("enabled", False))
+    _REGISTRY["service"] = service
+    _REGISTRY["config"] = metrics_config
+
+def enabled():
+    """ Whether metrics are being collected """
+    return _REGISTRY["enabled"]
+
+def counter(name, help_text, label_name=None):
+    """ New (or existing, by name) counter, or a no-op when disabled """
+    return _register(Counter(name, help_text, label_name)) if enabled() else _NULL_METRIC
+
+def gauge(name, help_text, label_name=None):
+    """ New (or existing, by name) gauge, or a no-op when disabled """
+    return _register(Gauge(name, help_text, label_name)) if enabled() else _NULL_METRIC
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    """ New (or existing, by name) histogram, or a no-op when disabled """
+    return _register(Histogram(name, help_text, buckets)) if enabled() else _NULL_METRIC
+
+def render():
+    """ All metrics in the Prometheus text exposition format """
+    _lines = []
+    with _LOCK:
+        _metrics = list(_REGISTRY["metrics"])
+    for _metric in _metrics:
+        _lines.append("# HELP " + _metric.name + " " + _metric.help_text)
+        _lines.append("# TYPE " + _metric.name + " " + _metric_type(_metric))
+        for _name, _labels_text, _value in _metric.samples():
+            _lines.append(_name + _labels_text + " " + repr(float(_value)))
+    return "\n".join(_lines) + "\n"
+
+def write_textfile(file_name):
+    """ Write the metrics, replacing the file in one go so that the collector
+    never reads half of it """
+    _temp_file = file_name + ".tmp"
+    with open(_temp_file, "w") as _metrics_file:
+        _metrics_file.write(render())
+    os.replace(_temp_file, file_name)
+
+def start():
+    """ Start the configured exporters, in background threads """
+    if not enabled():
+        return
+    _config = _REGISTRY["config"]
+    _service = _REGISTRY["service"]
+    if _config.get("textfile_dir"):
+        _file_name = os.path.join(_config["textfile_dir"], "riot_brick_" + _service + ".prom")
+        threading.Thread(
+            target=_write_textfile_loop,
+            args=(_file_name, _config.get("write_frequency_s", 15)),
+            name="metrics-textfile",
+            daemon=True
+        ).start()
+    _port = _config.get("http_ports", {}).get(_service)
+    if _port:
+        _server = HTTPServer((_config.get("http_address", "127.0.0.1"), int(_port)), _MetricsHandler)
+        threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """ Serves the metrics on any GET """
+
+    def do_GET(self):
+        """ Current metrics """
+        # pylint: disable=invalid-name
+        _body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def log_message(self, format, *args):
+        """ Scrapes are not worth a log line each """
+        # pylint: disable=redefined-builtin
+
+def _write_textfile_loop(file_name, frequency_s):
+    """ Write the textfile every frequency_s """
+    while True:
+        try:
+            write_textfile(file_name)
+        except OSError as ex:
+            LOG.warning("Metrics not written: %s", ex)
+        time.sleep(frequency_s)
+
+def _register(metric):
+    """ Add a metric to the exposition. Services sharing a process (see
+    riot-brick-runtime.py) share any metrics of the same name. """
+    with _LOCK:
+        for _existing in _REGISTRY["metrics"]:
+            if _existing.name == metric.name:
+                return _existing
+        _REGISTRY["metrics"].append(metric)
+    return metric
+
+def _metric_type(metric):
+    """ Prometheus type name """
+    if isinstance(metric, Histogram):
+        return "histogram"
+    if isinstance(metric, Gauge):
+        return "gauge"
+    return "counter"
+
+def _labels(label_name, label):
+    """ Label text for a sample, e.g. {status="200"} """
+    if label_name is None or label is None:
+        return ""
+    return "{" + label_name + '="' + str(label).replace("\\", "\\\\").replace('"', '\\"') + '"}'
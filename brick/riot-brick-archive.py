@@ -0,0 +1,58 @@
+""" riot-brick-archive.py
+Rolls uploaded records from the SQLite buffer into the columnar daily archive
+(see archive.py) every frequency_s, so that a trip can be analysed from NumPy
+arrays rather than by parsing every payload. With "purge" set, archived records
+are then deleted from the buffer. Records still not uploaded after
+max_pending_s are archived anyway.
+Run with --once to archive what is there and exit.
+"""
+
+import sys
+import time
+import json
+import logsetup
+import metrics
+import archive
+
+BRICK_CONFIG_FILE = "config/brick_config.json"
+with open(BRICK_CONFIG_FILE) as config_file:
+    BRICK_CONFIG = json.load(config_file)
+DEV_ID = BRICK_CONFIG["dev_id"]
+LOG = logsetup.configure(BRICK_CONFIG["logging"], "archiver")
+
+metrics.configure(BRICK_CONFIG.get("metrics", {}), "archiver")
+ARCHIVE_SECONDS = metrics.histogram(
+    "riot_brick_archive_seconds", "Time taken to archive newly uploaded records"
+)
+ARCHIVED = metrics.counter("riot_brick_archived_records_total", "Records archived")
+
+def main():
+    """ Archive every frequency_s, or once """
+    _archive_config = BRICK_CONFIG.get("archive", {})
+    _archiver = archive.Archiver(
+        _archive_config.get("archive_dir", "archive/"),
+        BRICK_CONFIG["database"]["sqlite_database"],
+        BRICK_CONFIG["database"]["sqlite_table"],
+        _archive_config.get("batch_size", 10000),
+        _archive_config.get("purge", False),
+        _archive_config.get("max_pending_s")
+    )
+    metrics.start()
+    while True:
+        _start_time = time.time()
+        with ARCHIVE_SECONDS.time():
+            _archived = _archiver.archive()
+        ARCHIVED.inc(_archived)
+        LOG.info("Archived %d records in %.1fs", _archived, time.time() - _start_time)
+        if "--once" in sys.argv[1:]:
+            break
+        _remaining_time = _archive_config.get("frequency_s", 3600) - int(time.time() - _start_time)
+        if _remaining_time > 0:
+            time.sleep(_remaining_time)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        LOG.info("Archiver stopped")
+        sys.exit()
@@ -0,0 +1,374 @@
+""" riot-brick-import.py
+Loads the brick's own logs - the daily sensor and rfproxy CSV files, and the
+GPX tracks - back into the SQLite buffer, e.g. after the database has been lost.
+Files are read a line (or track point) at a time, merged into time order, and
+stored (and added to the rollups, see rollups.py) in large transactions.
+Records already in the buffer (by device and timestamp) are skipped, and GPX
+points only fill in where the sensor CSV has no row within GPX_MATCH_S of
+them, as they carry position and altitude only.
+With --replay, the records are instead stored at N times the speed they were
+logged at (with timestamps moved to the time of replay), while the uploader
+runs, to load test the uploader and the cloud side with a real trip.
+python riot-brick-import.py [--mark-uploaded] [--replay N] [files or directories ...]
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import heapq
+import sqlite3
+import argparse
+import datetime
+import threading
+import collections
+import importlib.util
+import xml.etree.ElementTree as ElementTree
+import logsetup
+import rollups
+
+BRICK_CONFIG_FILE = "config/brick_config.json"
+with open(BRICK_CONFIG_FILE) as config_file:
+    BRICK_CONFIG = json.load(config_file)
+DEV_ID = BRICK_CONFIG["dev_id"]
+LOG = logsetup.configure(BRICK_CONFIG["logging"], "importer")
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Columns of the sensor CSV, as written by riot-brick-sensors.py
+SENSOR_COLUMNS = (
+    "timestamp", "position_lat", "position_long", "altitude", "temperature", "pressure",
+    "humidity", "light", "total_distance", "total_climb", "total_time",
+)
+# Where a GPX point and a CSV row share a time, the CSV row wins
+SOURCE_CSV = 0
+SOURCE_GPX = 1
+# The sensor daemon stamps a GPX point after the sensor reads and writes that
+# follow its CSV row's timestamp, often into the next second, so a GPX point
+# within this many seconds of a CSV row is taken as the same fix
+GPX_MATCH_S = 2
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "payload TEXT NOT NULL, dev_uid INTEGER NOT NULL, processed INTEGER NOT NULL DEFAULT 0)"
+)
+_TIMESTAMP_PATTERN = re.compile(r"'timestamp': '([^']*)'")
+
+def _number(text):
+    """ Value of a numeric CSV field, as the daemons had it """
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def read_sensor_csv(file_name, counts):
+    """ (timestamp, source, dev_uid, payload) for each sensor CSV row """
+    with open(file_name, newline="") as _csv_file:
+        for _row in csv.reader(_csv_file):
+            # Rows end with a comma; a row cut short by a power cut is skipped
+            if len(_row) < len(SENSOR_COLUMNS) or len(_row[0]) != 19:
+                counts["invalid"] += 1
+                continue
+            _payload = {}
+            try:
+                for _column, _text in zip(SENSOR_COLUMNS, _row):
+                    if _column == "timestamp":
+                        _payload[_column] = _text
+                    elif _text != "None":
+                        _payload[_column] = _number(_text)
+                    if _column == "position_long":
+                        _payload["location"] = _row[1] + "," + _row[2]
+            except ValueError:
+                counts["invalid"] += 1
+                continue
+            _payload["dev_id"] = DEV_ID
+            yield (_payload["timestamp"], SOURCE_CSV, 0, _payload)
+
+def read_rfproxy_csv(file_name, counts):
+    """ (timestamp, source, dev_uid, payload) for each rfproxy CSV row """
+    with open(file_name, newline="") as _csv_file:
+        for _row in csv.reader(_csv_file):
+            try:
+                _timestamp, _dev_uid, _latitude, _longitude = _row
+                _received_data = {
+                    "timestamp": _timestamp,
+                    "dev_uid": int(_dev_uid),
+                    "dev_id": "riot-tracker-" + str(int(_dev_uid)),
+                    "position_lat": float(_latitude),
+                    "position_long": float(_longitude),
+                }
+            except ValueError:
+                counts["invalid"] += 1
+                continue
+            if len(_timestamp) != 19:
+                counts["invalid"] += 1
+                continue
+            yield (
+                _timestamp, SOURCE_CSV, _received_data["dev_uid"],
+                {"rfproxy": _received_data, "dev_id": _received_data["dev_id"]}
+            )
+
+def read_gpx(file_name, counts):
+    """ (timestamp, source, dev_uid, payload) for each GPX track point. The file
+    is rewritten on every sample, so may end part way through. """
+    _point = None
+    try:
+        for _event, _element in ElementTree.iterparse(file_name, events=("start", "end")):
+            _tag = _element.tag.rsplit("}", 1)[-1]
+            if _event == "start":
+                if _tag == "trkpt":
+                    _point = {}
+                continue
+            if _point is None:
+                continue
+            if _tag in ("ele", "time"):
+                _point[_tag] = _element.text
+            elif _tag == "trkpt":
+                try:
+                    _timestamp = _point["time"][:19].replace("T", " ")
+                    _payload = {
+                        "timestamp": _timestamp,
+                        "position_lat": float(_element.get("lat")),
+                        "position_long": float(_element.get("lon")),
+                    }
+                    _payload["location"] =\
+                        str(_payload["position_lat"]) + "," + str(_payload["position_long"])
+                    if _point.get("ele") is not None:
+                        _payload["altitude"] = float(_point["ele"])
+                    _payload["dev_id"] = DEV_ID
+                except (KeyError, TypeError, ValueError):
+                    counts["invalid"] += 1
+                else:
+                    yield (_timestamp, SOURCE_GPX, 0, _payload)
+                _point = None
+                _element.clear()
+    except ElementTree.ParseError as ex:
+        LOG.warning("%s read up to: %s", file_name, ex)
+
+def find_log_files(paths):
+    """ (file name, reader) for each log file in paths (files or directories) """
+    _prefix = os.path.basename(BRICK_CONFIG["logging"]["file_name"])
+    _gpx_prefix = os.path.basename(BRICK_CONFIG["logging"]["gpx_file_name"])
+    _extension = "." + BRICK_CONFIG["logging"]["file_extension"]
+    _file_names = []
+    for _path in paths:
+        if os.path.isdir(_path):
+            _file_names.extend(
+                os.path.join(_path, _file_name) for _file_name in sorted(os.listdir(_path))
+            )
+        else:
+            _file_names.append(_path)
+    _log_files = []
+    for _file_name in _file_names:
+        _base_name = os.path.basename(_file_name)
+        if _base_name.startswith(_prefix + "rfproxy_") and _base_name.endswith(_extension):
+            _log_files.append((_file_name, read_rfproxy_csv))
+        elif _base_name.startswith(_prefix) and _base_name.endswith(_extension):
+            _log_files.append((_file_name, read_sensor_csv))
+        elif _base_name.startswith(_gpx_prefix) and _base_name.endswith(".gpx"):
+            _log_files.append((_file_name, read_gpx))
+    return _log_files
+
+def read_records(log_files, counts):
+    """ Records from all files, in time order (each file is in time order),
+    with CSV rows ahead of GPX points of the same time. Records from trackers
+    the uploader does not know are left out, as it could not upload them. """
+    _trackers = {int(_key) for _key in BRICK_CONFIG["uploader"]["trackers"]}
+    for _record in drop_gpx_duplicates(heapq.merge(
+            *[_reader(_file_name, counts) for _file_name, _reader in log_files],
+            key=lambda _record: _record[:2]
+        ), counts):
+        if _record[2] in _trackers:
+            yield _record
+        else:
+            counts["unknown"] += 1
+
+def drop_gpx_duplicates(records, counts):
+    """ Leave out GPX points within GPX_MATCH_S of a sensor CSV row. GPX points
+    are held back until the records have moved GPX_MATCH_S past them, so a
+    point can be up to that far out of order with other devices' records. """
+    _csv_seconds = collections.deque()
+    _gpx_points = collections.deque()
+    for _record in records:
+        _seconds = rollups.to_seconds(_record[0])
+        while _gpx_points and _gpx_points[0][0] < _seconds - GPX_MATCH_S:
+            yield _gpx_points.popleft()[1]
+        while _csv_seconds and _csv_seconds[0] < _seconds - GPX_MATCH_S:
+            _csv_seconds.popleft()
+        if _record[1] == SOURCE_GPX:
+            if _csv_seconds:
+                counts["duplicate"] += 1
+            else:
+                _gpx_points.append((_seconds, _record))
+        elif _record[2] == 0:
+            # Held back points are no more than GPX_MATCH_S older than this row
+            counts["duplicate"] += len(_gpx_points)
+            _gpx_points.clear()
+            _csv_seconds.append(_seconds)
+            yield _record
+        else:
+            yield _record
+    for _seconds, _record in _gpx_points:
+        yield _record
+
+def existing_keys(conn, table):
+    """ (dev_uid, timestamp) of the records in the buffer. Arrival events
+    share their fix's timestamp, so are left out. """
+    _keys = set()
+    for _payload, _dev_uid in conn.execute("SELECT payload, dev_uid FROM " + table):
+        if "'event': " in _payload:
+            continue
+        _match = _TIMESTAMP_PATTERN.search(_payload)
+        if _match:
+            _keys.add((_dev_uid, _match.group(1)))
+    return _keys
+
+def import_records(records, database, table, batch_size, mark_uploaded, counts):
+    """ Store records not already in the buffer, batch_size to a transaction """
+    _conn = sqlite3.connect(database)
+    _rollups = rollups.Rollups(BRICK_CONFIG.get("rollups", {}))
+    try:
+        _conn.execute(SCHEMA.format(table=table))
+        _conn.commit()
+        _rollups.create_tables(database, table)
+        _keys = existing_keys(_conn, table)
+        LOG.info("%d records already stored", len(_keys))
+        _insert = "INSERT INTO " + table + " (payload, dev_uid, processed) VALUES (?, ?, ?)"
+        _processed = 1 if mark_uploaded else 0
+        _batch = []
+        _batch_payloads = []
+        for _timestamp, _source, _dev_uid, _payload in records:
+            _key = (_dev_uid, _timestamp)
+            if _key in _keys:
+                counts["duplicate"] += 1
+                continue
+            _keys.add(_key)
+            _batch.append((str(_payload), _dev_uid, _processed))
+            _batch_payloads.append((_dev_uid, _payload))
+            counts["first"] = min(counts.get("first") or _timestamp, _timestamp)
+            counts["last"] = max(counts.get("last") or _timestamp, _timestamp)
+            if len(_batch) >= batch_size:
+                with _conn:
+                    _conn.executemany(_insert, _batch)
+                    _rollups.update(_conn, _batch_payloads)
+                counts["imported"] += len(_batch)
+                _batch = []
+                _batch_payloads = []
+        if _batch:
+            with _conn:
+                _conn.executemany(_insert, _batch)
+                _rollups.update(_conn, _batch_payloads)
+            counts["imported"] += len(_batch)
+    finally:
+        _conn.close()
+
+def load_uploader():
+    """ Import riot-brick-upload.py as a module (needs its environment variables) """
+    _file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), "riot-brick-upload.py")
+    _spec = importlib.util.spec_from_file_location("riot_brick_uploader", _file_name)
+    _module = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(_module)
+    return _module
+
+def replay(records, database, table, speed, counts):
+    """ Store records (one at a time, as the daemons do) at speed times the
+    rate they were logged at, with the uploader running every frequency_s / speed """
+    _uploader_module = load_uploader()
+    _uploader = _uploader_module.Uploader(_uploader_module.active_trackers)
+    _upload_frequency_s = BRICK_CONFIG["uploader"]["frequency_s"] / float(speed)
+    _stopped = threading.Event()
+
+    def _upload():
+        """ Upload cycles until the replay is over, then one more """
+        while not _stopped.wait(_upload_frequency_s):
+            _uploader.upload_cycle()
+        _uploader.upload_cycle()
+
+    _upload_thread = threading.Thread(target=_upload, name="uploader", daemon=True)
+    _upload_thread.start()
+    _conn = sqlite3.connect(database)
+    _rollups = rollups.Rollups(BRICK_CONFIG.get("rollups", {}))
+    _insert = "INSERT INTO " + table + " (payload, dev_uid) VALUES (?, ?)"
+    _first = None
+    _start_time = time.time()
+    try:
+        _conn.execute(SCHEMA.format(table=table))
+        _conn.commit()
+        _rollups.create_tables(database, table)
+        for _timestamp, _source, _dev_uid, _payload in records:
+            _logged = datetime.datetime.strptime(_timestamp, TIMESTAMP_FORMAT)
+            if _first is None:
+                _first = _logged
+            _offset_s = (_logged - _first).total_seconds() / speed
+            _delay_s = _start_time + _offset_s - time.time()
+            if _delay_s > 0:
+                time.sleep(_delay_s)
+            _replayed = datetime.datetime.now().strftime(TIMESTAMP_FORMAT)
+            _payload["timestamp"] = _replayed
+            if "rfproxy" in _payload:
+                _payload["rfproxy"]["timestamp"] = _replayed
+            with _conn:
+                _conn.execute(_insert, (str(_payload), _dev_uid))
+                _rollups.update(_conn, [(_dev_uid, _payload)])
+            counts["imported"] += 1
+            counts["first"] = counts.get("first") or _timestamp
+            counts["last"] = _timestamp
+    finally:
+        _conn.close()
+        _stopped.set()
+        _upload_thread.join()
+
+def main():
+    """ Import (or replay) the given logs, by default the brick's log directory """
+    _parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    _parser.add_argument(
+        "paths", nargs="*",
+        default=[os.path.dirname(BRICK_CONFIG["logging"]["file_name"]) or "."],
+        help="Log files, or directories of them"
+    )
+    _parser.add_argument("--batch-size", type=int, default=10000,
+                         help="Records stored per transaction")
+    _parser.add_argument("--mark-uploaded", action="store_true",
+                         help="Store records as already uploaded, so they are not sent again")
+    _parser.add_argument("--replay", type=float, metavar="SPEED",
+                         help="Replay through the uploader at SPEED times realtime instead")
+    _args = _parser.parse_args()
+    _log_files = find_log_files(_args.paths)
+    if not _log_files:
+        LOG.error("No log files found in %s", ", ".join(_args.paths))
+        sys.exit(1)
+    LOG.info("Reading %d log files", len(_log_files))
+    _counts = {
+        "imported": 0, "duplicate": 0, "invalid": 0, "unknown": 0, "first": None, "last": None
+    }
+    _records = read_records(_log_files, _counts)
+    _database = BRICK_CONFIG["database"]["sqlite_database"]
+    _table = BRICK_CONFIG["database"]["sqlite_table"]
+    _start_time = time.time()
+    if _args.replay:
+        replay(_records, _database, _table, _args.replay, _counts)
+    else:
+        import_records(
+            _records, _database, _table, _args.batch_size, _args.mark_uploaded, _counts
+        )
+    _elapsed_s = time.time() - _start_time
+    _span_s = 0.0
+    if _counts["first"] is not None:
+        _span_s = (
+            datetime.datetime.strptime(_counts["last"], TIMESTAMP_FORMAT) -
+            datetime.datetime.strptime(_counts["first"], TIMESTAMP_FORMAT)
+        ).total_seconds()
+    LOG.info(
+        "%s %d records (%d duplicates, %d invalid, %d from unknown trackers) "
+        "covering %.1f h in %.1f s (%.0fx realtime)",
+        "Replayed" if _args.replay else "Imported",
+        _counts["imported"], _counts["duplicate"], _counts["invalid"], _counts["unknown"],
+        _span_s / 3600.0, _elapsed_s, _span_s / max(_elapsed_s, 0.001)
+    )
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        LOG.info("Import stopped")
+        sys.exit()
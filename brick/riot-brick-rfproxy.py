@@ -9,11 +9,30 @@ import datetime
 import json
 import sqlite3
 import nrf24
+import metrics
+import logsetup
+import rollups
 
 BRICK_CONFIG_FILE = "config/brick_config.json"
 with open(BRICK_CONFIG_FILE) as config_file:
     BRICK_CONFIG = json.load(config_file)
 DEV_ID = BRICK_CONFIG["dev_id"]
+LOG = logsetup.configure(BRICK_CONFIG["logging"], "rfproxy")
+
+metrics.configure(BRICK_CONFIG.get("metrics", {}), "rfproxy")
+PACKETS = metrics.counter(
+    "riot_brick_rf_packets_total", "Packets received, by result", "result"
+)
+PACKET_SECONDS = metrics.histogram(
+    "riot_brick_rf_packet_seconds", "Time taken to decode and store a received packet"
+)
+LAST_PACKET_TIME = metrics.gauge(
+    "riot_brick_rf_last_packet_timestamp_seconds", "When each tracker was last heard from",
+    "dev_uid"
+)
+SQLITE_INSERT_SECONDS = metrics.histogram(
+    "riot_brick_sqlite_insert_seconds", "Time taken to store a payload in the buffer"
+)
 
 class NRF():
     """ Represents the nRF24L01+ transceiver.
@@ -54,32 +73,50 @@ class NRF():
         self.cur = None
         self.sensor_database = brick_config["database"]["sqlite_database"]
         self.sensor_data_table = brick_config["database"]["sqlite_table"]
-        printf("RF-proxy controller initialised")
+        # Set to a shared in-memory buffer, to store payloads through that instead
+        self.buffer = None
+        # Aggregates kept up to date as payloads are stored
+        self.rollups = rollups.Rollups(brick_config.get("rollups", {}))
+        self.rollups.create_tables(self.sensor_database, self.sensor_data_table)
+        LOG.info("RF-proxy controller initialised")
 
     def run(self):
         """ Indefinite loop to run the app """
         while True:
             try:
-                pipe = [0]
-                while not self.radio.available(pipe, True):
+                while not self.available():
                     time.sleep(self.rfproxy_config["nrf24_read_frequency_s"])
-                recv_buffer = []
-                self.radio.read(recv_buffer)
-                printf("Bytes received: " + str(recv_buffer))
-                # 1st byte of payload used as the shared id. For packet to be valid,
-                # receiver must be expecting this id.
-                if recv_buffer[0] == self.rfproxy_config["shared_id"]:
-                    _received_data = self._process_payload(
-                        recv_buffer[1:self.rfproxy_config["nrf24_payload_size"]]
-                    )
-                    _proxy_received_data = {}
-                    _proxy_received_data["rfproxy"] = _received_data
-                    _proxy_received_data["dev_id"] = _received_data["dev_id"]
-                    self._log_to_database(_received_data["dev_uid"], _proxy_received_data)
-                    self._log_to_file(_received_data)
+                self.receive()
             except KeyboardInterrupt:
                 break
 
+    def available(self):
+        """ Whether a packet is waiting to be read """
+        return self.radio.available([0], True)
+
+    def receive(self):
+        """ Read a waiting packet, and store it if it is one of ours """
+        _packet_start = time.perf_counter()
+        recv_buffer = []
+        self.radio.read(recv_buffer)
+        LOG.debug("Bytes received: %s", recv_buffer)
+        # 1st byte of payload used as the shared id. For packet to be valid,
+        # receiver must be expecting this id.
+        if recv_buffer[0] == self.rfproxy_config["shared_id"]:
+            _received_data = self._process_payload(
+                recv_buffer[1:self.rfproxy_config["nrf24_payload_size"]]
+            )
+            _proxy_received_data = {}
+            _proxy_received_data["rfproxy"] = _received_data
+            _proxy_received_data["dev_id"] = _received_data["dev_id"]
+            self._log_to_database(_received_data["dev_uid"], _proxy_received_data)
+            self._log_to_file(_received_data)
+            PACKETS.inc(label="accepted")
+            LAST_PACKET_TIME.set(time.time(), label=_received_data["dev_uid"])
+            PACKET_SECONDS.observe(time.perf_counter() - _packet_start)
+        else:
+            PACKETS.inc(label="wrong_id")
+
     def _process_payload(self, payload):
         """ Convert readings from bytearray payload, and remove neccessary offsets """
         _collected_data = {}
@@ -99,7 +136,7 @@ class NRF():
             )
         _collected_data["position_lat"] = _gps_latitude
         _collected_data["position_long"] = _gps_longitude
-        printf(_collected_data)
+        LOG.debug("Received: %s", _collected_data)
         return _collected_data
 
     def _convert_bytes_to_int(self, in_bytearray, start_position, num_bytes):
@@ -132,28 +169,29 @@ class NRF():
 
     def _log_to_database(self, dev_uid, log_data):
         """ Log data to local cache database """
-        try:
-            self.conn = sqlite3.connect(self.sensor_database)
-            self.cur = self.conn.cursor()
-            self.cur.execute(
-                "INSERT INTO " +
-                self.sensor_data_table +
-                " (payload, dev_uid) VALUES (?, ?)",
-                (str(log_data), int(dev_uid),)
-            )
-            self.conn.commit()
-        except sqlite3.OperationalError as ex:
-            printf(ex)
-        finally:
-            self.conn.close()
-
-def printf(message):
-    """ Print to console wrapper, inludes timestamp.
-    Flushes buffer to output when using Supervisor """
-    print(str(datetime.datetime.now()) + ": " + str(message), flush=True)
+        if self.buffer is not None:
+            self.buffer.put(str(log_data), int(dev_uid))
+            return
+        with SQLITE_INSERT_SECONDS.time():
+            try:
+                self.conn = sqlite3.connect(self.sensor_database)
+                self.cur = self.conn.cursor()
+                self.cur.execute(
+                    "INSERT INTO " +
+                    self.sensor_data_table +
+                    " (payload, dev_uid) VALUES (?, ?)",
+                    (str(log_data), int(dev_uid),)
+                )
+                self.rollups.update(self.conn, [(int(dev_uid), log_data)])
+                self.conn.commit()
+            except sqlite3.OperationalError as ex:
+                LOG.error("Payload not stored: %s", ex)
+            finally:
+                self.conn.close()
 
 def main():
     """ Main program """
+    metrics.start()
     nrfproxy = NRF(BRICK_CONFIG)
     nrfproxy.run()
 
@@ -161,5 +199,5 @@ if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        printf("RF-proxy controller stopped")
+        LOG.info("RF-proxy controller stopped")
         sys.exit()
@@ -0,0 +1,309 @@
+""" riot-brick-runtime.py
+Runs sensor sampling, nRF24 receive and upload as asyncio tasks in a single
+process, as an alternative to running riot-brick-sensors.py, riot-brick-rfproxy.py
+and riot-brick-upload.py as three processes under Supervisor. The config, common
+imports and logging are then loaded once, and payloads from the sensors and the
+radio go through one in-memory queue, written to the SQLite buffer in batches
+over a single connection.
+The rollups (see rollups.py) are updated in the same transactions.
+Blocking work (sensor reads, uploads) runs in executor threads, so the radio is
+still polled while it happens. Memory and CPU use are reported periodically,
+alongside those of the three separate daemons if they are also running.
+"""
+
+import sys
+import os
+import time
+import json
+import asyncio
+import sqlite3
+import importlib.util
+import psutil
+import logsetup
+import metrics
+import rollups
+
+BRICK_CONFIG_FILE = "config/brick_config.json"
+with open(BRICK_CONFIG_FILE) as config_file:
+    BRICK_CONFIG = json.load(config_file)
+DEV_ID = BRICK_CONFIG["dev_id"]
+LOG = logsetup.configure(BRICK_CONFIG["logging"], "runtime")
+metrics.configure(BRICK_CONFIG.get("metrics", {}), "runtime")
+RUNTIME_CONFIG = BRICK_CONFIG.get("runtime", {})
+
+# Service name to the script that also runs it on its own
+SERVICE_FILES = {
+    "sensors": "riot-brick-sensors.py",
+    "rfproxy": "riot-brick-rfproxy.py",
+    "uploader": "riot-brick-upload.py",
+}
+
+class PayloadBuffer():
+    """ In-memory queue in front of the SQLite buffer, shared by the services.
+    A single task writes queued payloads in batches, each in one transaction
+    (along with their rollups, if given a Rollups). """
+
+    def __init__(self, loop, database, table, batch_size, flush_s, payload_rollups=None):
+        """ Nothing is written until run is started """
+        self.loop = loop
+        self.database = database
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self.rollups = payload_rollups
+        self.queue = asyncio.Queue()
+        self.conn = None
+        self.written = 0
+        self.write_seconds = metrics.histogram(
+            "riot_brick_buffer_write_seconds", "Time taken to write a batch of payloads"
+        )
+        self.depth = metrics.gauge(
+            "riot_brick_buffer_queue_depth", "Payloads queued in memory, not yet written"
+        )
+
+    def put(self, payload, dev_uid):
+        """ Queue a payload. Can be called from any thread. """
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (payload, dev_uid))
+
+    async def run(self):
+        """ Write payloads as they arrive, waiting up to flush_s for a batch """
+        if self.rollups is not None:
+            self.rollups.create_tables(self.database, self.table)
+        self.conn = sqlite3.connect(self.database, check_same_thread=False)
+        _batch = []
+        _writing = None
+        try:
+            while True:
+                _batch.append(await self.queue.get())
+                _deadline = self.loop.time() + self.flush_s
+                while len(_batch) < self.batch_size:
+                    _timeout = _deadline - self.loop.time()
+                    if _timeout <= 0:
+                        break
+                    try:
+                        _batch.append(await asyncio.wait_for(self.queue.get(), _timeout))
+                    except asyncio.TimeoutError:
+                        break
+                _writing = self.loop.run_in_executor(None, self._write, _batch)
+                _batch = []
+                # Shielded, so that stopping does not leave the write running unawaited
+                await asyncio.shield(_writing)
+        finally:
+            # A write still running in its thread finishes before the connection
+            # is used again; then whatever is still collected or queued is written
+            if _writing is not None:
+                await asyncio.wait([_writing])
+            while not self.queue.empty():
+                _batch.append(self.queue.get_nowait())
+            if _batch:
+                self._write(_batch)
+            self.conn.close()
+
+    def _write(self, batch):
+        """ Insert a batch of (payload, dev_uid) in one transaction """
+        with self.write_seconds.time():
+            try:
+                with self.conn:
+                    self.conn.executemany(
+                        "INSERT INTO " + self.table + " (payload, dev_uid) VALUES (?, ?)",
+                        batch
+                    )
+                    if self.rollups is not None:
+                        self.rollups.update(
+                            self.conn, [(_dev_uid, _payload) for _payload, _dev_uid in batch]
+                        )
+            except sqlite3.OperationalError as ex:
+                LOG.error("%d payloads not stored: %s", len(batch), ex)
+                return
+        self.written += len(batch)
+        self.depth.set(self.queue.qsize())
+        LOG.debug("Stored %d payloads", len(batch))
+
+class ResourceReporter():
+    """ Memory and CPU use of this process, and of the separately run daemons
+    (found by their command lines) for comparison """
+
+    def __init__(self):
+        """ CPU percentages are measured between reports, so processes are kept """
+        self.processes = {}
+        self.rss = metrics.gauge(
+            "riot_brick_process_rss_bytes", "Resident memory, by process", "process"
+        )
+        self.cpu = metrics.gauge(
+            "riot_brick_process_cpu_percent", "CPU use since the last report, by process",
+            "process"
+        )
+
+    def report(self):
+        """ Usage of this runtime and of any separate daemons, as a dict """
+        _report = {"runtime": self._usage(os.getpid())}
+        _separate = {}
+        for _process in psutil.process_iter(["pid", "cmdline"]):
+            _cmdline = " ".join(_process.info["cmdline"] or [])
+            for _service, _file_name in SERVICE_FILES.items():
+                if _file_name in _cmdline and _process.info["pid"] != os.getpid():
+                    _separate[_service] = self._usage(_process.info["pid"])
+        if _separate:
+            _separate["total"] = {
+                "rss_mb": round(sum(_usage["rss_mb"] for _usage in _separate.values()), 1),
+                "cpu_percent": round(
+                    sum(_usage["cpu_percent"] for _usage in _separate.values()), 1
+                ),
+            }
+            _report["three_process"] = _separate
+        for _name, _usage in list(_report.items()) + list(_separate.items()):
+            if _name != "three_process":
+                self.rss.set(_usage["rss_mb"] * 1024 * 1024, label=_name)
+                self.cpu.set(_usage["cpu_percent"], label=_name)
+        return _report
+
+    def _usage(self, pid):
+        """ RSS in MB and CPU % (since the previous call) of one process """
+        try:
+            if pid not in self.processes:
+                self.processes[pid] = psutil.Process(pid)
+                self.processes[pid].cpu_percent(None)
+            _process = self.processes[pid]
+            return {
+                "rss_mb": round(_process.memory_info().rss / 1024.0 / 1024.0, 1),
+                "cpu_percent": _process.cpu_percent(None),
+            }
+        except psutil.Error:
+            self.processes.pop(pid, None)
+            return {"rss_mb": 0.0, "cpu_percent": 0.0}
+
+def load_service(name):
+    """ Import a service's script as a module. Returns None if it cannot be
+    loaded here (e.g. missing hardware libraries or environment variables). """
+    _file_name = os.path.join(os.path.dirname(os.path.abspath(__file__)), SERVICE_FILES[name])
+    _spec = importlib.util.spec_from_file_location("riot_brick_" + name, _file_name)
+    _module = importlib.util.module_from_spec(_spec)
+    try:
+        _spec.loader.exec_module(_module)
+    except (ImportError, OSError) as ex:
+        LOG.error("Service %s not loaded: %s", name, ex)
+        return None
+    return _module
+
+async def run_sensors(loop, module, buffer):
+    """ Take readings every frequency_s """
+    # Waits for a GPS fix, so is kept off the event loop
+    _controller = await loop.run_in_executor(None, module.SensorController, BRICK_CONFIG)
+    _controller.buffer = buffer
+    _frequency_s = BRICK_CONFIG["sensors"]["frequency_s"]
+    while True:
+        _start_time = time.time()
+        await loop.run_in_executor(None, _controller.sample)
+        await asyncio.sleep(max(0, _frequency_s - (time.time() - _start_time)))
+
+async def run_rfproxy(loop, module, buffer):
+    """ Poll the radio, and store packets as they arrive """
+    # pylint: disable=unused-argument
+    _nrf = module.NRF(BRICK_CONFIG)
+    _nrf.buffer = buffer
+    _read_frequency_s = BRICK_CONFIG["rfproxy"]["nrf24_read_frequency_s"]
+    while True:
+        if _nrf.available():
+            _nrf.receive()
+            # A burst of packets would otherwise hold the loop, and with it
+            # the other services, until the radio is empty
+            await asyncio.sleep(0)
+        else:
+            await asyncio.sleep(_read_frequency_s)
+
+async def run_uploader(loop, module, buffer):
+    """ Upload cached records every frequency_s, and as soon as the link comes up """
+    # pylint: disable=unused-argument
+    _uploader = await loop.run_in_executor(None, module.Uploader, module.active_trackers)
+    _link_up = asyncio.Event()
+    _uploader.monitor.add_listener(lambda: loop.call_soon_threadsafe(_link_up.set))
+    _frequency_s = BRICK_CONFIG["uploader"]["frequency_s"]
+    while True:
+        _start_time = time.time()
+        _link_up.clear()
+        await loop.run_in_executor(None, _uploader.upload_cycle)
+        try:
+            await asyncio.wait_for(
+                _link_up.wait(), max(0, _frequency_s - (time.time() - _start_time))
+            )
+        except asyncio.TimeoutError:
+            pass
+
+async def run_reporter(reporter, buffer):
+    """ Log resource use every report_frequency_s """
+    _frequency_s = RUNTIME_CONFIG.get("report_frequency_s", 300)
+    while True:
+        _report = reporter.report()
+        _report["payloads_stored"] = buffer.written
+        LOG.info("Resource use: %s", _report)
+        await asyncio.sleep(_frequency_s)
+
+SERVICE_TASKS = {
+    "sensors": run_sensors,
+    "rfproxy": run_rfproxy,
+    "uploader": run_uploader,
+}
+
+async def run(services):
+    """ Run the services until one of them fails """
+    _loop = asyncio.get_event_loop()
+    _buffer = PayloadBuffer(
+        _loop,
+        BRICK_CONFIG["database"]["sqlite_database"],
+        BRICK_CONFIG["database"]["sqlite_table"],
+        RUNTIME_CONFIG.get("buffer_batch_size", 50),
+        RUNTIME_CONFIG.get("buffer_flush_s", 1.0),
+        rollups.Rollups(BRICK_CONFIG.get("rollups", {}))
+    )
+    _tasks = [
+        _loop.create_task(_buffer.run()),
+        _loop.create_task(run_reporter(ResourceReporter(), _buffer)),
+    ]
+    for _name, _module in services.items():
+        _tasks.append(_loop.create_task(SERVICE_TASKS[_name](_loop, _module, _buffer)))
+    try:
+        # Services run forever, so the first to finish has failed
+        _done, _pending = await asyncio.wait(_tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for _task in _done:
+            _task.result()
+    finally:
+        for _task in _tasks:
+            _task.cancel()
+        await asyncio.gather(*_tasks, return_exceptions=True)
+
+def main():
+    """ Load the configured services, and run them together """
+    _start_time = time.time()
+    _services = {}
+    for _name in RUNTIME_CONFIG.get("services", list(SERVICE_FILES)):
+        _module = load_service(_name)
+        if _module is not None:
+            _services[_name] = _module
+    if not _services:
+        LOG.error("No services to run")
+        sys.exit(1)
+    # Each service names itself when loaded; export everything as the runtime
+    metrics.configure(BRICK_CONFIG.get("metrics", {}), "runtime")
+    metrics.start()
+    LOG.info(
+        "Loaded %s in %.1fs, using %.1f MB",
+        ", ".join(_services),
+        time.time() - _start_time,
+        psutil.Process().memory_info().rss / 1024.0 / 1024.0
+    )
+    _loop = asyncio.get_event_loop()
+    _task = _loop.create_task(run(_services))
+    try:
+        _loop.run_until_complete(_task)
+    except KeyboardInterrupt:
+        # Let the tasks stop, so that queued payloads are written
+        _task.cancel()
+        _loop.run_until_complete(asyncio.gather(_task, return_exceptions=True))
+        raise
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        LOG.info("Runtime stopped")
+        sys.exit()
@@ -1,18 +1,25 @@
 """ riot-brick-sensors.py
 Takes readings from connected sensors, and stores payload in a sqlite3 database.
 Also stores individual values locally in a CSV file for safekeeping.
+Each GPS fix is checked against a local copy of the geo points (kept up to date
+by the uploader), and arrivals are stored straight away as events of their own.
 """
 
 # TODO: Persist total distance / time over restarts
 
 import sys
+import os
 import time
 import datetime
 import json
 import subprocess
 import platform
 import sqlite3
-from haversine import haversine
+from haversine import ReferencePoint
+from geoindex import GeoIndex
+import metrics
+import logsetup
+import rollups
 import smbus
 import gpsd
 import psutil
@@ -25,6 +32,22 @@ BRICK_CONFIG_FILE = "config/brick_config.json"
 with open(BRICK_CONFIG_FILE) as config_file:
     BRICK_CONFIG = json.load(config_file)
 DEV_ID = BRICK_CONFIG["dev_id"]
+LOG = logsetup.configure(BRICK_CONFIG["logging"], "sensors")
+
+metrics.configure(BRICK_CONFIG.get("metrics", {}), "sensors")
+CYCLE_SECONDS = metrics.histogram(
+    "riot_brick_sensor_cycle_seconds", "Time taken by a sensor cycle, excluding the sleep"
+)
+MEASUREMENT_SECONDS = metrics.histogram(
+    "riot_brick_sensor_measurement_seconds", "Time taken to read all sensors"
+)
+SQLITE_INSERT_SECONDS = metrics.histogram(
+    "riot_brick_sqlite_insert_seconds", "Time taken to store a payload in the buffer"
+)
+SAMPLES = metrics.counter(
+    "riot_brick_sensor_samples_total", "Sensor cycles, by whether there was a GPS fix", "gps"
+)
+ARRIVALS = metrics.counter("riot_brick_geofence_arrivals_total", "Landmarks arrived at")
 
 class WeatherSensor():
     """ BME280 temperature, pressure and humidity sensor object """
@@ -36,7 +59,7 @@ class WeatherSensor():
                 address=weather_sensor_config["bme280_i2c_address"]
             )
         except OSError as ex:
-            printf(ex)
+            LOG.error("Weather sensor not initialised: %s", ex)
 
     def get_readings(self):
         """ Read raw data from the BME280 sensor and return formatted.
@@ -47,7 +70,7 @@ class WeatherSensor():
             pascals = round(self.weather_sensor.read_pressure(), 0)
             humidity = round(self.weather_sensor.read_humidity(), 0)
         except OSError as ex:
-            printf(ex)
+            LOG.warning("Weather sensor not read: %s", ex)
         else:
             _readings = (degrees, pascals, humidity)
         return _readings
@@ -71,7 +94,7 @@ class GPSReceiver():
         """ Initialise Neo-6 GPS module """
         gpsd.connect()
         while self.get_gps_fix() < 2:
-            printf("Awaiting GPS fix...")
+            LOG.info("Awaiting GPS fix...")
             time.sleep(gps_receiver_config["fix_retry_s"])
         # Set system time to UTC time provided by GPS
         # Important for when there is no internet connectivity (i.e. no NTP)
@@ -90,16 +113,11 @@ class GPSReceiver():
             )
             p_set_time.wait()
         except OSError as ex:
-            print(ex)
+            LOG.warning("System time not set: %s", ex)
         else:
-            printf(
-                "Changed system time from " +
-                str(_time_now) +
-                " to "+
-                str(datetime.datetime.now())
-            )
-        printf("GPS initialised")
-        printf(str(gpsd.state))
+            LOG.info("Changed system time from %s to %s", _time_now, datetime.datetime.now())
+        LOG.info("GPS initialised")
+        LOG.debug("%s", gpsd.state)
 
     def get_data(self):
         """ Get current data from gpsd """
@@ -112,7 +130,7 @@ class GPSReceiver():
                 _gps_raw_data.altitude()
             )
         except (UserWarning, gpsd.NoFixError) as ex:
-            printf(ex)
+            LOG.warning("No GPS data: %s", ex)
         return _gps_data_out
 
     def get_gps_fix(self):
@@ -120,6 +138,50 @@ class GPSReceiver():
         0=no mode, 1=no fix, 2=2D fix, 3=3D fix """
         return gpsd.get_current().mode
 
+class Geofence():
+    """ Local copy of the riot-geo-data points, in a spatial index, so that
+    arrivals are detected without connectivity. The landmarks file is written
+    by the uploader, and read again whenever it changes. """
+
+    def __init__(self, geofence_config):
+        """ Nothing is loaded until the first check """
+        self.enabled = geofence_config.get("enabled", False)
+        self.landmarks_file = geofence_config["landmarks_file"]
+        self.index = None
+        self.loaded_mtime = None
+        # Reset at start-up, like the running stats; the cloud ignores repeats
+        self.current_location = None
+
+    def load(self):
+        """ (Re)build the index if the landmarks file has changed. Returns
+        whether an index is available. """
+        try:
+            _mtime = os.path.getmtime(self.landmarks_file)
+        except OSError:
+            return self.index is not None
+        if _mtime != self.loaded_mtime:
+            try:
+                with open(self.landmarks_file) as _landmarks_file:
+                    self.index = GeoIndex(json.load(_landmarks_file))
+            except (OSError, ValueError, KeyError, TypeError) as ex:
+                LOG.warning("Landmarks not loaded: %s", ex)
+            else:
+                LOG.info("Loaded %d landmarks", self.index.size)
+            self.loaded_mtime = _mtime
+        return self.index is not None
+
+    def check(self, position):
+        """ Geo points arrived at, as (geo point, distance in km), for a fix.
+        Returns None when there is no index to check against. """
+        if not self.enabled or not self.load():
+            return None
+        _arrivals = []
+        for _geo_point, _distance_km in self.index.nearby(position):
+            if str(_geo_point["location"]) != str(self.current_location):
+                self.current_location = _geo_point["location"]
+                _arrivals.append((_geo_point, _distance_km))
+        return _arrivals
+
 class SensorController():
     """ Handles all connected sensors """
 
@@ -130,10 +192,12 @@ class SensorController():
         self.weather_sensor = WeatherSensor(self.sensors_config["weather_sensor"])
         self.lux_sensor = LuxSensor()
         self.gps = GPSReceiver(self.sensors_config["gps_receiver"])
+        self.geofence = Geofence(brick_config.get("geofence", {"landmarks_file": ""}))
         # All of these running stats are reset at app start-up
         self.total_distance_km = 0
         self.total_climb_m = 0
         self.last_data = {}
+        self.last_position = None
         self.start_time = datetime.datetime.now()
         self.total_duration_s = 0
         # SQLite3 connection details
@@ -141,7 +205,12 @@ class SensorController():
         self.cur = None
         self.sensor_database = brick_config["database"]["sqlite_database"]
         self.sensor_data_table = brick_config["database"]["sqlite_table"]
-        printf("Sensor controller initialised")
+        # Set to a shared in-memory buffer, to store payloads through that instead
+        self.buffer = None
+        # Aggregates kept up to date as payloads are stored
+        self.rollups = rollups.Rollups(brick_config.get("rollups", {}))
+        self.rollups.create_tables(self.sensor_database, self.sensor_data_table)
+        LOG.info("Sensor controller initialised")
         if self.logging_config["gpx"]:
             self.gpx = gpxpy.gpx.GPX()
             self.gpx_track = gpxpy.gpx.GPXTrack()
@@ -156,29 +225,40 @@ class SensorController():
     def run(self):
         """ Indefinite loop to run the controller app """
         while True:
-            printf("Sensor controller run started")
+            LOG.debug("Sensor controller run started")
             _start_time = time.time()
-            _current_data, _no_gps_data = self._obtain_measurements()
-            if not _no_gps_data:
-                self._log_to_file(_current_data)
-                self._log_to_database(_current_data)
-                if self.logging_config["gpx"]:
-                    self.gpx_segment.points.append(
-                        gpxpy.gpx.GPXTrackPoint(
-                            _current_data["position_lat"],
-                            _current_data["position_long"],
-                            elevation=_current_data["altitude"],
-                            time=datetime.datetime.now()
-                        )
-                    )
-                    _gpx_file = open(self.gpx_file_name, "w")
-                    _gpx_file.write(self.gpx.to_xml())
-                    _gpx_file.close()
-            printf("Sensor controller run completed")
+            self.sample()
+            LOG.debug("Sensor controller run completed")
             _remaining_time = self.sensors_config["frequency_s"] - int(time.time()-_start_time)
             if _remaining_time > 0:
                 time.sleep(_remaining_time)
 
+    def sample(self):
+        """ Take one set of readings, and store them """
+        _start_time = time.time()
+        with MEASUREMENT_SECONDS.time():
+            _current_data, _no_gps_data = self._obtain_measurements()
+        SAMPLES.inc(label="no" if _no_gps_data else "yes")
+        if not _no_gps_data:
+            _arrivals = self._check_geofence(_current_data)
+            self._log_to_file(_current_data)
+            self._log_to_database(_current_data)
+            for _arrival in _arrivals:
+                self._log_to_database(_arrival)
+            if self.logging_config["gpx"]:
+                self.gpx_segment.points.append(
+                    gpxpy.gpx.GPXTrackPoint(
+                        _current_data["position_lat"],
+                        _current_data["position_long"],
+                        elevation=_current_data["altitude"],
+                        time=datetime.datetime.now()
+                    )
+                )
+                _gpx_file = open(self.gpx_file_name, "w")
+                _gpx_file.write(self.gpx.to_xml())
+                _gpx_file.close()
+        CYCLE_SECONDS.observe(time.time() - _start_time)
+
     def _obtain_measurements(self):
         """ Obtain measurements from all devices """
         _collected_data = {}
@@ -198,12 +278,15 @@ class SensorController():
                         self.last_data["altitude"],
                         1
                     )
-                _distance_travelled = haversine(
-                    (self.last_data["position_lat"], self.last_data["position_long"]),
+                # Consecutive fixes are close together, so this is the fast mode
+                _distance_travelled = self.last_position.distance(
                     (_collected_data["position_lat"], _collected_data["position_long"])
                 )
                 self.total_distance_km = round((self.total_distance_km + _distance_travelled), 3)
             self.last_data = _collected_data
+            self.last_position = ReferencePoint(
+                (_collected_data["position_lat"], _collected_data["position_long"])
+            )
         else:
             _no_gps_data = True
         _weather_readings = self.weather_sensor.get_readings()
@@ -220,9 +303,36 @@ class SensorController():
         _collected_data["disk"] = psutil.disk_usage("/").percent
         _collected_data["system"] = platform.system()
         _collected_data["release"] = platform.release()
-        printf(_collected_data)
+        LOG.debug("Measurements: %s", _collected_data)
         return (_collected_data, _no_gps_data)
 
+    def _check_geofence(self, current_data):
+        """ Check the fix against the local landmarks, marking it as checked,
+        and return an arrival event for each landmark reached. Arrival events
+        only name the geo point, as payloads are stored as text. """
+        _arrivals = self.geofence.check(
+            (current_data["position_lat"], current_data["position_long"])
+        )
+        if _arrivals is None:
+            return []
+        current_data["geofence"] = "edge"
+        _events = []
+        for _geo_point, _distance_km in _arrivals:
+            LOG.info("Arrived at %s", _geo_point["location"])
+            ARRIVALS.inc()
+            _events.append({
+                "event": "arrival",
+                "geo_location": _geo_point["location"],
+                "distance_km": round(_distance_km, 3),
+                "timestamp": current_data["timestamp"],
+                "position_lat": current_data["position_lat"],
+                "position_long": current_data["position_long"],
+                "total_distance": current_data["total_distance"],
+                "total_time": current_data["total_time"],
+                "dev_id": DEV_ID,
+            })
+        return _events
+
     def _log_to_file(self, log_data):
         """ Log results to a flat text file """
         if self.logging_config["file_logging"]:
@@ -250,28 +360,29 @@ class SensorController():
 
     def _log_to_database(self, log_data):
         """ Log data to local cache database """
-        try:
-            self.conn = sqlite3.connect(self.sensor_database)
-            self.cur = self.conn.cursor()
-            self.cur.execute(
-                "INSERT INTO " +
-                self.sensor_data_table +
-                " (payload, dev_uid) VALUES (?, 0)",
-                (str(log_data),)
-            )
-            self.conn.commit()
-        except sqlite3.OperationalError as ex:
-            printf(ex)
-        finally:
-            self.conn.close()
-
-def printf(message):
-    """ Print to console wrapper, inludes timestamp.
-    Flushes buffer to output when using Supervisor """
-    print(str(datetime.datetime.now()) + ": " + str(message), flush=True)
+        if self.buffer is not None:
+            self.buffer.put(str(log_data), 0)
+            return
+        with SQLITE_INSERT_SECONDS.time():
+            try:
+                self.conn = sqlite3.connect(self.sensor_database)
+                self.cur = self.conn.cursor()
+                self.cur.execute(
+                    "INSERT INTO " +
+                    self.sensor_data_table +
+                    " (payload, dev_uid) VALUES (?, 0)",
+                    (str(log_data),)
+                )
+                self.rollups.update(self.conn, [(0, log_data)])
+                self.conn.commit()
+            except sqlite3.OperationalError as ex:
+                LOG.error("Payload not stored: %s", ex)
+            finally:
+                self.conn.close()
 
 def main():
     """ Main program """
+    metrics.start()
     tracker = SensorController(BRICK_CONFIG)
     tracker.run()
 
@@ -279,5 +390,5 @@ if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        printf("Sensor controller stopped")
+        LOG.info("Sensor controller stopped")
         sys.exit()
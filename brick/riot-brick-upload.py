@@ -1,25 +1,50 @@
 """ riot-brick-upload.py
 Retrieves cached JSON data from SQLite3 database and uploads to AWS IoT using REST API.
-Marks uploaded messages as processed.
+Marks uploaded messages as processed. When online, also keeps the local copy of
+the geo points (used by the sensor controller's geofence) up to date.
 Note that several environment variables need to be set for AWS IoT certificate
-and endpoint details. The application also restarts wlan interface if connection is
-not detected.
+and endpoint details. Connectivity is watched by a background thread, which also
+restarts the wlan interface (backing off between restarts) while it is down, so
+uploads are skipped rather than held up while offline, and start as soon as the
+link comes back.
 """
 
 import time
-import datetime
 import subprocess
 import sys
 import json
+import os
+import threading
 from os import environ
 import socket
 import sqlite3
 import requests
+import metrics
+import logsetup
 
 BRICK_CONFIG_FILE = "config/brick_config.json"
 with open(BRICK_CONFIG_FILE) as config_file:
     BRICK_CONFIG = json.load(config_file)
 DEV_ID = BRICK_CONFIG["dev_id"]
+LOG = logsetup.configure(BRICK_CONFIG["logging"], "uploader")
+
+metrics.configure(BRICK_CONFIG.get("metrics", {}), "uploader")
+CONNECT_SECONDS = metrics.histogram(
+    "riot_brick_connect_seconds", "Time taken to resolve and connect to the AWS IoT endpoint"
+)
+LINK_UP = metrics.gauge("riot_brick_link_up", "Whether the AWS IoT endpoint can be reached")
+INTERFACE_RESTARTS = metrics.counter(
+    "riot_brick_interface_restarts_total", "Restarts of the wlan interface while offline"
+)
+BACKLOG_QUERY_SECONDS = metrics.histogram(
+    "riot_brick_backlog_query_seconds", "Time taken to read the records awaiting upload"
+)
+BACKLOG = metrics.gauge("riot_brick_backlog_records", "Records awaiting upload")
+UPLOAD_SECONDS = metrics.histogram(
+    "riot_brick_upload_seconds", "Time taken to upload a single record"
+)
+UPLOADS = metrics.counter("riot_brick_uploads_total", "Upload attempts, by result", "status")
+UPLOAD_BYTES = metrics.counter("riot_brick_upload_bytes_total", "Payload bytes uploaded")
 
 # Load AWS IoT thing certificate locations from environment variables
 if "AWS_IOT_THING_CA" in environ:
@@ -50,108 +75,306 @@ for key, value in BRICK_CONFIG["uploader"]["trackers"].items():
 class Uploader():
     """ Controller to check local SQLite database / table, and upload
     any cached events """
-    # pylint: disable=too-few-public-methods
 
     def __init__(self, active_trackers):
         """ Initialise with some parameters """
-        self.aws_iot_uploader = AWSIoTUploader(AWS_IOT_THING_CA)
+        self.aws_iot_uploader = AWSIoTUploader(
+            AWS_IOT_THING_CA, BRICK_CONFIG["uploader"].get("upload_timeout_s", 30)
+        )
         self.conn = None
         self.cur = None
         self.sensor_database = BRICK_CONFIG["database"]["sqlite_database"]
         self.sensor_data_table = BRICK_CONFIG["database"]["sqlite_table"]
-        printf("Uploader initialised")
+        LOG.info("Uploader initialised")
         self.active_trackers = active_trackers
-        printf("Discovered trackers: " + str(self.active_trackers))
+        LOG.info("Discovered trackers: %s", self.active_trackers)
+        self.landmark_sync = LandmarkSync(BRICK_CONFIG.get("geofence", {}))
+        _host, _port = self.active_trackers[0]["endpoint"].split("/")[2].split(":")
+        self.monitor = ConnectivityMonitor(
+            _host, int(_port), BRICK_CONFIG["uploader"].get("connectivity", {})
+        )
+        self.monitor.start()
 
     def run(self):
         """ Run the uploader application continuously """
         while True:
-            printf("Uploader run started")
+            LOG.debug("Uploader run started")
             _start_time = time.time()
-            test_url = self.active_trackers[0]["endpoint"].split("/")[2].split(":")
-            _connection = False
-            _wlan_interface = BRICK_CONFIG["uploader"]["wlan_interface"]
-            if test_connection(test_url[0], int(test_url[1])):
-                _connection = True
-            else:
-                printf("No connectivity to " + test_url[0] + ":" + str(test_url[1]))
-                printf("Restarting wlan interface " + _wlan_interface)
-                try:
-                    p_reconnect_wifi = subprocess.Popen(
-                        ["sudo", "systemctl", "restart", "dhcpdc.service"], stdout=subprocess.PIPE
+            self.upload_cycle()
+            _remaining_time = BRICK_CONFIG["uploader"]["frequency_s"] \
+                - int(time.time()-_start_time)
+            # Cut the wait short if the link has just come (back) up
+            if _remaining_time > 0 and self.monitor.wait_for_link_up(_remaining_time):
+                LOG.info("Link up, uploading now")
+
+    def upload_cycle(self):
+        """ Upload all cached records, if the endpoint can be reached """
+        if not self.monitor.is_up():
+            LOG.debug("No connectivity, upload skipped")
+            return
+        self.landmark_sync.sync()
+        self.conn = sqlite3.connect(self.sensor_database)
+        self.cur = self.conn.cursor()
+        try:
+            with BACKLOG_QUERY_SECONDS.time():
+                rows = self.cur.execute(
+                    "SELECT id, payload, dev_uid FROM " +
+                    self.sensor_data_table +
+                    " WHERE processed = 0 ORDER BY id ASC"
+                )
+                cached_records = []
+                for row in rows:
+                    cached_records.append(row)
+            BACKLOG.set(len(cached_records))
+            LOG.info("Discovered %d cached records", len(cached_records))
+            for cached_record in cached_records:
+                _cached_record_id = int(cached_record[0])
+                _cached_record_json = json.loads(cached_record[1].replace("'", '"'))
+                # Attempt to upload data
+                _response = self.aws_iot_uploader.upload(
+                    _cached_record_json,
+                    self.active_trackers[cached_record[2]]["endpoint"],
+                    self.active_trackers[cached_record[2]]["cert"],
+                    self.active_trackers[cached_record[2]]["key"]
+                )
+                self.monitor.report_success()
+                if _response.status_code == 200:
+                    self.cur.execute(
+                        "UPDATE " +
+                        self.sensor_data_table +
+                        " SET processed = 1 WHERE id = " +
+                        str(_cached_record_id)
                     )
-                    p_reconnect_wifi.wait()
-                except OSError as ex:
-                    printf(ex)
+                    self.conn.commit()
+                    BACKLOG.inc(-1)
+                    LOG.debug("Succesfully uploaded record %d", _cached_record_id)
                 else:
-                    printf("Restarted wlan interface " + _wlan_interface)
-                    time.sleep(10)
-                    if test_connection(test_url[0], int(test_url[1])):
-                        _connection = True
-            if _connection:
-                printf("Connection possible to " + test_url[0] + ":" + str(test_url[1]))
-            else:
-                printf("Failed to connect to " + test_url[0] + ":" + str(test_url[1]))
-            if _connection:
-                self.conn = sqlite3.connect(self.sensor_database)
-                self.cur = self.conn.cursor()
-                try:
-                    rows = self.cur.execute(
-                        "SELECT id, payload, dev_uid FROM " +
-                        self.sensor_data_table +
-                        " WHERE processed = 0 ORDER BY id ASC"
+                    LOG.warning(
+                        "Error encountered during upload of %d (%s)",
+                        _cached_record_id,
+                        _response.status_code
                     )
-                    cached_records = []
-                    for row in rows:
-                        cached_records.append(row)
-                    printf("Discovered " + str(len(cached_records)) + " cached records")
-                    for cached_record in cached_records:
-                        _cached_record_id = int(cached_record[0])
-                        _cached_record_json = json.loads(cached_record[1].replace("'", '"'))
-                        # Attempt to upload data
-                        _response = self.aws_iot_uploader.upload(
-                            _cached_record_json,
-                            self.active_trackers[cached_record[2]]["endpoint"],
-                            self.active_trackers[cached_record[2]]["cert"],
-                            self.active_trackers[cached_record[2]]["key"]
-                        )
-                        if _response.status_code == 200:
-                            self.cur.execute(
-                                "UPDATE " +
-                                self.sensor_data_table +
-                                " SET processed = 1 WHERE id = " +
-                                str(_cached_record_id)
-                            )
-                            self.conn.commit()
-                            printf("Succesfully uploaded record " + str(_cached_record_id))
-                        else:
-                            printf(
-                                "Error encountered during upload of " +
-                                str(_cached_record_id) +
-                                " (" +
-                                str(_response.status_code) +
-                                ")"
-                            )
-                except (
-                        sqlite3.OperationalError, requests.exceptions.SSLError,
-                        FileNotFoundError
-                    ) as ex:
-                    printf(ex)
-                finally:
-                    # Always close connection afterwards
-                    self.conn.close()
-            _remaining_time = BRICK_CONFIG["uploader"]["frequency_s"] \
-                - int(time.time()-_start_time)
-            if _remaining_time > 0:
-                time.sleep(_remaining_time)
+        except (
+                sqlite3.OperationalError, requests.exceptions.SSLError,
+                FileNotFoundError
+            ) as ex:
+            LOG.error("Upload run failed: %s", ex)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as ex:
+            LOG.warning("Upload run interrupted: %s", ex)
+            self.monitor.report_failure()
+        finally:
+            # Always close connection afterwards
+            self.conn.close()
+
+class LandmarkSync():
+    """ Downloads the geo points from landmarks_url (a JSON list of riot-geo-data
+    items, or a DynamoDB scan response) to the landmarks file, at most once
+    every sync_frequency_s. Unchanged points are not downloaded again. """
+
+    def __init__(self, geofence_config):
+        """ Syncing is off unless a landmarks_url is configured """
+        self.landmarks_url = geofence_config.get("landmarks_url")
+        self.landmarks_file = geofence_config.get("landmarks_file")
+        self.frequency_s = geofence_config.get("sync_frequency_s", 3600)
+        self.enabled = bool(
+            geofence_config.get("enabled", False) and self.landmarks_url and self.landmarks_file
+        )
+        self.last_sync = 0
+        self.etag = None
+
+    def sync(self):
+        """ Download the geo points, if due. Returns whether the file was updated. """
+        if not self.enabled or time.time() - self.last_sync < self.frequency_s:
+            return False
+        _headers = {}
+        if self.etag and os.path.exists(self.landmarks_file):
+            _headers["If-None-Match"] = self.etag
+        try:
+            _response = requests.get(self.landmarks_url, headers=_headers, timeout=10)
+        except requests.exceptions.RequestException as ex:
+            LOG.warning("Landmarks not synced: %s", ex)
+            return False
+        if _response.status_code == 304:
+            self.last_sync = time.time()
+            LOG.debug("Landmarks unchanged")
+            return False
+        if _response.status_code != 200:
+            LOG.warning("Error encountered during landmark sync (%s)", _response.status_code)
+            return False
+        try:
+            _geo_points = _response.json()
+            if isinstance(_geo_points, dict):
+                _geo_points = _geo_points["Items"]
+            for _geo_point in _geo_points:
+                for _key in ("location", "latitude", "longitude", "approach_distance_km"):
+                    if _key not in _geo_point:
+                        raise ValueError("Geo point without " + _key)
+        except (ValueError, KeyError, TypeError) as ex:
+            LOG.warning("Landmarks not usable: %s", ex)
+            return False
+        # Replaced in one go, so the sensor controller never reads half a file
+        _temp_file = self.landmarks_file + ".tmp"
+        try:
+            with open(_temp_file, "w") as _landmarks_file:
+                json.dump(_geo_points, _landmarks_file)
+            os.replace(_temp_file, self.landmarks_file)
+        except OSError as ex:
+            LOG.error("Landmarks not stored: %s", ex)
+            return False
+        self.etag = _response.headers.get("ETag")
+        self.last_sync = time.time()
+        LOG.info("Synced %d landmarks", len(_geo_points))
+        return True
+
+class ConnectivityMonitor(threading.Thread):
+    """ Keeps track of whether the AWS IoT endpoint can be reached, from a
+    background thread, so that the uploader never waits on a probe. Probes are
+    a TCP connect (closed straight away) to the endpoint's address, which is
+    looked up again only every dns_ttl_s, or after a failure. Successful uploads
+    count as probes. While the link is down, the wlan interface is restarted
+    after restart_after_s, then at doubling intervals up to restart_backoff_max_s. """
+
+    def __init__(self, host, port, connectivity_config):
+        """ The first probe is made by start() """
+        super().__init__(name="connectivity", daemon=True)
+        self.host = host
+        self.port = port
+        self.probe_frequency_s = connectivity_config.get("probe_frequency_s", 30)
+        self.retry_frequency_s = connectivity_config.get("retry_frequency_s", 5)
+        self.probe_timeout_s = connectivity_config.get("probe_timeout_s", 2)
+        self.dns_ttl_s = connectivity_config.get("dns_ttl_s", 300)
+        self.restart_after_s = connectivity_config.get("restart_after_s", 60)
+        self.restart_backoff_max_s = connectivity_config.get("restart_backoff_max_s", 1800)
+        self.restart_command = connectivity_config.get(
+            "restart_command", ["sudo", "systemctl", "restart", "dhcpcd.service"]
+        )
+        self.lock = threading.Lock()
+        self.link_up = threading.Event()
+        self.link_came_up = threading.Event()
+        self.wake = threading.Event()
+        self.listeners = []
+        self.address = None
+        self.resolved_time = 0
+        self.last_success = 0
+        self.down_since = None
+        self.next_restart = None
+        self.restart_backoff_s = self.restart_after_s
+
+    def start(self):
+        """ Probe once, so the link state is known, then keep watching """
+        self._set_state(self.probe())
+        super().start()
+
+    def is_up(self):
+        """ Whether the endpoint could be reached when last checked """
+        return self.link_up.is_set()
+
+    def add_listener(self, callback):
+        """ Call callback (from the monitor's thread) whenever the link comes up """
+        self.listeners.append(callback)
+
+    def wait_for_link_up(self, timeout):
+        """ Wait up to timeout seconds for the link to come back up. Returns
+        whether it did, including since the last call. """
+        _came_up = self.link_came_up.wait(timeout)
+        self.link_came_up.clear()
+        return _came_up
+
+    def report_success(self):
+        """ The endpoint was just reached, so no probe is needed for a while """
+        self.last_success = time.time()
+        if not self.is_up():
+            self._set_state(True)
+
+    def report_failure(self):
+        """ The endpoint was just not reached; probe again straight away """
+        self._set_state(False)
+        self.wake.set()
+
+    def run(self):
+        """ Probe every probe_frequency_s while up, every retry_frequency_s while down """
+        while True:
+            if self.is_up() and time.time() - self.last_success < self.probe_frequency_s:
+                _up = True
+            else:
+                _up = self.probe()
+            self._set_state(_up)
+            if not _up and time.time() >= self.next_restart:
+                self._restart_interface()
+            self.wake.wait(self.probe_frequency_s if _up else self.retry_frequency_s)
+            self.wake.clear()
+
+    def probe(self):
+        """ Whether a TCP connection can be made to the endpoint """
+        with CONNECT_SECONDS.time():
+            try:
+                if self.address is None or time.time() - self.resolved_time > self.dns_ttl_s:
+                    self.address = socket.gethostbyname(self.host)
+                    self.resolved_time = time.time()
+                with socket.create_connection((self.address, self.port), self.probe_timeout_s):
+                    pass
+            except OSError as ex:
+                LOG.debug("Probe of %s:%s failed: %s", self.host, self.port, ex)
+                # The address may have changed
+                self.address = None
+                return False
+        self.last_success = time.time()
+        return True
+
+    def _set_state(self, up):
+        """ Record the link state, announcing changes. Only a link that was
+        known to be down comes up; the first probe (from start) just sets the
+        state, so nobody is woken for a link that was up all along. """
+        _went_down = False
+        with self.lock:
+            _was_up = self.link_up.is_set()
+            _was_down = self.down_since is not None
+            if up:
+                self.link_up.set()
+                self.down_since = None
+                self.restart_backoff_s = self.restart_after_s
+            elif _was_up or self.down_since is None:
+                self.link_up.clear()
+                self.link_came_up.clear()
+                self.down_since = time.time()
+                self.next_restart = self.down_since + self.restart_after_s
+                _went_down = True
+        LINK_UP.set(1 if up else 0)
+        if up and not _was_up:
+            LOG.info("Connectivity to %s:%s", self.host, self.port)
+            if _was_down:
+                self.link_came_up.set()
+                for _callback in self.listeners:
+                    _callback()
+        elif _went_down:
+            LOG.warning("No connectivity to %s:%s", self.host, self.port)
+
+    def _restart_interface(self):
+        """ Restart the wlan interface, and back off before doing so again """
+        _wlan_interface = BRICK_CONFIG["uploader"]["wlan_interface"]
+        LOG.info(
+            "Restarting wlan interface %s, offline for %ds",
+            _wlan_interface, time.time() - self.down_since
+        )
+        try:
+            subprocess.run(
+                self.restart_command, stdout=subprocess.DEVNULL, timeout=60, check=True
+            )
+        except (OSError, subprocess.SubprocessError) as ex:
+            LOG.error("wlan interface not restarted: %s", ex)
+        else:
+            INTERFACE_RESTARTS.inc()
+        self.restart_backoff_s = min(self.restart_backoff_s * 2, self.restart_backoff_max_s)
+        self.next_restart = time.time() + self.restart_backoff_s
 
 class AWSIoTUploader():
     """ Upload single AWS IoT message using HTTPS, and handle responses """
     # pylint: disable=too-few-public-methods
 
-    def __init__(self, aws_iot_thing_ca):
+    def __init__(self, aws_iot_thing_ca, timeout_s):
         """ Initialise requests REST parameters for upload """
         self.aws_ca_certfile = BRICK_CONFIG["uploader"]["cert_dir"] + aws_iot_thing_ca
+        self.timeout_s = timeout_s
 
     def upload(self, data, thing_endpoint, thing_cert, thing_key):
         """ Use REST POST to upload single AWS IoT message
@@ -161,32 +384,27 @@ class AWSIoTUploader():
             BRICK_CONFIG["uploader"]["cert_dir"] + thing_cert,
             BRICK_CONFIG["uploader"]["cert_dir"] + thing_key
         )
-        _response = requests.post(
-            url=aws_endpoint,
-            cert=aws_iot_certs,
-            verify=self.aws_ca_certfile,
-            data=json.dumps(data)
-        )
+        _data = json.dumps(data)
+        with UPLOAD_SECONDS.time():
+            try:
+                _response = requests.post(
+                    url=aws_endpoint,
+                    cert=aws_iot_certs,
+                    verify=self.aws_ca_certfile,
+                    data=_data,
+                    timeout=self.timeout_s
+                )
+            except requests.exceptions.RequestException:
+                UPLOADS.inc(label="error")
+                raise
+        UPLOADS.inc(label=_response.status_code)
+        if _response.status_code == 200:
+            UPLOAD_BYTES.inc(len(_data))
         return _response
 
-def test_connection(url, port):
-    """ Test connectivity to a URL / port """
-    connection = False
-    try:
-        host = socket.gethostbyname(url)
-        _socket = socket.create_connection((host, port), 2)
-        connection = True
-    except:
-        pass
-    return connection
-
-def printf(message):
-    """ Print to console wrapper, inludes timestamp.
-    Flushes buffer to output when using Supervisor """
-    print(str(datetime.datetime.now()) + ": " + str(message), flush=True)
-
 def main():
     """ Main application """
+    metrics.start()
     uploader = Uploader(active_trackers)
     uploader.run()
 
@@ -195,5 +413,5 @@ if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        printf("Uploader stopped")
+        LOG.info("Uploader stopped")
         sys.exit()
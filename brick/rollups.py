@@ -0,0 +1,269 @@
+""" rollups.py
+Per device, per time bucket aggregates of the records in the SQLite buffer, kept
+up to date as records are stored (in the same transaction, though a failure
+in the rollups never loses the records), so that questions
+such as distance per hour, the highest altitude today or packets per tracker
+per 10 minutes are answered from a few rows, however long the history.
+Configured from the "rollups" section of the brick config.
+For each device, bucket size and bucket, every field has a count, total,
+minimum and maximum (so also a mean):
+records: 1 per record, so its count is the number of records
+distance_km, climb_m: from the device's previous record
+altitude, temperature, pressure, humidity, light: the brick's own readings
+Buckets start at multiples of their size since the epoch, with timestamps taken
+as UTC (the brick's clock is set from GPS), so a day bucket is a UTC day.
+Needs SQLite 3.24 or later (for upserts); with an older SQLite, rollups are
+left disabled.
+"""
+
+import json
+import time
+import sqlite3
+import calendar
+import datetime
+import logging
+from haversine import haversine
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+DEFAULT_BUCKETS_S = (600, 3600, 86400)
+MIN_SQLITE_VERSION = (3, 24, 0)
+SENSOR_FIELDS = ("altitude", "temperature", "pressure", "humidity", "light")
+ROLLUP_TABLE = "rollups"
+STATE_TABLE = "rollup_state"
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS " + ROLLUP_TABLE + " (dev_uid INTEGER NOT NULL, "
+    "bucket_s INTEGER NOT NULL, field TEXT NOT NULL, bucket_start INTEGER NOT NULL, "
+    "count INTEGER NOT NULL, total REAL NOT NULL, minimum REAL NOT NULL, maximum REAL NOT NULL, "
+    "PRIMARY KEY (dev_uid, bucket_s, field, bucket_start)) WITHOUT ROWID",
+    # Each device's latest position, for the distance to its next record
+    "CREATE TABLE IF NOT EXISTS " + STATE_TABLE + " (dev_uid INTEGER PRIMARY KEY, "
+    "timestamp TEXT NOT NULL, position_lat REAL, position_long REAL, altitude REAL)",
+)
+_UPSERT = (
+    "INSERT INTO " + ROLLUP_TABLE + " VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (dev_uid, bucket_s, field, bucket_start) DO UPDATE SET "
+    "count = count + excluded.count, total = total + excluded.total, "
+    "minimum = MIN(minimum, excluded.minimum), maximum = MAX(maximum, excluded.maximum)"
+)
+_COLUMNS = "bucket_start, count, total, minimum, maximum"
+
+LOG = logging.getLogger("riot.rollups")
+
+try:
+    # Much quicker than strptime, for "YYYY-MM-DD HH:MM:SS"
+    _from_timestamp = datetime.datetime.fromisoformat
+except AttributeError:
+    # Python before 3.7
+    def _from_timestamp(timestamp):
+        """ A datetime from a stored (or ISO 8601, to the second) timestamp """
+        return datetime.datetime.strptime(timestamp[:19].replace("T", " "), TIMESTAMP_FORMAT)
+
+class Rollups():
+    """ Updates, and answers queries from, the rollups of the buffer """
+
+    def __init__(self, rollups_config):
+        """ Nothing is kept unless enabled """
+        self.enabled = rollups_config.get("enabled", False)
+        self.buckets_s = tuple(rollups_config.get("bucket_s", DEFAULT_BUCKETS_S))
+
+    def create_tables(self, database, table):
+        """ Create the rollup tables if need be, filling them from the records
+        already in the buffer table when first created """
+        if not self.enabled:
+            return
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            LOG.warning(
+                "Rollups disabled: SQLite %s is older than %s", sqlite3.sqlite_version,
+                ".".join(str(_part) for _part in MIN_SQLITE_VERSION)
+            )
+            self.enabled = False
+            return
+        _conn = sqlite3.connect(database, isolation_level=None)
+        try:
+            # Taken before checking, so only one daemon does the filling
+            _conn.execute("BEGIN IMMEDIATE")
+            _exists = _conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (STATE_TABLE,)
+            ).fetchone()
+            if not _exists:
+                for _statement in SCHEMA:
+                    _conn.execute(_statement)
+                _rows = _conn.execute(
+                    "SELECT dev_uid, payload FROM " + table + " ORDER BY id ASC"
+                )
+                _count = 0
+                while True:
+                    _batch = _rows.fetchmany(10000)
+                    if not _batch:
+                        break
+                    self._add(_conn, _batch)
+                    _count += len(_batch)
+                LOG.info("Rollups created from %d stored records", _count)
+            _conn.execute("COMMIT")
+        except Exception as ex:  # pylint: disable=broad-except
+            LOG.error("Rollups not created: %s", ex)
+        finally:
+            _conn.close()
+
+    def update(self, conn, records):
+        """ Add records, as (dev_uid, payload) with the payload as a dict or as
+        stored, to the rollups. Runs in the caller's transaction, so is committed
+        (or not) along with the records themselves. Events are left out.
+        Any error is logged, and the rollups left as they were, in a savepoint,
+        so the caller still commits the records. """
+        if not self.enabled:
+            return
+        conn.execute("SAVEPOINT rollups")
+        try:
+            self._add(conn, records)
+        except Exception as ex:  # pylint: disable=broad-except
+            LOG.error("Rollups not updated for %d records: %s", len(records), ex)
+            conn.execute("ROLLBACK TO rollups")
+        conn.execute("RELEASE rollups")
+
+    def _add(self, conn, records):
+        """ Add records to the rollups, in the current transaction """
+        _states = {}
+        _changed = set()
+        # Merged here first, so a batch costs one upsert per bucket and field
+        _rows = {}
+        for _dev_uid, _payload in records:
+            if isinstance(_payload, str):
+                try:
+                    _payload = json.loads(_payload.replace("'", '"'))
+                except ValueError:
+                    continue
+            if "event" in _payload:
+                continue
+            _data = _payload.get("rfproxy", _payload)
+            _timestamp = _data.get("timestamp")
+            try:
+                _seconds = to_seconds(_timestamp)
+            except (TypeError, ValueError):
+                continue
+            _values = {"records": 1.0}
+            for _field in SENSOR_FIELDS:
+                if isinstance(_data.get(_field), (int, float)):
+                    _values[_field] = float(_data[_field])
+            if _dev_uid not in _states:
+                _states[_dev_uid] = _load_state(conn, _dev_uid)
+            _state = _states[_dev_uid]
+            _position = (_data.get("position_lat"), _data.get("position_long"))
+            # Older records (e.g. backfilled) are counted, but not travelled
+            if None not in _position and (_state is None or _state[0] <= _timestamp):
+                if _state is not None and _state[1] is not None:
+                    _values["distance_km"] = haversine((_state[1], _state[2]), _position)
+                    if "altitude" in _values and _state[3] is not None:
+                        _values["climb_m"] = max(0.0, _values["altitude"] - _state[3])
+                _states[_dev_uid] = (_timestamp,) + _position + (_values.get("altitude"),)
+                _changed.add(_dev_uid)
+            for _bucket_s in self.buckets_s:
+                _start = _seconds - _seconds % _bucket_s
+                for _field, _value in _values.items():
+                    _key = (_dev_uid, _bucket_s, _field, _start)
+                    _row = _rows.get(_key)
+                    if _row is None:
+                        _rows[_key] = [1, _value, _value, _value]
+                    else:
+                        _row[0] += 1
+                        _row[1] += _value
+                        _row[2] = min(_row[2], _value)
+                        _row[3] = max(_row[3], _value)
+        conn.executemany(_UPSERT, [_key + tuple(_row) for _key, _row in _rows.items()])
+        conn.executemany(
+            "INSERT OR REPLACE INTO " + STATE_TABLE + " VALUES (?, ?, ?, ?, ?)",
+            [(_dev_uid,) + _states[_dev_uid] for _dev_uid in _changed]
+        )
+
+    def bucket(self, conn, dev_uid, field, bucket_s, at):
+        """ The bucket of bucket_s containing at, e.g. today's altitude with
+        (0, "altitude", 86400, now). None if nothing was recorded. """
+        _seconds = to_seconds(at)
+        _row = conn.execute(
+            "SELECT " + _COLUMNS + " FROM " + ROLLUP_TABLE +
+            " WHERE dev_uid = ? AND bucket_s = ? AND field = ? AND bucket_start = ?",
+            (dev_uid, bucket_s, field, _seconds - _seconds % bucket_s)
+        ).fetchone()
+        return _aggregate(_row) if _row else None
+
+    def series(self, conn, dev_uid, field, bucket_s, start, end):
+        """ Buckets of bucket_s from the one containing start up to end, oldest
+        first, e.g. distance per hour with ("distance_km", 3600). Empty buckets
+        are left out. """
+        _start = to_seconds(start)
+        return [
+            _aggregate(_row) for _row in conn.execute(
+                "SELECT " + _COLUMNS + " FROM " + ROLLUP_TABLE +
+                " WHERE dev_uid = ? AND bucket_s = ? AND field = ? "
+                "AND bucket_start >= ? AND bucket_start <= ? ORDER BY bucket_start",
+                (dev_uid, bucket_s, field, _start - _start % bucket_s, to_seconds(end))
+            )
+        ]
+
+    def summary(self, conn, dev_uid, field, start, end):
+        """ One aggregate from start to end (exclusive), to the resolution of
+        the smallest bucket, made up from as few (and as large) buckets as
+        possible. None if nothing was recorded. """
+        _smallest_s = min(self.buckets_s)
+        _time = to_seconds(start) // _smallest_s * _smallest_s
+        _end = to_seconds(end)
+        _cover = {}
+        while _time < _end:
+            _bucket_s = max(
+                _size for _size in self.buckets_s
+                if _time % _size == 0 and (_time + _size <= _end or _size == _smallest_s)
+            )
+            _cover.setdefault(_bucket_s, []).append(_time)
+            _time += _bucket_s
+        _rows = []
+        for _bucket_s, _starts in _cover.items():
+            _rows.extend(conn.execute(
+                "SELECT " + _COLUMNS + " FROM " + ROLLUP_TABLE +
+                " WHERE dev_uid = ? AND bucket_s = ? AND field = ? AND bucket_start IN (" +
+                ", ".join("?" * len(_starts)) + ")",
+                [dev_uid, _bucket_s, field] + _starts
+            ))
+        if not _rows:
+            return None
+        return _aggregate((
+            to_timestamp(min(_row[0] for _row in _rows)),
+            sum(_row[1] for _row in _rows),
+            sum(_row[2] for _row in _rows),
+            min(_row[3] for _row in _rows),
+            max(_row[4] for _row in _rows),
+        ))
+
+    def devices(self, conn):
+        """ dev_uids with rollups """
+        return [_row[0] for _row in conn.execute("SELECT dev_uid FROM " + STATE_TABLE)]
+
+def _load_state(conn, dev_uid):
+    """ (timestamp, latitude, longitude, altitude) of a device's latest record """
+    return conn.execute(
+        "SELECT timestamp, position_lat, position_long, altitude FROM " + STATE_TABLE +
+        " WHERE dev_uid = ?", (dev_uid,)
+    ).fetchone()
+
+def _aggregate(row):
+    """ A rollup row as a dict """
+    _start, _count, _total, _minimum, _maximum = row
+    return {
+        "start": _start if isinstance(_start, str) else to_timestamp(_start),
+        "count": _count,
+        "total": _total,
+        "min": _minimum,
+        "max": _maximum,
+        "mean": _total / _count,
+    }
+
+def to_seconds(moment):
+    """ Seconds since the epoch from a stored timestamp, datetime or number """
+    if isinstance(moment, (int, float)):
+        return int(moment)
+    if isinstance(moment, str):
+        moment = _from_timestamp(moment)
+    return calendar.timegm(moment.timetuple())
+
+def to_timestamp(seconds):
+    """ A stored timestamp from seconds since the epoch """
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds))
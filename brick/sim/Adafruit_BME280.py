@@ -0,0 +1,30 @@
+""" Adafruit_BME280.py
+Stand-in BME280 temperature, pressure and humidity sensor, for the brick simulator.
+"""
+
+import random
+
+class BME280():
+    """ Weather sensor on an I2C address """
+
+    def __init__(self, address=0x76):
+        """ Readings wander around a cool, damp day """
+        self.address = address
+        self.degrees = 12.0
+        self.pascals = 90000.0
+        self.humidity = 85.0
+
+    def read_temperature(self):
+        """ Degrees C """
+        self.degrees += random.uniform(-0.1, 0.1)
+        return self.degrees
+
+    def read_pressure(self):
+        """ Pascals """
+        self.pascals += random.uniform(-5, 5)
+        return self.pascals
+
+    def read_humidity(self):
+        """ Relative humidity, % """
+        self.humidity = min(100.0, max(0.0, self.humidity + random.uniform(-0.5, 0.5)))
+        return self.humidity
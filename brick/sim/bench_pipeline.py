@@ -0,0 +1,585 @@
+""" bench_pipeline.py
+End to end benchmark of the brick: runs the real SensorController, NRF and
+Uploader (from riot-brick-sensors.py, riot-brick-rfproxy.py and
+riot-brick-upload.py) against the stand-ins in this directory - I2C sensors,
+gpsd, an nRF24 radio receiving packets at a set rate, and a local mutual TLS
+server in place of AWS IoT (run as a separate process, see iotserver.py).
+Each fix and packet is followed from capture to acknowledgement, and the
+results printed (and optionally saved) as JSON, for tracking over time:
+records/s stored and uploaded, capture to ack latency percentiles, SQLite
+statements and file writes, and peak RSS.
+The services run in threads of this process, on their own loops as the
+separate daemons do, or (with --buffer runtime) storing payloads through the
+batched buffer of riot-brick-runtime.py. requests, psutil and gpxpy must be
+installed, as for the brick itself. Commands run with sudo (setting the
+clock, restarting the wlan) are not run.
+python bench_pipeline.py --duration 30 --rf-rate 20 --trackers 2 --json results.json
+With --layouts, the brick is instead run as it is deployed, one layout after
+the other: riot-brick-runtime.py as a single process, then the three daemons
+as separate processes (each started by run_service.py). The memory (RSS) and
+CPU use of each layout's processes are sampled and compared, along with the
+records each stored and uploaded.
+python bench_pipeline.py --layouts --duration 60
+"""
+
+import os
+import sys
+import time
+import json
+import shutil
+import asyncio
+import builtins
+import argparse
+import platform
+import resource
+import signal
+import sqlite3
+import tempfile
+import threading
+import subprocess
+import collections
+import importlib.util
+import psutil
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+BRICK_DIR = os.path.dirname(SIM_DIR)
+# Stand-ins first, so they are imported instead of the hardware libraries
+sys.path[0:0] = [SIM_DIR, BRICK_DIR]
+
+import gpsd
+import nrf24
+import iotserver
+import rollups
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "payload TEXT NOT NULL, dev_uid INTEGER NOT NULL, processed INTEGER NOT NULL DEFAULT 0)"
+)
+
+# Scripts run by each layout, one process each
+LAYOUTS = {
+    "runtime": ("riot-brick-runtime.py",),
+    "three_process": ("riot-brick-sensors.py", "riot-brick-rfproxy.py", "riot-brick-upload.py"),
+}
+# Seconds between samples of the layout's processes
+LAYOUT_SAMPLE_S = 0.5
+
+class WriteCounter():
+    """ Counts SQLite statements (by kind) and connections, and files opened
+    for writing (by extension), made by the brick code while installed """
+
+    def __init__(self):
+        """ Nothing is counted until installed """
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+        self.originals = None
+
+    def install(self):
+        """ Wrap sqlite3.connect and open """
+        _connect = sqlite3.connect
+        _open = builtins.open
+        self.originals = (_connect, _open)
+
+        def _counting_connect(*args, **kwargs):
+            """ Connection that reports each statement run """
+            _conn = _connect(*args, **kwargs)
+            _conn.set_trace_callback(self._statement)
+            self._count("sqlite_connections")
+            return _conn
+
+        def _counting_open(file, mode="r", *args, **kwargs):
+            """ open, counting files opened for writing """
+            if isinstance(file, str) and any(_flag in mode for _flag in "wax+"):
+                self._count("file_writes_" + (os.path.splitext(file)[1].lstrip(".") or "other"))
+            return _open(file, mode, *args, **kwargs)
+
+        sqlite3.connect = _counting_connect
+        builtins.open = _counting_open
+
+    def uninstall(self):
+        """ Put sqlite3.connect and open back """
+        sqlite3.connect, builtins.open = self.originals
+
+    def report(self):
+        """ Counts as a dict """
+        with self.lock:
+            _counts = dict(self.counts)
+        return {
+            "sqlite_connections": _counts.pop("sqlite_connections", 0),
+            "sqlite_statements": {
+                _name[7:]: _count for _name, _count in sorted(_counts.items())
+                if _name.startswith("sqlite_")
+            },
+            "file_writes": {
+                _name[12:]: _count for _name, _count in sorted(_counts.items())
+                if _name.startswith("file_writes_")
+            },
+        }
+
+    def _statement(self, statement):
+        """ Trace callback, e.g. INSERT, SELECT, BEGIN, COMMIT """
+        self._count("sqlite_" + statement.split(None, 1)[0].upper())
+
+    def _count(self, name):
+        """ Thread safe increment """
+        with self.lock:
+            self.counts[name] += 1
+
+class ServiceThread(threading.Thread):
+    """ Runs step every period_s (or as fast as it will go, for 0) until
+    stopped, keeping the first error """
+
+    def __init__(self, name, step, period_s):
+        """ Started with start() """
+        super().__init__(name=name, daemon=True)
+        self.step = step
+        self.period_s = period_s
+        self.stopped = threading.Event()
+        self.error = None
+        self.cycles = 0
+
+    def run(self):
+        """ Step until stopped """
+        while not self.stopped.is_set():
+            _start_time = time.time()
+            try:
+                self.step()
+            except Exception as ex:  # pylint: disable=broad-except
+                self.error = self.name + ": " + repr(ex)
+                return
+            self.cycles += 1
+            self.stopped.wait(max(0, self.period_s - (time.time() - _start_time)))
+
+    def stop(self):
+        """ Stop after the current step """
+        self.stopped.set()
+        self.join()
+
+class BufferThread(threading.Thread):
+    """ Event loop running riot-brick-runtime.py's PayloadBuffer """
+
+    def __init__(self, runtime, brick_config):
+        """ The buffer is usable once started """
+        super().__init__(name="buffer", daemon=True)
+        self.loop = asyncio.new_event_loop()
+        _runtime_config = brick_config.get("runtime", {})
+        self.buffer = runtime.PayloadBuffer(
+            self.loop,
+            brick_config["database"]["sqlite_database"],
+            brick_config["database"]["sqlite_table"],
+            _runtime_config.get("buffer_batch_size", 50),
+            _runtime_config.get("buffer_flush_s", 1.0),
+            rollups.Rollups(brick_config.get("rollups", {}))
+        )
+        self.task = None
+        self.ready = threading.Event()
+
+    def run(self):
+        """ Write payloads until stopped """
+        asyncio.set_event_loop(self.loop)
+        self.task = self.loop.create_task(self.buffer.run())
+        self.loop.call_soon(self.ready.set)
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def stop(self):
+        """ Write whatever is queued, then stop """
+        self.loop.call_soon_threadsafe(self.task.cancel)
+        self.join()
+
+def load_service(file_name, module_name):
+    """ Import one of the brick scripts as a module """
+    _spec = importlib.util.spec_from_file_location(module_name, os.path.join(BRICK_DIR, file_name))
+    _module = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(_module)
+    return _module
+
+def write_brick_config(args, trackers):
+    """ The brick's own config, for fast sampling and the simulated trackers """
+    with open(os.path.join(BRICK_DIR, "config", "brick_config.json")) as _config_file:
+        _brick_config = json.load(_config_file)
+    _brick_config["logging"]["log_level"] = args.log_level
+    _brick_config["sensors"]["frequency_s"] = args.sensor_period
+    _brick_config["sensors"]["gps_receiver"]["fix_retry_s"] = 0
+    _brick_config["geofence"]["landmarks_url"] = ""
+    _brick_config["metrics"]["enabled"] = False
+    _brick_config["uploader"]["frequency_s"] = args.upload_period
+    _brick_config["uploader"]["trackers"] = {"0": {"name": _brick_config["dev_id"]}}
+    for _dev_uid in trackers:
+        _brick_config["uploader"]["trackers"][str(_dev_uid)] = {
+            "name": "riot-tracker-" + str(_dev_uid)
+        }
+    with open(os.path.join("config", "brick_config.json"), "w") as _config_file:
+        json.dump(_brick_config, _config_file, indent=4)
+    return _brick_config
+
+def start_server(args, work_dir):
+    """ Start iotserver.py in its own process, and return (process, port) """
+    _port_file = os.path.join(work_dir, "server.port")
+    _process = subprocess.Popen([
+        sys.executable, os.path.join(SIM_DIR, "iotserver.py"),
+        "--cert-dir", os.path.join(work_dir, "certs"),
+        "--port-file", _port_file,
+        "--messages-file", os.path.join(work_dir, "messages.jsonl"),
+        "--latency-ms", str(args.server_latency_ms),
+        "--failure-rate", str(args.failure_rate),
+    ])
+    _deadline = time.time() + 10
+    while not os.path.exists(_port_file):
+        if _process.poll() is not None or time.time() > _deadline:
+            _process.kill()
+            raise RuntimeError("IoT server did not start")
+        time.sleep(0.05)
+    with open(_port_file) as _port_file_handle:
+        return _process, int(_port_file_handle.read())
+
+def set_environment(brick_config, certificates, port, work_dir):
+    """ Certificate and endpoint variables, as set for the uploader on a brick,
+    and a sudo that does nothing """
+    os.environ["AWS_IOT_THING_CA"] = certificates["ca"]
+    for _key, _tracker in brick_config["uploader"]["trackers"].items():
+        _prefix = "AWS_IOT_" + _key.upper() + "_"
+        os.environ[_prefix + "CERT"] = certificates["client_cert"]
+        os.environ[_prefix + "KEY"] = certificates["client_key"]
+        os.environ[_prefix + "ENDPOINT"] =\
+            "https://localhost:" + str(port) + "/topics/riot/" + _tracker["name"]
+    _bin_dir = os.path.join(work_dir, "bin")
+    os.makedirs(_bin_dir)
+    _sudo = os.path.join(_bin_dir, "sudo")
+    with open(_sudo, "w") as _sudo_file:
+        _sudo_file.write("#!/bin/sh\nexit 0\n")
+    os.chmod(_sudo, 0o755)
+    os.environ["PATH"] = _bin_dir + os.pathsep + os.environ.get("PATH", "")
+
+def match_acks(messages_file):
+    """ Latencies from capture to ack, in ms, and counts of acks that matched
+    no capture (e.g. arrival events) or were repeats """
+    _gps_captures = dict(gpsd.CAPTURES)
+    _rf_captures = {(_dev_uid, _sequence): _time for _dev_uid, _sequence, _time in nrf24.CAPTURES}
+    _latencies_ms = []
+    _seen = set()
+    _unmatched = 0
+    _duplicates = 0
+    _last_ack = None
+    with open(messages_file) as _messages:
+        for _line in _messages:
+            _ack_time, _topic, _payload = json.loads(_line)
+            _last_ack = _ack_time if _last_ack is None else max(_last_ack, _ack_time)
+            if "rfproxy" in _payload:
+                _rf_data = _payload["rfproxy"]
+                _decimals = int(repr(float(_rf_data["position_long"])).split(".")[1])
+                _key = ("rf", _rf_data["dev_uid"], (_decimals - 1) // 10)
+                _capture_time = _rf_captures.get(_key[1:])
+            elif "altitude" in _payload and "event" not in _payload:
+                _key = ("gps", int(_payload["altitude"]))
+                _capture_time = _gps_captures.get(_key[1])
+            else:
+                _unmatched += 1
+                continue
+            if _capture_time is None:
+                _unmatched += 1
+            elif _key in _seen:
+                _duplicates += 1
+            else:
+                _seen.add(_key)
+                _latencies_ms.append((_ack_time - _capture_time) * 1000.0)
+    return _latencies_ms, _unmatched, _duplicates, _last_ack
+
+def percentile(values, fraction):
+    """ Nearest rank percentile of sorted values """
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))], 1)
+
+def backlog(connect, brick_config):
+    """ (stored, not yet uploaded) records """
+    _conn = connect(brick_config["database"]["sqlite_database"])
+    try:
+        return _conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(processed = 0), 0) FROM " +
+            brick_config["database"]["sqlite_table"]
+        ).fetchone()
+    finally:
+        _conn.close()
+
+def prepare_work_dir(args, work_dir):
+    """ Config, database and certificates for a run in work_dir, which is made
+    the current directory. Returns (brick config, trackers, certificates). """
+    for _dir in ("config", "db", "data", "certs"):
+        os.makedirs(os.path.join(work_dir, _dir))
+    os.chdir(work_dir)
+    _trackers = list(range(1, args.trackers + 1))
+    _brick_config = write_brick_config(args, _trackers)
+    _conn = sqlite3.connect(_brick_config["database"]["sqlite_database"])
+    _conn.execute(SCHEMA.format(table=_brick_config["database"]["sqlite_table"]))
+    _conn.commit()
+    _conn.close()
+    return _brick_config, _trackers, iotserver.generate_certificates("certs")
+
+def run_benchmark(args, work_dir):
+    """ Run the services for the duration, then let the uploader catch up """
+    # pylint: disable=too-many-locals,too-many-statements
+    _brick_config, _trackers, _certificates = prepare_work_dir(args, work_dir)
+    _server, _port = start_server(args, work_dir)
+    try:
+        set_environment(_brick_config, _certificates, _port, work_dir)
+        _sensors = load_service("riot-brick-sensors.py", "riot_brick_sensors")
+        _rfproxy = load_service("riot-brick-rfproxy.py", "riot_brick_rfproxy")
+        _uploader = load_service("riot-brick-upload.py", "riot_brick_uploader")
+        _buffer_thread = None
+        if args.buffer == "runtime":
+            _buffer_thread = BufferThread(
+                load_service("riot-brick-runtime.py", "riot_brick_runtime"), _brick_config
+            )
+        gpsd.set_track(gpsd.default_track)
+        nrf24.configure(args.rf_rate, _trackers, bad_id_rate=args.bad_id_rate)
+        _counter = WriteCounter()
+        _counter.install()
+        _controller = _sensors.SensorController(_brick_config)
+        _nrf = _rfproxy.NRF(_brick_config)
+        _upload_controller = _uploader.Uploader(_uploader.active_trackers)
+        if _buffer_thread is not None:
+            _buffer_thread.start()
+            _buffer_thread.ready.wait()
+            _controller.buffer = _buffer_thread.buffer
+            _nrf.buffer = _buffer_thread.buffer
+        _read_frequency_s = _brick_config["rfproxy"]["nrf24_read_frequency_s"]
+
+        def _rf_step():
+            """ One poll of the radio """
+            if _nrf.available():
+                _nrf.receive()
+            else:
+                time.sleep(_read_frequency_s)
+
+        _ingest_threads = [
+            ServiceThread("sensors", _controller.sample, args.sensor_period),
+            ServiceThread("rfproxy", _rf_step, 0),
+        ]
+        _upload_thread = ServiceThread(
+            "uploader", _upload_controller.upload_cycle, args.upload_period
+        )
+        _cpu_start = time.process_time()
+        _start_time = time.time()
+        for _thread in _ingest_threads + [_upload_thread]:
+            _thread.start()
+        _deadline = _start_time + args.duration
+        while time.time() < _deadline and not any(_thread.error for _thread in _ingest_threads):
+            time.sleep(0.1)
+        for _thread in _ingest_threads:
+            _thread.stop()
+        if _buffer_thread is not None:
+            _buffer_thread.stop()
+        _ingest_time = time.time() - _start_time
+        # Let the uploader clear the backlog
+        _drain_deadline = time.time() + args.drain_timeout
+        _pending = backlog(_counter.originals[0], _brick_config)[1]
+        while _pending and time.time() < _drain_deadline and not _upload_thread.error:
+            time.sleep(0.1)
+            _pending = backlog(_counter.originals[0], _brick_config)[1]
+        _upload_thread.stop()
+        _end_time = time.time()
+        _cpu_seconds = time.process_time() - _cpu_start
+        _counter.uninstall()
+    finally:
+        _server.terminate()
+        _server.wait()
+    _stored, _pending = backlog(sqlite3.connect, _brick_config)
+    _latencies_ms, _unmatched, _duplicates, _last_ack =\
+        match_acks(os.path.join(work_dir, "messages.jsonl"))
+    _latencies_ms.sort()
+    # Fixes taken while the GPS receiver started up are not sampled
+    _captured = len(nrf24.CAPTURES) + len(
+        [_capture for _capture in gpsd.CAPTURES if _capture[1] >= _start_time]
+    )
+    _upload_time = (_last_ack or _end_time) - _start_time
+    return {
+        "ingest_seconds": round(_ingest_time, 2),
+        "total_seconds": round(_end_time - _start_time, 2),
+        "records": {
+            "captured": _captured,
+            "stored": _stored,
+            "uploaded": _stored - _pending,
+            "acked": len(_latencies_ms),
+            "not_acked": _stored - _pending - len(_latencies_ms),
+            "pending": _pending,
+            "ack_duplicates": _duplicates,
+            "ack_unmatched": _unmatched,
+        },
+        "throughput": {
+            "stored_per_s": round(_stored / _ingest_time, 2),
+            "uploaded_per_s": round(len(_latencies_ms) / _upload_time, 2) if _upload_time > 0 else 0,
+        },
+        "latency_ms": {
+            "p50": percentile(_latencies_ms, 0.50),
+            "p90": percentile(_latencies_ms, 0.90),
+            "p99": percentile(_latencies_ms, 0.99),
+            "max": round(_latencies_ms[-1], 1) if _latencies_ms else None,
+        },
+        "writes": _counter.report(),
+        "cycles": {_thread.name: _thread.cycles for _thread in _ingest_threads + [_upload_thread]},
+        "cpu_seconds": round(_cpu_seconds, 2),
+        # Linux reports kilobytes
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+        "errors": [
+            _thread.error for _thread in _ingest_threads + [_upload_thread] if _thread.error
+        ],
+    }
+
+def run_layout(args, work_dir, layout):
+    """ Run a layout's processes for the duration, sampling their memory and
+    CPU use, then stop them as Supervisor would (SIGINT) """
+    # pylint: disable=too-many-locals
+    _brick_config, _trackers, _certificates = prepare_work_dir(args, work_dir)
+    _server, _port = start_server(args, work_dir)
+    _processes = {}
+    try:
+        set_environment(_brick_config, _certificates, _port, work_dir)
+        for _file_name in LAYOUTS[layout]:
+            with open(os.path.splitext(_file_name)[0] + ".log", "w") as _log_file:
+                _processes[_file_name] = psutil.Popen(
+                    [sys.executable, os.path.join(SIM_DIR, "run_service.py"), _file_name,
+                     "--rf-rate", str(args.rf_rate), "--trackers", str(args.trackers),
+                     "--bad-id-rate", str(args.bad_id_rate)],
+                    stdout=_log_file, stderr=subprocess.STDOUT
+                )
+        _rss_mb = {_file_name: [] for _file_name in _processes}
+        _start_time = time.time()
+        while time.time() < _start_time + args.duration:
+            time.sleep(LAYOUT_SAMPLE_S)
+            for _file_name, _process in _processes.items():
+                if _process.poll() is not None:
+                    raise RuntimeError(_file_name + " exited with " + str(_process.returncode))
+                _rss_mb[_file_name].append(_process.memory_info().rss / 1024.0 / 1024.0)
+        _elapsed = time.time() - _start_time
+        _cpu_seconds = {
+            _file_name: sum(_process.cpu_times()[:2]) for _file_name, _process in _processes.items()
+        }
+    finally:
+        for _process in _processes.values():
+            if _process.poll() is None:
+                _process.send_signal(signal.SIGINT)
+        for _process in _processes.values():
+            try:
+                _process.wait(10)
+            except subprocess.TimeoutExpired:
+                _process.kill()
+        _server.terminate()
+        _server.wait()
+    _stored, _pending = backlog(sqlite3.connect, _brick_config)
+    # RSS of the layout as a whole, at each sample
+    _total_rss_mb = [sum(_sample) for _sample in zip(*_rss_mb.values())]
+    return {
+        "layout": layout,
+        "processes": len(_processes),
+        "seconds": round(_elapsed, 2),
+        "rss_mb": {
+            "peak": round(max(_total_rss_mb), 1),
+            "mean": round(sum(_total_rss_mb) / len(_total_rss_mb), 1),
+        },
+        "cpu_seconds": round(sum(_cpu_seconds.values()), 2),
+        "cpu_percent": round(sum(_cpu_seconds.values()) / _elapsed * 100, 1),
+        "records": {"stored": _stored, "uploaded": _stored - _pending},
+        "by_process": {
+            _file_name: {
+                "peak_rss_mb": round(max(_rss_mb[_file_name]), 1),
+                "cpu_seconds": round(_cpu_seconds[_file_name], 2),
+            } for _file_name in _processes
+        },
+    }
+
+def compare_layouts(args):
+    """ Run each layout in turn, each in a new working directory """
+    _results = []
+    _cwd = os.getcwd()
+    for _layout in LAYOUTS:
+        _work_dir = tempfile.mkdtemp(prefix="riot-bench-" + _layout + "-")
+        try:
+            _results.append(run_layout(args, _work_dir, _layout))
+        finally:
+            os.chdir(_cwd)
+            if args.keep:
+                print("Working directory kept:", _work_dir, file=sys.stderr)
+            else:
+                shutil.rmtree(_work_dir, ignore_errors=True)
+    return _results
+
+def main():
+    """ Parse arguments, run, and report """
+    _parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    _parser.add_argument("--duration", type=float, default=30.0,
+                         help="Seconds of sensor sampling and packet reception")
+    _parser.add_argument("--sensor-period", type=float, default=1.0,
+                         help="Seconds between sensor cycles (frequency_s)")
+    _parser.add_argument("--rf-rate", type=float, default=10.0,
+                         help="nRF24 packets per second, across all trackers")
+    _parser.add_argument("--trackers", type=int, default=2, help="Remote trackers")
+    _parser.add_argument("--bad-id-rate", type=float, default=0.0,
+                         help="Fraction of packets with the wrong shared id")
+    _parser.add_argument("--upload-period", type=float, default=5.0,
+                         help="Seconds between upload cycles (frequency_s)")
+    _parser.add_argument("--server-latency-ms", type=float, default=0.0,
+                         help="Added to every response from the IoT server")
+    _parser.add_argument("--failure-rate", type=float, default=0.0,
+                         help="Fraction of uploads refused with a 503")
+    _parser.add_argument("--drain-timeout", type=float, default=60.0,
+                         help="Seconds to wait for the uploader to catch up afterwards")
+    _parser.add_argument("--buffer", choices=("direct", "runtime"), default="direct",
+                         help="Store payloads directly, or through the runtime's batched buffer")
+    _parser.add_argument("--layouts", action="store_true",
+                         help="Compare the memory and CPU use of the runtime and the three daemons")
+    _parser.add_argument("--log-level", default="WARNING", help="Brick log level")
+    _parser.add_argument("--json", help="Also write the results to this file")
+    _parser.add_argument("--keep", action="store_true",
+                         help="Keep the working directory (database, CSV, GPX, acks)")
+    _args = _parser.parse_args()
+    if _args.json:
+        _args.json = os.path.abspath(_args.json)
+    if _args.layouts:
+        _report = {
+            "benchmark": "brick_layouts",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "parameters": {_name: _value for _name, _value in vars(_args).items() if _name != "json"},
+            "results": compare_layouts(_args),
+        }
+        print(json.dumps(_report, indent=2))
+        if _args.json:
+            with open(_args.json, "w") as _json_file:
+                json.dump(_report, _json_file, indent=2)
+        return
+    _work_dir = tempfile.mkdtemp(prefix="riot-bench-")
+    _cwd = os.getcwd()
+    # The brick logs to stdout, which is kept for the results
+    _stdout, sys.stdout = sys.stdout, sys.stderr
+    try:
+        _results = run_benchmark(_args, _work_dir)
+    finally:
+        sys.stdout = _stdout
+        os.chdir(_cwd)
+        if _args.keep:
+            print("Working directory kept:", _work_dir, file=sys.stderr)
+        else:
+            shutil.rmtree(_work_dir, ignore_errors=True)
+    _report = {
+        "benchmark": "brick_pipeline",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "parameters": {_name: _value for _name, _value in vars(_args).items() if _name != "json"},
+        "results": _results,
+    }
+    print(json.dumps(_report, indent=2))
+    if _args.json:
+        with open(_args.json, "w") as _json_file:
+            json.dump(_report, _json_file, indent=2)
+    if _results["errors"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+""" gpsd.py
+Stand-in for the gpsd-py3 client, for the brick simulator. Positions come from
+a track function (set with set_track), and every fix handed out is recorded in
+CAPTURES as (sequence number, time), so that the benchmark can work out how long
+it took to reach AWS IoT. The sequence number is passed as the altitude.
+"""
+
+import datetime
+import math
+import time
+
+class NoFixError(Exception):
+    """ No fix (yet) """
+
+state = {"simulated": True}
+CAPTURES = []
+_TRACK = {"track": None, "sequence": 0}
+
+def default_track(sequence):
+    """ Walking pace, north east from the foot of Pen y Fan """
+    _distance_deg = sequence * 0.00002
+    return (51.8638 + _distance_deg * math.cos(0.6), -3.4467 + _distance_deg * math.sin(0.6))
+
+def set_track(track):
+    """ Use track(sequence) for the position of each fix """
+    _TRACK["track"] = track
+    _TRACK["sequence"] = 0
+    del CAPTURES[:]
+
+class _Current():
+    """ Result of get_current """
+
+    def __init__(self, sequence):
+        """ A 3D fix """
+        self.mode = 3
+        self.sequence = sequence
+
+    def get_time(self):
+        """ UTC time of the fix """
+        return datetime.datetime.utcnow()
+
+    def position(self):
+        """ (latitude, longitude) """
+        return (_TRACK["track"] or default_track)(self.sequence)
+
+    def altitude(self):
+        """ The sequence number, so payloads can be matched up to their fix """
+        return float(self.sequence)
+
+def connect(host="127.0.0.1", port=2947):
+    """ Nothing to connect to """
+    # pylint: disable=unused-argument
+
+def get_current():
+    """ The next fix on the track """
+    _TRACK["sequence"] += 1
+    CAPTURES.append((_TRACK["sequence"], time.time()))
+    return _Current(_TRACK["sequence"])
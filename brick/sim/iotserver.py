@@ -0,0 +1,176 @@
+""" iotserver.py
+Local stand-in for the AWS IoT HTTPS endpoint, for the brick simulator. Like AWS
+IoT, it only accepts clients presenting a certificate signed by its CA (mutual
+TLS). Certificates are generated with the openssl command line tool. Every
+accepted message is recorded in MESSAGES as (time, topic, payload), and
+optionally written to a JSON lines file.
+Run on its own (so as not to share the GIL with the code being measured):
+python iotserver.py --cert-dir certs --port-file port --messages-file messages.jsonl
+"""
+
+import os
+import sys
+import ssl
+import argparse
+import json
+import time
+import random
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+MESSAGES = []
+_LOCK = threading.Lock()
+
+def generate_certificates(cert_dir):
+    """ CA, server (for localhost) and client certificates, as file names
+    relative to cert_dir: {"ca", "server_cert", "server_key", "client_cert", "client_key"} """
+    _files = {
+        "ca": "ca.pem", "ca_key": "ca.key",
+        "server_cert": "server.pem", "server_key": "server.key",
+        "client_cert": "client.pem", "client_key": "client.key",
+    }
+    _paths = {_name: os.path.join(cert_dir, _file) for _name, _file in _files.items()}
+    _extensions = os.path.join(cert_dir, "server.ext")
+    with open(_extensions, "w") as _extensions_file:
+        _extensions_file.write("subjectAltName=DNS:localhost,IP:127.0.0.1\n")
+    _commands = [
+        ["req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=riot-sim-ca",
+         "-keyout", _paths["ca_key"], "-out", _paths["ca"]],
+    ]
+    for _name, _subject in (("server", "/CN=localhost"), ("client", "/CN=riot-brick")):
+        _csr = os.path.join(cert_dir, _name + ".csr")
+        _commands.append(
+            ["req", "-newkey", "rsa:2048", "-nodes", "-subj", _subject,
+             "-keyout", _paths[_name + "_key"], "-out", _csr]
+        )
+        _sign = ["x509", "-req", "-in", _csr, "-CA", _paths["ca"], "-CAkey", _paths["ca_key"],
+                 "-CAcreateserial", "-days", "1", "-out", _paths[_name + "_cert"]]
+        if _name == "server":
+            _sign += ["-extfile", _extensions]
+        _commands.append(_sign)
+    for _command in _commands:
+        subprocess.run(
+            ["openssl"] + _command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+    return {_name: _file for _name, _file in _files.items() if _name != "ca_key"}
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """ One thread per connection, as each upload is a new connection. The TLS
+    handshake happens in that thread, so a plain TCP connectivity check (as the
+    uploader makes) does not hold up anyone else. """
+    daemon_threads = True
+    ssl_context = None
+    iot = None
+
+    def finish_request(self, request, client_address):
+        """ Handshake, then handle the request """
+        try:
+            _tls_request = self.ssl_context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
+        super().finish_request(_tls_request, client_address)
+
+class IoTServer():
+    """ HTTPS server accepting POSTs to /topics/<topic>, in a background thread """
+
+    def __init__(self, cert_dir, certificates, latency_s=0.0, failure_rate=0.0,
+                 messages_file=None):
+        """ latency_s is added to every response; failure_rate of them get a 503 """
+        self.latency_s = latency_s
+        self.failure_rate = failure_rate
+        self.messages_file = messages_file
+        self.server = _ThreadingHTTPServer(("127.0.0.1", 0), _IoTHandler)
+        self.server.iot = self
+        _context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        _context.load_cert_chain(
+            os.path.join(cert_dir, certificates["server_cert"]),
+            os.path.join(cert_dir, certificates["server_key"])
+        )
+        _context.load_verify_locations(os.path.join(cert_dir, certificates["ca"]))
+        _context.verify_mode = ssl.CERT_REQUIRED
+        self.server.ssl_context = _context
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def endpoint(self, topic):
+        """ URL to POST a topic's messages to """
+        return "https://localhost:" + str(self.port) + "/topics/" + topic
+
+    def start(self):
+        """ Start serving """
+        del MESSAGES[:]
+        self.thread.start()
+
+    def stop(self):
+        """ Stop serving """
+        self.server.shutdown()
+        self.server.server_close()
+
+class _IoTHandler(BaseHTTPRequestHandler):
+    """ Accepts JSON messages """
+
+    def do_POST(self):
+        """ Record the message, and acknowledge it as AWS IoT does """
+        # pylint: disable=invalid-name
+        _iot = self.server.iot
+        _body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if _iot.latency_s:
+            time.sleep(_iot.latency_s)
+        if random.random() < _iot.failure_rate:
+            self._respond(503, {"message": "Service Unavailable"})
+            return
+        try:
+            _payload = json.loads(_body)
+        except ValueError:
+            self._respond(400, {"message": "Invalid JSON"})
+            return
+        _message = (time.time(), self.path.split("/topics/", 1)[-1], _payload)
+        with _LOCK:
+            MESSAGES.append(_message)
+            if _iot.messages_file is not None:
+                _iot.messages_file.write(json.dumps(_message) + "\n")
+                _iot.messages_file.flush()
+        self._respond(200, {"message": "OK", "traceId": str(len(MESSAGES))})
+
+    def _respond(self, status, body):
+        """ JSON response """
+        _body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def log_message(self, format, *args):
+        """ Not worth a line per request """
+        # pylint: disable=redefined-builtin
+
+def main():
+    """ Serve until killed, writing the port to --port-file once listening """
+    _parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    _parser.add_argument("--cert-dir", required=True)
+    _parser.add_argument("--port-file", required=True)
+    _parser.add_argument("--messages-file", required=True)
+    _parser.add_argument("--latency-ms", type=float, default=0.0)
+    _parser.add_argument("--failure-rate", type=float, default=0.0)
+    _args = _parser.parse_args()
+    _certificates = {
+        "ca": "ca.pem", "server_cert": "server.pem", "server_key": "server.key",
+    }
+    with open(_args.messages_file, "w") as _messages_file:
+        _server = IoTServer(
+            _args.cert_dir, _certificates, _args.latency_ms / 1000.0, _args.failure_rate,
+            _messages_file
+        )
+        with open(_args.port_file + ".tmp", "w") as _port_file:
+            _port_file.write(str(_server.port))
+        os.replace(_args.port_file + ".tmp", _args.port_file)
+        try:
+            _server.server.serve_forever()
+        except KeyboardInterrupt:
+            sys.exit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+""" nrf24.py
+Stand-in for the nRF24 library used by riot-brick-rfproxy.py, for the brick
+simulator. Packets from trackers arrive at a configured rate (set with
+configure), encoded as tracker/main.py sends them. Each packet's sequence number
+is carried in the longitude decimals, and its arrival is recorded in CAPTURES as
+(dev_uid, sequence number, time).
+"""
+
+import time
+import random
+
+CAPTURES = []
+_CONFIG = {"rate": 0.0, "trackers": (1,), "shared_id": 23, "payload_size": 16, "bad_id_rate": 0.0}
+
+def configure(rate, trackers=(1,), shared_id=23, payload_size=16, bad_id_rate=0.0):
+    """ Packets per second (across all trackers), tracker dev_uids, and the
+    fraction of packets sent with the wrong shared id """
+    _CONFIG.update(
+        rate=float(rate), trackers=tuple(trackers), shared_id=shared_id,
+        payload_size=payload_size, bad_id_rate=bad_id_rate
+    )
+    del CAPTURES[:]
+
+def encode(shared_id, dev_uid, latitude, longitude_int, longitude_decimals):
+    """ Payload as tracker/main.py packs it: offset integer degrees, then the
+    decimal digits as an integer """
+    _lat_int = int(latitude)
+    _lat_decimals = int(str(latitude).split(".")[1][:6] or 0)
+    return (
+        bytes([shared_id, dev_uid, _lat_int + 90]) +
+        _lat_decimals.to_bytes(3, "big") +
+        (longitude_int + 180).to_bytes(2, "big") +
+        longitude_decimals.to_bytes(3, "big")
+    )
+
+class NRF24():
+    """ Receive side of an nRF24L01+ """
+    BR_250KBPS = 2
+    PA_MAX = 3
+
+    def __init__(self, major=0, minor=0, ce_pin=25, irq_pin=5):
+        """ Packets are scheduled from when the radio starts listening """
+        self.payload_size = 32
+        self.next_arrival = None
+        self.sequence = 0
+
+    def begin(self, major=0, minor=0, ce_pin=25, irq_pin=5):
+        """ Nothing to set up """
+
+    def setRetries(self, delay, count):
+        """ Not simulated """
+        # pylint: disable=invalid-name
+
+    def setPayloadSize(self, payload_size):
+        """ Size of payloads handed back by read """
+        # pylint: disable=invalid-name
+        self.payload_size = payload_size
+
+    def setChannel(self, channel):
+        """ Not simulated """
+        # pylint: disable=invalid-name
+
+    def setDataRate(self, data_rate):
+        """ Not simulated """
+        # pylint: disable=invalid-name
+
+    def setPALevel(self, pa_level):
+        """ Not simulated """
+        # pylint: disable=invalid-name
+
+    def setAutoAck(self, auto_ack):
+        """ Not simulated """
+        # pylint: disable=invalid-name
+
+    def openWritingPipe(self, pipe):
+        """ Not simulated """
+        # pylint: disable=invalid-name
+
+    def openReadingPipe(self, number, pipe):
+        """ Not simulated """
+        # pylint: disable=invalid-name
+
+    def startListening(self):
+        """ Packets start arriving """
+        # pylint: disable=invalid-name
+        if self.next_arrival is None:
+            self.next_arrival = time.time() + self._interval()
+
+    def stopListening(self):
+        """ Not simulated """
+        # pylint: disable=invalid-name
+
+    def printDetails(self):
+        """ Not simulated """
+        # pylint: disable=invalid-name
+
+    def available(self, pipe=None, irq_wait=False):
+        """ Whether the next packet has arrived """
+        # pylint: disable=unused-argument
+        return self.next_arrival is not None and time.time() >= self.next_arrival
+
+    def read(self, buffer, length=None):
+        """ Append the packet that has arrived to buffer """
+        # pylint: disable=unused-argument
+        self.sequence += 1
+        _dev_uid = _CONFIG["trackers"][self.sequence % len(_CONFIG["trackers"])]
+        _shared_id = _CONFIG["shared_id"]
+        if random.random() < _CONFIG["bad_id_rate"]:
+            _shared_id = (_shared_id + 1) % 256
+        else:
+            CAPTURES.append((_dev_uid, self.sequence, self.next_arrival))
+        # Sequence numbers end in 1, so they survive as float decimals
+        _packet = encode(_shared_id, _dev_uid, 51.884, -3, self.sequence * 10 + 1)
+        buffer.extend(_packet.ljust(self.payload_size, b"\x00"))
+        self.next_arrival += self._interval()
+
+    @staticmethod
+    def _interval():
+        """ Time to the next packet; none at all with a rate of 0 """
+        return 1.0 / _CONFIG["rate"] if _CONFIG["rate"] > 0 else float("inf")
@@ -0,0 +1,39 @@
+""" run_service.py
+Runs one of the brick scripts as its daemon would be run, against the
+stand-ins in this directory, for bench_pipeline.py --layouts. Nothing but the
+stand-ins is loaded besides the script, so the memory and CPU use of the
+process are the script's own. Stopped with SIGINT, as by Supervisor.
+python run_service.py riot-brick-runtime.py --rf-rate 10 --trackers 2
+"""
+
+import os
+import sys
+import runpy
+import argparse
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+BRICK_DIR = os.path.dirname(SIM_DIR)
+# Stand-ins first, so they are imported instead of the hardware libraries
+sys.path[0:0] = [SIM_DIR, BRICK_DIR]
+
+import gpsd
+import nrf24
+
+def main():
+    """ Set up the stand-ins, then run the script as __main__ """
+    _parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    _parser.add_argument("script", help="Brick script, e.g. riot-brick-sensors.py")
+    _parser.add_argument("--rf-rate", type=float, default=10.0,
+                         help="nRF24 packets per second, across all trackers")
+    _parser.add_argument("--trackers", type=int, default=2, help="Remote trackers")
+    _parser.add_argument("--bad-id-rate", type=float, default=0.0,
+                         help="Fraction of packets with the wrong shared id")
+    _args = _parser.parse_args()
+    gpsd.set_track(gpsd.default_track)
+    nrf24.configure(_args.rf_rate, list(range(1, _args.trackers + 1)),
+                    bad_id_rate=_args.bad_id_rate)
+    sys.argv = [_args.script]
+    runpy.run_path(os.path.join(BRICK_DIR, _args.script), run_name="__main__")
+
+if __name__ == "__main__":
+    main()
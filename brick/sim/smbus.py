@@ -0,0 +1,12 @@
+""" smbus.py
+Stand-in I2C bus for the brick simulator. The sensors on it (bh1750,
+Adafruit_BME280) are stand-ins too, so nothing is actually read.
+"""
+
+class SMBus():
+    """ I2C bus """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, bus_number):
+        """ Bus 1 on the Pi """
+        self.bus_number = bus_number
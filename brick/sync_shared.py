@@ -0,0 +1,37 @@
+""" sync_shared.py
+The brick runs copies of modules whose source is in aws-lambda/, so that the
+brick and the Lambda functions measure distances the same way. Edit them in
+aws-lambda/ only, then run this to copy them over. With --check, nothing is
+copied; it exits non-zero if a copy differs (e.g. before a commit, or in CI).
+brick/haversine.py shadows the haversine package from pip, which the brick
+used before. It keeps that package's haversine() and Unit.
+"""
+
+import os
+import sys
+import shutil
+import filecmp
+
+BRICK_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_DIR = os.path.join(os.path.dirname(BRICK_DIR), "aws-lambda")
+SHARED_FILES = ("haversine.py", "geoindex.py")
+
+def main():
+    """ Copy, or check, each shared module """
+    _check = "--check" in sys.argv[1:]
+    _differ = []
+    for _file_name in SHARED_FILES:
+        _source = os.path.join(SOURCE_DIR, _file_name)
+        _copy = os.path.join(BRICK_DIR, _file_name)
+        if os.path.exists(_copy) and filecmp.cmp(_source, _copy, shallow=False):
+            continue
+        if _check:
+            _differ.append(_file_name)
+            print("brick/" + _file_name + " differs from aws-lambda/" + _file_name)
+        else:
+            shutil.copyfile(_source, _copy)
+            print("Copied aws-lambda/" + _file_name + " to brick/" + _file_name)
+    sys.exit(1 if _differ else 0)
+
+if __name__ == "__main__":
+    main()
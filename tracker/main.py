@@ -4,25 +4,40 @@ Communicates with U-blox Neo-6 GPS receiver module using UART to
 obtain GPS location data. Then casually broadcasts it, using:
 
 1) LoRaWAN unconfirmed data up using Semtech SX127X LoRa transceiver
-2) 2.4GHz radio (slave mode) using Nordic Semiconductor nRF24L01
+2) 2.4GHz radio using Nordic Semiconductor nRF24L01, to a nearby brick (if enabled)
 
 Requires no acknowledgements. Device simply transitions in to deep sleep until
 it repeats the process all over again. Quite boring, really.
+
+Optionally, fixes can be batched: each one is held in RTC memory (which survives
+deep sleep) and several are sent together in a single LoRaWAN uplink.
+
+When the tracker is not moving (e.g. at base camp), transmissions are skipped and
+the deep sleep interval is stretched, until the tracker moves again.
 """
 
 # TODO: Flash some status LEDs, to instil some human confidence
-# TODO: nRF24L01 code not yet implemented
 # TODO: Should probably sync time via GPS as well
 
-from machine import UART, deepsleep    # pylint: disable=import-error
+from machine import UART, RTC, SPI, Pin, deepsleep  # pylint: disable=import-error
 import utime                                # pylint: disable=import-error
 import ubinascii                            # pylint: disable=import-error
 import ujson                                # pylint: disable=import-error
+from math import radians, cos, sqrt
 from micropyGPS import MicropyGPS           # pylint: disable=import-error
 from ulora import TTN, uLoRa                # pylint: disable=import-error
+from nrf24l01 import NRF24L01, POWER_3, SPEED_250K  # pylint: disable=import-error
 
 # Configuration parameters loaded from external json file
 TRACKER_CONFIG_FILE = "config/tracker_config.json"
+# Batched fix: 13 byte encoded fix followed by 2 byte age in seconds
+BATCH_RECORD_LENGTH = 15
+# Mean earth radius, for the (short range) stationary check
+EARTH_RADIUS_M = 6371008.8
+# nRF24L01 registers / bits not exposed by the driver's API
+NRF24_CONFIG = 0x00
+NRF24_PWR_UP = 0x02
+NRF24_SETUP_RETR = 0x04
 try:
     with open(TRACKER_CONFIG_FILE, "r") as config_file:
         TRACKER_CONFIG = ujson.load(config_file)
@@ -36,12 +51,29 @@ class Tracker():
     def __init__(self, tracker_config):
         """ Instantiate a tracker and its devices """
         self.general_config = tracker_config["GENERAL"]
-        self.lora_transceiver = LoraTransceiver(tracker_config["LORA"], tracker_config["LORAWAN"])
+        self.rtc_memory = RtcMemory()
+        self.lora_transceiver = LoraTransceiver(
+            tracker_config["LORA"],
+            tracker_config["LORAWAN"],
+            self.rtc_memory.state.get("frame_counter", 0)
+        )
         self.gps_receiver = GpsReceiver(tracker_config["GPS"])
+        self.nrf24_transceiver = None
+        if tracker_config.get("NRF24", {}).get("NRF24_ENABLED"):
+            self.nrf24_transceiver = Nrf24Transceiver(tracker_config["NRF24"])
+        # Number of fixes sent per uplink, capped by what fits in one LoRaWAN frame
+        self.batch_size = min(
+            self.general_config.get("BATCH_SIZE", 1),
+            tracker_config["LORAWAN"]["LORAWAN_MAX_PAYLOAD"] // BATCH_RECORD_LENGTH
+        )
+        # Number of consecutive cycles the tracker has not moved
+        self._stationary_count = self.rtc_memory.state.get("stationary", 0)
 
     def run(self):
         """ Run the tracker application once. """
         _start_time_ms = utime.ticks_ms()
+        # Time carried over deep sleeps, used to work out the age of batched fixes
+        _clock_ms = self.rtc_memory.state.get("clock_ms", 0)
         _errors = 0
         try:
             _gps_data = self.gps_receiver.get_gps_data()
@@ -52,20 +84,126 @@ class Tracker():
             _gps_data_bytes = self.gps_receiver.convert_to_bytes(_gps_data)
         # TODO: incorporate status LEDs here
         if not _errors:
-            try:
-                self.lora_transceiver.unconfirmed_data_up(_gps_data_bytes)
-            except (OSError, ValueError, RuntimeError, KeyError) as ex:
-                debug_console(ex)
-                _errors += 1
-            # TODO: nRF24L01 code needs to go here
+            _position = _signed_position(_gps_data)
+            _fix_clock_ms = _clock_ms + utime.ticks_ms() - _start_time_ms
+            if self._is_stationary(_position, _fix_clock_ms):
+                # No point counting any higher once the interval is at its cap
+                self._stationary_count = min(
+                    self._stationary_count + 1, self._stationary_count_cap()
+                )
+                debug_console(
+                    "Stationary for " + str(self._stationary_count) +
+                    " cycles, skipping transmit"
+                )
+            else:
+                try:
+                    self._transmit_lora(_gps_data_bytes, _fix_clock_ms)
+                except (OSError, ValueError, RuntimeError, KeyError) as ex:
+                    debug_console(ex)
+                    _errors += 1
+                if self.nrf24_transceiver and not self._transmit_nrf24(_gps_data_bytes):
+                    _errors += 1
+                self._record_transmitted_fix(_position, _fix_clock_ms)
         if _errors:
             debug_console("There are " + str(_errors) + " errors with the tracker")
         _time_elapsed_ms = utime.ticks_ms() - _start_time_ms
         # Deep sleep for the remaining time
-        _time_remaining_ms = self.general_config["TRACKER_FREQ_MS"]-_time_elapsed_ms
+        _time_remaining_ms = self._sleep_interval_ms() - _time_elapsed_ms
+        self.rtc_memory.state["clock_ms"] = \
+            _clock_ms + _time_elapsed_ms + max(_time_remaining_ms, 0)
+        self.rtc_memory.state["frame_counter"] = self.lora_transceiver.lora.frame_counter
+        self.rtc_memory.state["stationary"] = self._stationary_count
+        self.rtc_memory.save()
         debug_console("Deep sleep for " + str(_time_remaining_ms) + " ms...")
         deepsleep(_time_remaining_ms)
 
+    def _is_stationary(self, position, fix_clock_ms):
+        """ Tracker is stationary if it is still within the distance threshold
+        of the last transmitted fix. A fix is sent regardless once in a while,
+        so that the tracker is not reported as lost. """
+        _last_fix = self.rtc_memory.state.get("last_fix")
+        _threshold_m = self.general_config.get("STATIONARY_DISTANCE_M", 0)
+        if not _last_fix or _threshold_m <= 0:
+            return False
+        if fix_clock_ms - _last_fix[2] >= self.general_config["STATIONARY_HEARTBEAT_MS"]:
+            return False
+        return _distance_m(_last_fix[:2], position) <= _threshold_m
+
+    def _record_transmitted_fix(self, position, fix_clock_ms):
+        """ Remember the fix sent, and snap back to the base rate if moved """
+        _last_fix = self.rtc_memory.state.get("last_fix")
+        _threshold_m = self.general_config.get("STATIONARY_DISTANCE_M", 0)
+        if not _last_fix or _distance_m(_last_fix[:2], position) > _threshold_m:
+            self._stationary_count = 0
+        self.rtc_memory.state["last_fix"] = [position[0], position[1], fix_clock_ms]
+
+    def _sleep_interval_ms(self):
+        """ Base interval, stretched geometrically while stationary (up to a cap) """
+        _interval_ms = self.general_config["TRACKER_FREQ_MS"]
+        if self._stationary_count:
+            _interval_ms = min(
+                _interval_ms *
+                self.general_config["STATIONARY_BACKOFF"] ** self._stationary_count,
+                self.general_config["STATIONARY_MAX_FREQ_MS"]
+            )
+        return int(_interval_ms)
+
+    def _stationary_count_cap(self):
+        """ Stationary count at which the stretched interval reaches its cap """
+        _interval_ms = self.general_config["TRACKER_FREQ_MS"]
+        _max_interval_ms = self.general_config["STATIONARY_MAX_FREQ_MS"]
+        _backoff = self.general_config["STATIONARY_BACKOFF"]
+        _count = 1
+        while _backoff > 1 and _interval_ms * _backoff ** _count < _max_interval_ms:
+            _count += 1
+        return _count
+
+    def _transmit_lora(self, gps_data_bytes, fix_clock_ms):
+        """ Send the fix straight away, or hold it in RTC memory until there
+        are enough fixes to fill a batch. """
+        if self.batch_size <= 1:
+            self.lora_transceiver.unconfirmed_data_up(gps_data_bytes)
+            return
+        # Fixes left over from a failed uplink are kept, but only the newest
+        # ones that still fit in a single frame
+        _batch = self.rtc_memory.state.get("batch", [])[-(self.batch_size - 1):]
+        _batch.append([ubinascii.hexlify(gps_data_bytes).decode(), fix_clock_ms])
+        self.rtc_memory.state["batch"] = _batch
+        if len(_batch) < self.batch_size:
+            debug_console(
+                "Holding fix " + str(len(_batch)) + " of " + str(self.batch_size) +
+                " in RTC memory"
+            )
+            return
+        self.lora_transceiver.unconfirmed_data_up(self._encode_batch(_batch, fix_clock_ms))
+        self.rtc_memory.state["batch"] = []
+
+    def _transmit_nrf24(self, gps_data_bytes):
+        """ Send the fix to the brick, keeping an eye on how much awake time
+        it adds. Returns False if the send failed. """
+        _start_time_ms = utime.ticks_ms()
+        _sent = True
+        try:
+            self.nrf24_transceiver.send(gps_data_bytes)
+        except (OSError, ValueError) as ex:
+            debug_console(ex)
+            _sent = False
+        _time_elapsed_ms = utime.ticks_ms() - _start_time_ms
+        debug_console("nRF24 send took " + str(_time_elapsed_ms) + " ms")
+        if _time_elapsed_ms > self.nrf24_transceiver.nrf24_config["NRF24_BUDGET_MS"]:
+            debug_console("nRF24 send over budget")
+        return _sent
+
+    def _encode_batch(self, batch, send_clock_ms):
+        """ Concatenate batched fixes, each followed by its age in seconds. """
+        # pylint: disable=no-self-use
+        _data_bytes = b""
+        for _fix_hex, _fix_clock_ms in batch:
+            _age_s = min((send_clock_ms - _fix_clock_ms) // 1000, 0xFFFF)
+            _data_bytes += ubinascii.unhexlify(_fix_hex)
+            _data_bytes += _age_s.to_bytes(2, "big")
+        return _data_bytes
+
 class GpsReceiver():
     """ U-blox Neo-6 GPS receiver, accessible using UART. """
 
@@ -96,7 +234,8 @@ class GpsReceiver():
         while not self.gps_fix:
             for _data in self.uart.read():
                 self.gps.update(chr(_data))
-            if self.gps.fix_type != 1:
+            # The parser reports a fix type before it has a position to go with it
+            if self.gps.fix_type != 1 and _valid_position(self.gps):
                 self.gps_fix = True
                 _gps_data["latitude"] = self.gps.latitude
                 _gps_data["longitude"] = self.gps.longitude
@@ -128,9 +267,9 @@ class GpsReceiver():
         lat_int, lat_frac = str(gps_data["latitude"][0]).split(".")
         long_int, long_frac = str(gps_data["longitude"][0]).split(".")
         if gps_data["latitude"][1] == "S":
-            lat_int = -lat_int
+            lat_int = "-" + lat_int
         if gps_data["longitude"][1] == "W":
-            long_int = -long_int
+            long_int = "-" + long_int
         _data_bytes += (int(lat_int) + _lat_int_offset).to_bytes(1, "big")
         _data_bytes += (int(lat_frac[:_lat_long_offset])).to_bytes(3, "big")
         _data_bytes += (int(long_int) + _long_int_offset).to_bytes(2, "big")
@@ -144,9 +283,10 @@ class LoraTransceiver:
     """ Semtech SX1276 transceiver and the LoRaWAN protocol. """
     # pylint: disable=too-few-public-methods
 
-    def __init__(self, lora_config, lorawan_config):
+    def __init__(self, lora_config, lorawan_config, frame_counter=0):
         """ Initialise a ulora object with Semtech SX127X parameters and
-        LoRaWAN details """
+        LoRaWAN details. Frame counter is restored, as it must keep increasing
+        across deep sleeps. """
         self.lora = uLoRa(
             cs=lora_config["LORA_CS"],
             sck=lora_config["LORA_SCK"],
@@ -156,13 +296,14 @@ class LoraTransceiver:
             rst=lora_config["LORA_RST"],
             datarate=lora_config["LORA_DATARATE"],
             ttn_config=TTN(
-                dev_address=self._convert_to_bytearray(lorawan_config["LORAWAN_DEVADDR"]),
-                net_key=self._convert_to_bytearray(lorawan_config["LORAWAN_NWKEY"]),
-                app_key=self._convert_to_bytearray(lorawan_config["LORAWAN_APPKEY"]),
+                dev_address=_convert_to_bytearray(lorawan_config["LORAWAN_DEVADDR"]),
+                net_key=_convert_to_bytearray(lorawan_config["LORAWAN_NWKEY"]),
+                app_key=_convert_to_bytearray(lorawan_config["LORAWAN_APPKEY"]),
                 country=lorawan_config["LORAWAN_REGION"]
             ),
             fport=lorawan_config["LORAWAN_FPORT"]
         )
+        self.lora.frame_counter = frame_counter
 
     def unconfirmed_data_up(self, data):
         """ Send raw LoRaWAN raw packets using SX127X. """
@@ -171,14 +312,107 @@ class LoraTransceiver:
         debug_console("LoRa bytes sent: " + str(len(data)))
         self.lora.frame_counter += 1
 
-    def _convert_to_bytearray(self, str_list):
-        """ JSON byte arrays are stored as list of strings. Convert these into
-        real bytearray. """
-        # pylint: disable=no-self-use
-        _bytearray = []
-        for _byte_str in str_list:
-            _bytearray.append(int(_byte_str))
-        return bytearray(_bytearray)
+class Nrf24Transceiver:
+    """ Nordic Semiconductor nRF24L01+ transceiver, sending to the brick's
+    rfproxy. The radio is only powered up for the send itself. """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, nrf24_config):
+        """ Radio set-up is deferred until there is something to send """
+        self.nrf24_config = nrf24_config
+        # Sent as given, least significant byte first. The brick's pynrf24 reverses
+        # the address lists it is given, so this is its reading pipe backwards.
+        self.tx_pipe = bytes(_convert_to_bytearray(nrf24_config["NRF24_TX_PIPE"]))
+
+    def send(self, data):
+        """ Send shared id, device uid and data in a single fixed size payload.
+        Only the radio's own (bounded) retries are used; no waiting beyond them. """
+        _payload = bytes([self.nrf24_config["NRF24_SHARED_ID"], self.nrf24_config["NRF24_DEV_UID"]])
+        _payload += data
+        _padding = self.nrf24_config["NRF24_PAYLOAD_SIZE"] - len(_payload)
+        if _padding < 0:
+            raise ValueError("nRF24 payload too long: " + str(len(_payload)) + " bytes")
+        _payload += bytes(_padding)
+        debug_console("Sending nRF24 packet: " + str(ubinascii.hexlify(_payload)))
+        _radio = self._power_up()
+        try:
+            _radio.send(_payload, timeout=self.nrf24_config["NRF24_SEND_TIMEOUT_MS"])
+        finally:
+            # Driver leaves the radio powered up if the send timed out
+            _radio.reg_write(NRF24_CONFIG, _radio.reg_read(NRF24_CONFIG) & ~NRF24_PWR_UP)
+        debug_console("nRF24 bytes sent: " + str(len(_payload)))
+
+    def _power_up(self):
+        """ Initialise the radio, with settings matching the brick's receiver """
+        _radio = NRF24L01(
+            SPI(
+                self.nrf24_config["NRF24_SPI"],
+                sck=Pin(self.nrf24_config["NRF24_SCK"]),
+                mosi=Pin(self.nrf24_config["NRF24_MOSI"]),
+                miso=Pin(self.nrf24_config["NRF24_MISO"])
+            ),
+            Pin(self.nrf24_config["NRF24_CS"], Pin.OUT),
+            Pin(self.nrf24_config["NRF24_CE"], Pin.OUT),
+            channel=self.nrf24_config["NRF24_CHANNEL"],
+            payload_size=self.nrf24_config["NRF24_PAYLOAD_SIZE"]
+        )
+        _radio.set_power_speed(POWER_3, SPEED_250K)
+        # Auto retransmit delay (in 250us steps) and count
+        _radio.reg_write(
+            NRF24_SETUP_RETR,
+            (self.nrf24_config["NRF24_RETRY_DELAY"] << 4) | self.nrf24_config["NRF24_RETRY_COUNT"]
+        )
+        _radio.open_tx_pipe(self.tx_pipe)
+        return _radio
+
+class RtcMemory():
+    """ Tracker state kept in RTC slow memory as JSON. It survives deep sleep,
+    but not a power-on reset. """
+
+    def __init__(self):
+        """ Load any state left behind by the previous run """
+        self.rtc = RTC()
+        try:
+            self.state = ujson.loads(self.rtc.memory())
+        except ValueError:
+            self.state = {}
+
+    def save(self):
+        """ Write state back to RTC memory, ahead of deep sleep """
+        self.rtc.memory(ujson.dumps(self.state))
+
+def _convert_to_bytearray(str_list):
+    """ JSON byte arrays are stored as list of strings. Convert these into
+    real bytearray. """
+    _bytearray = []
+    for _byte_str in str_list:
+        _bytearray.append(int(_byte_str, 16))
+    return bytearray(_bytearray)
+
+def _valid_position(gps):
+    """ A position of exactly 0, 0 is what the parser holds until a sentence
+    supplies one (or after one reporting the fix lost), not a real fix. """
+    return bool(gps.latitude[0] or gps.longitude[0])
+
+def _signed_position(gps_data):
+    """ Convert GPS data (decimal degrees plus hemisphere) into signed
+    latitude and longitude. """
+    _latitude, _hemisphere = gps_data["latitude"][:2]
+    if _hemisphere == "S":
+        _latitude = -_latitude
+    _longitude, _hemisphere = gps_data["longitude"][:2]
+    if _hemisphere == "W":
+        _longitude = -_longitude
+    return (_latitude, _longitude)
+
+def _distance_m(position1, position2):
+    """ Equirectangular distance in metres. Accurate enough over the few tens of
+    metres the stationary check is interested in, and cheaper than haversine. """
+    _lat1, _long1 = radians(position1[0]), radians(position1[1])
+    _lat2, _long2 = radians(position2[0]), radians(position2[1])
+    _x = (_long2 - _long1) * cos((_lat1 + _lat2) / 2)
+    _y = _lat2 - _lat1
+    return EARTH_RADIUS_M * sqrt(_x * _x + _y * _y)
 
 def debug_console(print_message):
     """ Timestamped display to console for debugging purposes. """
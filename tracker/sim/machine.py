@@ -0,0 +1,150 @@
+""" machine.py
+Stand-in for MicroPython's machine module on the ESP32. The UART replays a
+recorded NMEA log at the GPS module's real baud rate, RTC memory survives
+deep sleep, and deep sleep itself hands control back to the simulator.
+"""
+
+import simenv
+
+# ESP32 RTC slow memory available to MicroPython's RTC.memory()
+RTC_MEMORY_SIZE = 2048
+# NMEA log to replay, as a list of 1 second epochs (bytes). Set by the simulator.
+NMEA_EPOCHS = []
+# Milliseconds into the NMEA log at which the virtual clock starts
+NMEA_OFFSET_MS = 0
+# Size of the UART receive buffer (MicroPython's default rxbuf)
+UART_RXBUF = 256
+
+_rtc_memory = b""
+
+class DeepSleep(BaseException):
+    """ Raised instead of sleeping, so the simulator can take over. Derives
+    from BaseException so that firmware error handling does not swallow it. """
+
+    def __init__(self, duration_ms):
+        """ Remember how long the firmware asked to sleep for """
+        super().__init__(duration_ms)
+        self.duration_ms = duration_ms
+
+class UART():
+    """ UART connected to a (simulated) GPS module """
+
+    def __init__(self, uart_id, baudrate=9600, **kwargs):
+        """ Start receiving from the moment the UART is created """
+        self.uart_id = uart_id
+        self.init(baudrate, **kwargs)
+
+    def init(self, baudrate=9600, **kwargs):
+        """ (Re)configure the UART. Pin and framing settings are ignored. """
+        # pylint: disable=unused-argument
+        self.baudrate = baudrate
+        self.rxbuf = kwargs.get("rxbuf", UART_RXBUF)
+        self.buffer = bytearray()
+        self.overflow_bytes = 0
+        self.last_ms = simenv.CLOCK.now_ms()
+
+    def any(self):
+        """ Number of bytes waiting in the receive buffer """
+        self._receive()
+        return len(self.buffer)
+
+    def read(self, nbytes=None):
+        """ Read waiting bytes. Like MicroPython, returns None if there are none. """
+        self._receive()
+        if not self.buffer:
+            return None
+        if nbytes is None:
+            nbytes = len(self.buffer)
+        _data = bytes(self.buffer[:nbytes])
+        del self.buffer[:nbytes]
+        return _data
+
+    def _receive(self):
+        """ Move bytes sent by the GPS module since last time into the receive
+        buffer. Bytes that arrive while the buffer is full are lost. """
+        _now_ms = simenv.CLOCK.now_ms()
+        if not NMEA_EPOCHS:
+            self.last_ms = _now_ms
+            return
+        _byte_ms = 10000.0 / self.baudrate
+        _start_ms = self.last_ms + NMEA_OFFSET_MS
+        _end_ms = _now_ms + NMEA_OFFSET_MS
+        for _epoch in range(int(_start_ms // 1000), int(_end_ms // 1000) + 1):
+            _sentences = NMEA_EPOCHS[_epoch % len(NMEA_EPOCHS)]
+            _epoch_ms = _epoch * 1000
+            # Bytes of this epoch whose last bit arrived within (_start_ms, _end_ms]
+            _first = max(0, int((_start_ms - _epoch_ms) // _byte_ms))
+            _last = min(len(_sentences), int((_end_ms - _epoch_ms) // _byte_ms))
+            if _first >= _last:
+                continue
+            _room = self.rxbuf - len(self.buffer)
+            _received = _sentences[_first:_last]
+            self.buffer += _received[:_room]
+            self.overflow_bytes += max(0, len(_received) - _room)
+        self.last_ms = _now_ms
+
+class Pin():
+    """ GPIO pin, only remembers its number and level """
+    # pylint: disable=too-few-public-methods
+    IN = 1
+    OUT = 3
+
+    def __init__(self, pin_id, mode=-1, pull=-1, value=0):
+        """ Same signature as MicroPython, mode and pull are ignored """
+        # pylint: disable=unused-argument
+        self.pin_id = pin_id
+        self.level = value
+
+    def value(self, level=None):
+        """ Read or set the level """
+        if level is None:
+            return self.level
+        self.level = level
+        return None
+
+    def __call__(self, level=None):
+        return self.value(level)
+
+    def init(self, *args, **kwargs):
+        """ Reconfigure, ignored """
+
+class SPI():
+    """ SPI bus. Devices on it are simulated at the driver level, so this
+    only needs to exist. """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, spi_id, baudrate=1000000, **kwargs):
+        """ Same signature as MicroPython, pins are ignored """
+        # pylint: disable=unused-argument
+        self.spi_id = spi_id
+        self.baudrate = baudrate
+
+    def init(self, baudrate=1000000, **kwargs):
+        """ Reconfigure """
+        # pylint: disable=unused-argument
+        self.baudrate = baudrate
+
+class RTC():
+    """ Real time clock, only its slow memory is simulated """
+
+    def memory(self, data=None):
+        """ Read, or replace, the contents of RTC memory """
+        global _rtc_memory  # pylint: disable=global-statement
+        if data is None:
+            return _rtc_memory
+        if isinstance(data, str):
+            data = data.encode()
+        if len(data) > RTC_MEMORY_SIZE:
+            raise ValueError("buffer too long")
+        _rtc_memory = bytes(data)
+        return None
+
+def deepsleep(duration_ms=0):
+    """ Hand over to the simulator, which decides what happens next """
+    simenv.record("deepsleep", duration_ms=duration_ms)
+    raise DeepSleep(duration_ms)
+
+def reset_rtc_memory():
+    """ Clear RTC memory, as a power-on reset would """
+    global _rtc_memory  # pylint: disable=global-statement
+    _rtc_memory = b""
@@ -0,0 +1,118 @@
+""" micropyGPS.py
+Minimal stand-in for the micropyGPS NMEA parser. Only understands the GGA, GSA
+and RMC sentences, and only the attributes the tracker uses. As in micropyGPS,
+both GGA and RMC update the position. Also records the
+moment a fix first becomes visible to the firmware, for time-to-fix reporting.
+"""
+
+import simenv
+
+class MicropyGPS():
+    """ Character fed NMEA parser, same interface as micropyGPS """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, local_offset=0, location_formatting="ddm"):
+        """ Start with no fix """
+        self.local_offset = local_offset
+        self.coord_format = location_formatting
+        self.sentence = ""
+        self.active = False
+        self.clean_sentences = 0
+        self.crc_fails = 0
+        self.latitude = [0.0, "N"]
+        self.longitude = [0.0, "W"]
+        self.altitude = 0.0
+        self.course = 0.0
+        self.satellites_in_use = 0
+        self.valid = False
+        self._fix_type = 1
+        self._fix_recorded = False
+
+    @property
+    def fix_type(self):
+        """ 1=no fix, 2=2D fix, 3=3D fix (from GSA) """
+        if self._fix_type != 1 and not self._fix_recorded:
+            self._fix_recorded = True
+            simenv.record("gps_fix", fix_type=self._fix_type)
+        return self._fix_type
+
+    def update(self, new_char):
+        """ Feed a single character. Returns the sentence type once a complete,
+        valid sentence has been parsed. """
+        if new_char == "$":
+            self.sentence = ""
+            self.active = True
+            return None
+        if not self.active:
+            return None
+        if new_char in "\r\n":
+            self.active = False
+            return self._parse(self.sentence)
+        self.sentence += new_char
+        if len(self.sentence) > 90:
+            self.active = False
+        return None
+
+    def _parse(self, sentence):
+        """ Check the checksum, then dispatch on sentence type """
+        if "*" not in sentence:
+            return None
+        _body, _checksum = sentence.rsplit("*", 1)
+        _crc = 0
+        for _char in _body:
+            _crc ^= ord(_char)
+        try:
+            if _crc != int(_checksum[:2], 16):
+                self.crc_fails += 1
+                return None
+        except ValueError:
+            self.crc_fails += 1
+            return None
+        _fields = _body.split(",")
+        _type = _fields[0][2:]
+        try:
+            if _type == "GGA":
+                self._gga(_fields)
+            elif _type == "GSA":
+                self._fix_type = int(_fields[2]) if _fields[2] else 1
+            elif _type == "RMC":
+                self._rmc(_fields)
+            else:
+                return None
+        except (ValueError, IndexError):
+            return None
+        self.clean_sentences += 1
+        return _fields[0]
+
+    def _gga(self, fields):
+        """ Position, altitude and satellites """
+        if int(fields[6] or 0) == 0:
+            return
+        self.latitude = self._coordinate(fields[2], fields[3], 2)
+        self.longitude = self._coordinate(fields[4], fields[5], 3)
+        self.satellites_in_use = int(fields[7] or 0)
+        self.altitude = float(fields[9] or 0)
+
+    def _rmc(self, fields):
+        """ Position and course, or (as micropyGPS does) position cleared if
+        the receiver reports its data invalid """
+        if fields[2] != "A":
+            self.latitude = self._coordinate("0000.0", "N", 2)
+            self.longitude = self._coordinate("00000.0", "W", 3)
+            self.course = 0.0
+            self.valid = False
+            return
+        if fields[4] not in ("N", "S") or fields[6] not in ("E", "W"):
+            raise ValueError("Invalid hemisphere")
+        self.latitude = self._coordinate(fields[3], fields[4], 2)
+        self.longitude = self._coordinate(fields[5], fields[6], 3)
+        self.course = float(fields[8]) if fields[8] else 0.0
+        self.valid = True
+
+    def _coordinate(self, value, hemisphere, degree_digits):
+        """ NMEA ddmm.mmmm into the configured format """
+        _degrees = int(value[:degree_digits])
+        _minutes = float(value[degree_digits:])
+        if self.coord_format == "dd":
+            return [round(_degrees + _minutes / 60, 6), hemisphere]
+        return [_degrees, _minutes, hemisphere]
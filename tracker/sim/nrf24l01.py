@@ -0,0 +1,128 @@
+""" nrf24l01.py
+Stand-in for MicroPython's nrf24l01 driver, transmit side only. Registers are
+kept in memory, and each send is simulated at the radio level: every attempt
+spends the frame's time on air plus the auto retransmit delay on the virtual
+clock, and is acknowledged with probability ACK_PROBABILITY.
+"""
+
+import random
+import simenv
+
+# pylint: disable=invalid-name
+POWER_0 = 0x00
+POWER_1 = 0x02
+POWER_2 = 0x04
+POWER_3 = 0x06
+SPEED_1M = 0x00
+SPEED_2M = 0x08
+SPEED_250K = 0x20
+
+CONFIG = 0x00
+SETUP_RETR = 0x04
+RF_SETUP = 0x06
+STATUS = 0x07
+PWR_UP = 0x02
+# Register values after the driver's own initialisation
+_INITIAL_REGISTERS = {CONFIG: 0x0C, SETUP_RETR: (6 << 4) | 8, RF_SETUP: POWER_3 | SPEED_250K}
+# Crystal oscillator start-up, power down to standby
+POWER_UP_MS = 1.5
+# Preamble, address, packet control field, CRC (payload excluded)
+FRAME_OVERHEAD_BITS = 8 + 40 + 9 + 16
+# ACK frame on the air, plus turnaround either side
+ACK_MS = 0.5
+
+# Chance of each attempt being acknowledged by the brick; set by the simulator
+ACK_PROBABILITY = 1.0
+RANDOM = random.Random(0)
+
+class NRF24L01():
+    """ Same interface as the MicroPython driver """
+
+    def __init__(self, spi, cs, ce, channel=46, payload_size=16):
+        """ Radio starts powered down """
+        self.spi = spi
+        self.cs = cs
+        self.ce = ce
+        self.channel = channel
+        self.payload_size = payload_size
+        self.registers = dict(_INITIAL_REGISTERS)
+        self.tx_address = None
+        self._result = None
+
+    def reg_read(self, reg):
+        """ Read a register """
+        return self.registers.get(reg, 0)
+
+    def reg_write(self, reg, value):
+        """ Write a register, noting power downs """
+        if reg == CONFIG and self.registers.get(CONFIG, 0) & PWR_UP and not value & PWR_UP:
+            simenv.record("radio_power_down", radio="nrf24")
+        self.registers[reg] = value
+        return 0
+
+    def set_power_speed(self, power, speed):
+        """ Transmit power and data rate """
+        self.registers[RF_SETUP] = power | speed
+
+    def set_crc(self, length):
+        """ CRC length, ignored """
+
+    def set_channel(self, channel):
+        """ RF channel """
+        self.channel = min(channel, 125)
+
+    def open_tx_pipe(self, address):
+        """ Address to send to (and receive ACKs on) """
+        assert len(address) == 5
+        self.tx_address = bytes(address)
+
+    def open_rx_pipe(self, pipe_id, address):
+        """ Not used when transmitting """
+
+    def send_start(self, buf):
+        """ Power up and transmit, working out the outcome up front """
+        self.reg_write(CONFIG, self.reg_read(CONFIG) | PWR_UP)
+        simenv.record("radio_power_up", radio="nrf24")
+        simenv.CLOCK.advance(POWER_UP_MS)
+        _delay_ms = ((self.registers[SETUP_RETR] >> 4) + 1) * 0.25
+        _max_attempts = (self.registers[SETUP_RETR] & 0x0F) + 1
+        _speed = self.registers[RF_SETUP] & (SPEED_2M | SPEED_250K)
+        _bits_per_ms = {SPEED_250K: 250, SPEED_1M: 1000, SPEED_2M: 2000}[_speed]
+        _frame_ms = (FRAME_OVERHEAD_BITS + 8 * self.payload_size) / _bits_per_ms
+        _attempts = 0
+        _acked = False
+        while not _acked and _attempts < _max_attempts:
+            _attempts += 1
+            _acked = RANDOM.random() < ACK_PROBABILITY
+        _duration_ms = _attempts * (_frame_ms + ACK_MS) + (_attempts - 1) * _delay_ms
+        simenv.record(
+            "frame",
+            radio="nrf24",
+            payload=bytes(buf).hex(),
+            payload_bytes=len(buf),
+            phy_bytes=_attempts * ((FRAME_OVERHEAD_BITS + 8 * self.payload_size) // 8),
+            attempts=_attempts,
+            acked=_acked,
+            airtime_ms=_attempts * _frame_ms
+        )
+        self._result = (simenv.CLOCK.now_ms() + _duration_ms, 1 if _acked else 2)
+
+    def send_done(self):
+        """ None while still sending, then 1 on success, 2 on failure """
+        _done_ms, _result = self._result
+        if simenv.CLOCK.now_ms() < _done_ms:
+            # Polling the status register over SPI takes a little while
+            simenv.CLOCK.advance(0.05)
+            return None
+        self.reg_write(CONFIG, self.reg_read(CONFIG) & ~PWR_UP)
+        return _result
+
+    def send(self, buf, timeout=500):
+        """ Blocking send, as in the MicroPython driver """
+        self.send_start(buf)
+        _start_ms = simenv.CLOCK.now_ms()
+        _result = None
+        while _result is None and simenv.CLOCK.now_ms() - _start_ms < timeout:
+            _result = self.send_done()
+        if _result == 2:
+            raise OSError("send failed")
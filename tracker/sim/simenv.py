@@ -0,0 +1,40 @@
+""" simenv.py
+Shared state for the stand-in MicroPython modules used by the tracker simulator:
+a virtual clock (so deep sleep and waits cost no real time) and a log of
+events of interest (boots, GPS fixes, radio frames, deep sleeps).
+"""
+
+import time
+
+class VirtualClock():
+    """ Millisecond clock that only moves when the firmware waits, plus the
+    host time actually spent running firmware code (scaled, to approximate a
+    slower CPU). """
+
+    def __init__(self, cpu_scale=1.0):
+        """ Start the clock at zero """
+        self.cpu_scale = cpu_scale
+        self.reset()
+
+    def reset(self):
+        """ Back to zero, e.g. between simulation runs """
+        self.virtual_ms = 0.0
+        self.anchor = time.perf_counter()
+
+    def now_ms(self):
+        """ Current time in milliseconds """
+        return self.virtual_ms + (time.perf_counter() - self.anchor) * 1000 * self.cpu_scale
+
+    def advance(self, duration_ms):
+        """ Move the clock on, without spending any host time """
+        if duration_ms > 0:
+            self.virtual_ms += duration_ms
+
+CLOCK = VirtualClock()
+EVENTS = []
+
+def record(event, **fields):
+    """ Timestamp and record an event for the harness to report on """
+    fields["event"] = event
+    fields["time_ms"] = CLOCK.now_ms()
+    EVENTS.append(fields)
@@ -0,0 +1,220 @@
+""" simulate.py
+Host-side simulator and benchmark harness for the tracker firmware. Runs
+tracker/main.py under CPython, against stand-in MicroPython modules found
+alongside this file:
+
+- machine: UART replaying a recorded NMEA log at real baud timing, RTC memory
+  that survives deep sleep, and deep sleep that hands back to the simulator
+- utime: virtual clock, so waits and deep sleep cost no real time
+- ulora: records LoRa frames and their time on air
+- nrf24l01: simulates nRF24 sends (with retries), and how long the radio is up
+- micropyGPS, ubinascii, ujson: minimal equivalents
+
+Every deep sleep ends the cycle; the next cycle re-runs main.py from scratch,
+just like a wake-up on the ESP32. Reports time-to-fix, awake time per cycle and
+bytes / time on air, as JSON for benchmarking in CI.
+
+Example:
+python tracker/sim/simulate.py --cycles 24 --set GENERAL.BATCH_SIZE=4 --json out.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import runpy
+import shutil
+import statistics
+import sys
+import tempfile
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+TRACKER_DIR = os.path.dirname(SIM_DIR)
+if SIM_DIR not in sys.path:
+    sys.path.insert(0, SIM_DIR)
+
+import simenv       # pylint: disable=wrong-import-position
+import machine      # pylint: disable=wrong-import-position
+import nrf24l01     # pylint: disable=wrong-import-position
+
+DEFAULT_CONFIG_FILE = os.path.join(TRACKER_DIR, "config", "tracker_config.json")
+DEFAULT_NMEA_FILE = os.path.join(SIM_DIR, "nmea", "pen_y_fan.nmea")
+
+def load_nmea_epochs(nmea_file):
+    """ Split a recorded NMEA log into 1 second epochs, each starting with a GGA
+    sentence (as u-blox receivers output them). """
+    _epochs = []
+    with open(nmea_file, "rb") as _nmea_file:
+        for _line in _nmea_file:
+            _line = _line.rstrip(b"\r\n") + b"\r\n"
+            if _line[3:6] == b"GGA" or not _epochs:
+                _epochs.append(b"")
+            _epochs[-1] += _line
+    return _epochs
+
+def apply_overrides(tracker_config, overrides):
+    """ Apply SECTION.KEY=VALUE overrides, VALUE being JSON (or a plain string) """
+    for _override in overrides:
+        _path, _value = _override.split("=", 1)
+        _section, _key = _path.split(".", 1)
+        try:
+            _value = json.loads(_value)
+        except ValueError:
+            pass
+        tracker_config[_section][_key] = _value
+    return tracker_config
+
+def run_simulation(tracker_config, nmea_epochs, cycles, cpu_scale=1.0, boot_ms=0,
+                   ack_probability=1.0, verbose=False):
+    """ Run the firmware for a number of wake / deep sleep cycles, and return
+    per cycle measurements. """
+    _work_dir = tempfile.mkdtemp(prefix="riot-tracker-sim-")
+    _cwd = os.getcwd()
+    os.makedirs(os.path.join(_work_dir, "config"))
+    with open(os.path.join(_work_dir, "config", "tracker_config.json"), "w") as _config_file:
+        json.dump(tracker_config, _config_file)
+    machine.NMEA_EPOCHS = nmea_epochs
+    machine.reset_rtc_memory()
+    nrf24l01.ACK_PROBABILITY = ack_probability
+    nrf24l01.RANDOM.seed(0)
+    simenv.CLOCK.cpu_scale = cpu_scale
+    simenv.CLOCK.reset()
+    del simenv.EVENTS[:]
+    _cycles = []
+    try:
+        os.chdir(_work_dir)
+        for _cycle in range(cycles):
+            _first_event = len(simenv.EVENTS)
+            simenv.record("boot", cycle=_cycle)
+            _sleep_ms = None
+            _console = io.StringIO()
+            try:
+                with contextlib.redirect_stdout(sys.stdout if verbose else _console):
+                    runpy.run_path(os.path.join(TRACKER_DIR, "main.py"), run_name="__main__")
+            except machine.DeepSleep as ex:
+                _sleep_ms = ex.duration_ms
+            _cycles.append(_summarise_cycle(_cycle, simenv.EVENTS[_first_event:], _sleep_ms))
+            if _sleep_ms is None:
+                # Firmware returned without sleeping; a real tracker would now sit idle
+                print("Cycle " + str(_cycle) + " ended without deep sleep:\n" +
+                      _console.getvalue(), file=sys.stderr)
+                break
+            simenv.CLOCK.advance(max(_sleep_ms, 0) + boot_ms)
+    finally:
+        os.chdir(_cwd)
+        shutil.rmtree(_work_dir, ignore_errors=True)
+    return _cycles
+
+def _summarise_cycle(cycle, events, sleep_ms):
+    """ Measurements for a single wake-up """
+    _boot_ms = events[0]["time_ms"]
+    _end_ms = events[-1]["time_ms"]
+    _fixes = [_event for _event in events if _event["event"] == "gps_fix"]
+    _frames = [_event for _event in events if _event["event"] == "frame"]
+    # Time the nRF24 radio was powered up for
+    _nrf24_ms = 0
+    for _event in events:
+        if _event["event"] == "radio_power_up":
+            _power_up_ms = _event["time_ms"]
+        elif _event["event"] == "radio_power_down":
+            _nrf24_ms += _event["time_ms"] - _power_up_ms
+    return {
+        "cycle": cycle,
+        "start_ms": round(_boot_ms, 1),
+        "awake_ms": round(_end_ms - _boot_ms, 1),
+        "time_to_fix_ms": round(_fixes[0]["time_ms"] - _boot_ms, 1) if _fixes else None,
+        "sleep_ms": sleep_ms,
+        "nrf24_ms": round(_nrf24_ms, 2),
+        "frames": [
+            {
+                "radio": _frame["radio"],
+                "payload": _frame["payload"],
+                "payload_bytes": _frame["payload_bytes"],
+                "phy_bytes": _frame["phy_bytes"],
+                "airtime_ms": round(_frame["airtime_ms"], 1),
+                "acked": _frame.get("acked"),
+            } for _frame in _frames
+        ],
+    }
+
+def summarise(cycles, nrf24_budget_ms=None):
+    """ Totals and averages across all cycles """
+    _awake = [_cycle["awake_ms"] for _cycle in cycles]
+    _fixes = [_cycle["time_to_fix_ms"] for _cycle in cycles if _cycle["time_to_fix_ms"] is not None]
+    _simulated_ms = sum(_cycle["awake_ms"] + max(_cycle["sleep_ms"] or 0, 0) for _cycle in cycles)
+    _hours = _simulated_ms / 3600000.0 if _simulated_ms else 0
+    _nrf24 = [_cycle["nrf24_ms"] for _cycle in cycles if _cycle["nrf24_ms"]]
+    _summary = {
+        "cycles": len(cycles),
+        "simulated_s": round(_simulated_ms / 1000.0, 1),
+        "fixes": len(_fixes),
+        "time_to_fix_ms_mean": round(statistics.mean(_fixes), 1) if _fixes else None,
+        "time_to_fix_ms_max": round(max(_fixes), 1) if _fixes else None,
+        "awake_ms_mean": round(statistics.mean(_awake), 1) if _awake else None,
+        "awake_ms_median": round(statistics.median(_awake), 1) if _awake else None,
+        "awake_ms_max": round(max(_awake), 1) if _awake else None,
+        "awake_duty_cycle_pct":
+            round(100.0 * sum(_awake) / _simulated_ms, 3) if _simulated_ms else None,
+        "nrf24_ms_mean": round(statistics.mean(_nrf24), 2) if _nrf24 else None,
+        "nrf24_ms_max": round(max(_nrf24), 2) if _nrf24 else None,
+        "nrf24_over_budget": len([_ms for _ms in _nrf24 if _ms > nrf24_budget_ms])
+                             if nrf24_budget_ms is not None else None,
+    }
+    for _radio in ("lora", "nrf24"):
+        _frames = [
+            _frame for _cycle in cycles for _frame in _cycle["frames"] if _frame["radio"] == _radio
+        ]
+        _summary[_radio] = {
+            "frames": len(_frames),
+            "payload_bytes": sum(_frame["payload_bytes"] for _frame in _frames),
+            "bytes_on_air": sum(_frame["phy_bytes"] for _frame in _frames),
+            "airtime_ms": round(sum(_frame["airtime_ms"] for _frame in _frames), 1),
+            "frames_per_hour": round(len(_frames) / _hours, 2) if _hours else None,
+        }
+    return _summary
+
+def main():
+    """ Command line entry point """
+    _parser = argparse.ArgumentParser(description="Simulate the tracker firmware on the host")
+    _parser.add_argument("--config", default=DEFAULT_CONFIG_FILE, help="tracker config JSON")
+    _parser.add_argument("--nmea", default=DEFAULT_NMEA_FILE, help="recorded NMEA log to replay")
+    _parser.add_argument("--cycles", type=int, default=12, help="wake-ups to simulate")
+    _parser.add_argument(
+        "--set", action="append", default=[], metavar="SECTION.KEY=VALUE",
+        help="override a config value, e.g. GENERAL.BATCH_SIZE=4"
+    )
+    _parser.add_argument(
+        "--cpu-scale", type=float, default=1.0,
+        help="multiply host time spent in firmware code (ESP32 is slower)"
+    )
+    _parser.add_argument("--boot-ms", type=float, default=0, help="time to boot after deep sleep")
+    _parser.add_argument(
+        "--ack-probability", type=float, default=1.0,
+        help="chance of each nRF24 attempt being acknowledged by the brick"
+    )
+    _parser.add_argument("--json", help="write full results to this file")
+    _parser.add_argument("--verbose", action="store_true", help="show the firmware console")
+    _args = _parser.parse_args()
+    with open(_args.config) as _config_file:
+        _tracker_config = apply_overrides(json.load(_config_file), _args.set)
+    _cycles = run_simulation(
+        _tracker_config,
+        load_nmea_epochs(_args.nmea),
+        _args.cycles,
+        cpu_scale=_args.cpu_scale,
+        boot_ms=_args.boot_ms,
+        ack_probability=_args.ack_probability,
+        verbose=_args.verbose
+    )
+    _results = {
+        "summary": summarise(_cycles, _tracker_config.get("NRF24", {}).get("NRF24_BUDGET_MS")),
+        "cycles": _cycles
+    }
+    print(json.dumps(_results["summary"], indent=2))
+    if _args.json:
+        with open(_args.json, "w") as _json_file:
+            json.dump(_results, _json_file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+""" ubinascii.py
+Stand-in for MicroPython's ubinascii.
+"""
+
+# pylint: disable=unused-import
+from binascii import hexlify, unhexlify, a2b_base64, b2a_base64
@@ -0,0 +1,6 @@
+""" ujson.py
+Stand-in for MicroPython's ujson.
+"""
+
+# pylint: disable=unused-import
+from json import dump, dumps, load, loads
@@ -0,0 +1,37 @@
+""" utime.py
+Stand-in for MicroPython's utime, driven by the simulator's virtual clock.
+"""
+
+import time as _time
+import simenv
+
+# Wall clock time the simulated tracker believes it starts at
+EPOCH_S = 1567296000
+
+def ticks_ms():
+    """ Milliseconds since (simulated) power on """
+    return int(simenv.CLOCK.now_ms())
+
+def ticks_diff(ticks1, ticks2):
+    """ Signed difference between two ticks values """
+    return ticks1 - ticks2
+
+def sleep_ms(duration_ms):
+    """ Sleep, on the virtual clock only """
+    simenv.CLOCK.advance(duration_ms)
+
+def sleep(duration_s):
+    """ Sleep, on the virtual clock only """
+    simenv.CLOCK.advance(duration_s * 1000)
+
+def time():
+    """ Seconds since epoch, as the simulated RTC sees it """
+    return EPOCH_S + int(simenv.CLOCK.now_ms() // 1000)
+
+def localtime(secs=None):
+    """ MicroPython style 8-tuple """
+    if secs is None:
+        secs = time()
+    _tm = _time.gmtime(secs)
+    return (_tm.tm_year, _tm.tm_mon, _tm.tm_mday, _tm.tm_hour, _tm.tm_min, _tm.tm_sec,
+            _tm.tm_wday, _tm.tm_yday)
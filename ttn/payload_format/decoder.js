@@ -1,16 +1,42 @@
+// Single fix: 13 bytes. Batched fixes: 15 bytes each (fix + 2 byte age in seconds)
+var FIX_LENGTH = 13;
+var BATCH_RECORD_LENGTH = 15;
+
+function DecodeFix(bytes, offset) {
+  // Decode a single 13 byte GPS fix, starting at offset
+  var fix = {};
+  var b = bytes.slice(offset, offset + FIX_LENGTH);
+  var latitude = Number((b[0] - 90).toString().concat(".", ((b[1] << 16) + (b[2] << 8) + b[3]).toString()));
+  var longitude = Number((((b[4] << 8) +  b[5]) - 180).toString().concat(".", ((b[6] << 16) + (b[7] << 8) + b[8]).toString()));
+  fix.location = latitude.toString().concat(",", longitude.toString());
+  fix.altitude = Number((b[9] << 8) +  b[10]);
+  fix.course = Number((b[11] << 8) +  b[12]) / 10;
+  return fix;
+}
+
 function Decoder(bytes, port) {
   // Decode an uplink message from a buffer
   // (array) of bytes to an object of fields.
   var decoded = {};
 
   if (port === 1) {
-    latitude = Number((bytes[0] - 90).toString().concat(".", ((bytes[1] << 16) + (bytes[2] << 8) + bytes[3]).toString()));
-    longitude = Number((((bytes[4] << 8) +  bytes[5]) - 180).toString().concat(".", ((bytes[6] << 16) + (bytes[7] << 8) + bytes[8]).toString()));
-    altitude = Number((bytes[9] << 8) +  bytes[10]);
-    course = Number((bytes[11] << 8) +  bytes[12]) / 10;
-    decoded.location = latitude.toString().concat(",", longitude.toString());
-    decoded.altitude = altitude;
-    decoded.course = course;
+    if (bytes.length === FIX_LENGTH) {
+      decoded = DecodeFix(bytes, 0);
+    } else {
+      // Batched uplink. Top level fields hold the newest fix, as before.
+      decoded.fixes = [];
+      for (var offset = 0; offset + BATCH_RECORD_LENGTH <= bytes.length; offset += BATCH_RECORD_LENGTH) {
+        var fix = DecodeFix(bytes, offset);
+        fix.age_s = (bytes[offset + FIX_LENGTH] << 8) + bytes[offset + FIX_LENGTH + 1];
+        decoded.fixes.push(fix);
+      }
+      if (decoded.fixes.length) {
+        var newest = decoded.fixes[decoded.fixes.length - 1];
+        decoded.location = newest.location;
+        decoded.altitude = newest.altitude;
+        decoded.course = newest.course;
+      }
+    }
   }
 
   return decoded;